@@ -116,6 +116,9 @@ DATABASES = {
     )
 }
 
+# Redis with live messages counts written by the bot, leave empty to read counts from the db only
+REDIS_URL = env.str("REDIS_URL", default="")
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -1,8 +1,14 @@
+from datetime import timedelta
+
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.template.defaultfilters import pluralize
 
 from grappelli.dashboard import modules, Dashboard
 
+from discord.models import Task
+from discord.utils import task_latency_stats
 from discord.constants import SETTINGS_SINGLETON_ID
 
 
@@ -24,6 +30,11 @@ class CustomIndexDashboard(Dashboard):
                         "url": "/discord/task/",
                         "external": False,
                     },
+                    {
+                        "title": _("Review impersonation suspects"),
+                        "url": "/discord/impersonationsuspect/?status__exact=PENDING",
+                        "external": False,
+                    },
                     {
                         "title": _("Settings"),
                         "url": f"/discord/settings/{SETTINGS_SINGLETON_ID}/change/",
@@ -33,6 +44,27 @@ class CustomIndexDashboard(Dashboard):
             )
         )
 
+        self.children.append(
+            modules.LinkList(
+                _("Task latency (last 24 hours)"),
+                column=1,
+                collapsible=False,
+                children=[
+                    {
+                        "title": (
+                            f"{Task.TaskPriorityChoices(stats['priority']).label}: "
+                            f"started after {stats['avg_wait'].total_seconds():.0f}s on average "
+                            f"({stats['max_wait'].total_seconds():.0f}s at most), "
+                            f"{stats['tasks_count']} task{pluralize(stats['tasks_count'])}"
+                        ),
+                        "url": f"/discord/task/?priority__exact={stats['priority']}",
+                        "external": False,
+                    }
+                    for stats in task_latency_stats(timezone.now() - timedelta(days=1))
+                ],
+            )
+        )
+
         self.children.append(
             modules.LinkList(
                 _("Resources"),
@@ -3,6 +3,8 @@ from io import StringIO
 
 from django.contrib import admin
 from django.contrib import messages
+from django.db import transaction
+from django.utils import timezone
 from django.utils.html import format_html
 from django.shortcuts import render
 from django.http import HttpResponseRedirect, StreamingHttpResponse
@@ -10,10 +12,20 @@ from django.utils.safestring import mark_safe
 from django.template.defaultfilters import pluralize
 
 from discord.forms import DiscordRoleForm
-from discord.models import DiscordMember, Task, Settings
+from discord.models import DiscordMember, DiscordRole, ImpersonationSuspect, Task, TaskMemberResult, Settings
 from discord.constants import SETTINGS_SINGLETON_ID
 
-from .utils import keyset_pagination_iterator
+from .cache import get_members_messages_count
+from .utils import humanize_readable_datetime, keyset_pagination_iterator, members_filter_spec, rescore_members
+
+
+def create_members_task(request, queryset, members_count, **kwargs):
+    # "select all" only stores the changelist filters, the bot resolves them in batches so the request stays fast
+    if request.POST.get("select_across") == "1":
+        members_filter = members_filter_spec(request.GET)
+        if members_filter is not None:
+            return Task.objects.create(members_filter=members_filter, members_count=members_count, **kwargs)
+    return Task.objects.create(members_ids=list(queryset.values_list("id", flat=True)), **kwargs)
 
 
 @admin.register(Settings)
@@ -30,13 +42,47 @@ class SettingsAdmin(admin.ModelAdmin):
     def has_delete_permission(self, request, obj=None):
         return False
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if any(field.startswith("engagement_score_") for field in form.changed_data):
+            members_count = rescore_members(obj.engagement_score_thresholds)
+            self.message_user(
+                request, f"Engagement score of {members_count} member{pluralize(members_count)} was recalculated"
+            )
+
+
+class CopiedAvatarFilter(admin.SimpleListFilter):
+    title = "copied avatar"
+    parameter_name = "copied_avatar"
+
+    def lookups(self, request, model_admin):
+        return [("yes", "Copies a protected member's avatar")]
+
+    def queryset(self, request, queryset):
+        if self.value() == "yes":
+            suspects = ImpersonationSuspect.objects.filter(
+                signal=ImpersonationSuspect.SuspectSignalChoices.AVATAR
+            ).exclude(status=ImpersonationSuspect.SuspectStatusChoices.DISMISSED)
+            return queryset.filter(id__in=suspects.values("member_id"))
+        return queryset
+
+
+class RoleFilter(admin.SimpleListFilter):
+    # filters on the denormalized roles ids through their GIN index instead of joining the role links
+    title = "roles"
+    parameter_name = "role"
+
+    def lookups(self, request, model_admin):
+        return DiscordRole.objects.values_list("id", "name")
+
+    def queryset(self, request, queryset):
+        if self.value() and self.value().isdigit():
+            return queryset.filter(roles_ids__contains=[int(self.value())])
+        return queryset
+
 
 @admin.register(DiscordMember)
 class DiscordMemberAdmin(admin.ModelAdmin):
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.prefetch_related("roles")
-
     fields = [
         "id",
         "avatar",
@@ -47,29 +93,77 @@ class DiscordMemberAdmin(admin.ModelAdmin):
         "pending",
         "engagement_score",
         "messages_count",
+        "engagement_score_7d",
+        "messages_count_7d",
+        "engagement_score_30d",
+        "messages_count_30d",
+        "engagement_score_90d",
+        "messages_count_90d",
         "premium_since",
         "joined_at",
         "created_at",
         "age_of_account",
     ]
     filter_horizontal = ["roles"]
-    readonly_fields = ["avatar"]
+    readonly_fields = ["avatar", "age_of_account"]
     list_display = [
         "username",
         "role",
         "engagement_score",
-        "messages_count",
+        "live_messages_count",
+        "messages_count_7d",
+        "messages_count_30d",
+        "messages_count_90d",
         "joined_at",
         "created_at",
         "age_of_account",
     ]
     ordering = ["joined_at"]
-    sortable_by = ["username", "bot", "engagement_score", "messages_count", "joined_at", "created_at"]
-    list_filter = ["roles", "engagement_score", "joined_at", "created_at", "pending", "bot"]
+    sortable_by = [
+        "username",
+        "bot",
+        "engagement_score",
+        "live_messages_count",
+        "messages_count_7d",
+        "messages_count_30d",
+        "messages_count_90d",
+        "joined_at",
+        "created_at",
+    ]
+    list_filter = [
+        RoleFilter,
+        "engagement_score",
+        "engagement_score_7d",
+        "engagement_score_30d",
+        "engagement_score_90d",
+        "joined_at",
+        "created_at",
+        "pending",
+        "bot",
+        CopiedAvatarFilter,
+    ]
     search_fields = ["name", "discriminator", "nick", "username"]
 
+    def get_changelist_instance(self, request):
+        cl = super().get_changelist_instance(request)
+        # read live messages counts for the whole page at once
+        live_messages_count = get_members_messages_count(obj.id for obj in cl.result_list)
+        for obj in cl.result_list:
+            obj.live_messages_count = live_messages_count.get(obj.id, obj.messages_count)
+        return cl
+
+    @admin.display(description="Role")
     def role(self, obj):
-        return ", ".join([_.name for _ in obj.roles.all()])
+        return obj.roles_names
+
+    @admin.display(description="Messages count", ordering="messages_count")
+    def live_messages_count(self, obj):
+        return getattr(obj, "live_messages_count", obj.messages_count)
+
+    @admin.display(description="Age of account", ordering="-created_at")
+    def age_of_account(self, obj):
+        # derived when displayed, a stored age would change every hour and make every member look changed to the sync
+        return humanize_readable_datetime(timezone.now(), obj.created_at)
 
     @admin.display()
     def avatar(self, obj):
@@ -118,9 +212,8 @@ class DiscordMemberAdmin(admin.ModelAdmin):
 
     @admin.action(description="Kick members from Discord")
     def kick_action(self, request, queryset):
-        members_ids = list(queryset.values_list("id", flat=True))
-        task = Task.objects.create(members_ids=members_ids, task_type=Task.TaskTypesChoices.KICK)
         members_count = queryset.count()
+        task = create_members_task(request, queryset, members_count, task_type=Task.TaskTypesChoices.KICK)
         self.message_user(
             request,
             mark_safe(
@@ -131,9 +224,8 @@ class DiscordMemberAdmin(admin.ModelAdmin):
 
     @admin.action(description="Ban members from Discord")
     def ban_action(self, request, queryset):
-        members_ids = list(queryset.values_list("id", flat=True))
-        task = Task.objects.create(members_ids=members_ids, task_type=Task.TaskTypesChoices.BAN)
         members_count = queryset.count()
+        task = create_members_task(request, queryset, members_count, task_type=Task.TaskTypesChoices.BAN)
         self.message_user(
             request,
             mark_safe(
@@ -150,9 +242,11 @@ class DiscordMemberAdmin(admin.ModelAdmin):
             form = DiscordRoleForm(request.POST)
             if form.is_valid():
                 role = form.cleaned_data["role"]
-                task = Task.objects.create(
+                task = create_members_task(
+                    request,
+                    queryset,
+                    members_count,
                     task_type=Task.TaskTypesChoices.ASSIGN_ROLE,
-                    members_ids=list(queryset.values_list("id", flat=True)),
                     roles_ids=[role.id],
                 )
                 self.message_user(
@@ -185,9 +279,11 @@ class DiscordMemberAdmin(admin.ModelAdmin):
             form = DiscordRoleForm(request.POST)
             if form.is_valid():
                 role = form.cleaned_data["role"]
-                task = Task.objects.create(
+                task = create_members_task(
+                    request,
+                    queryset,
+                    members_count,
                     task_type=Task.TaskTypesChoices.REMOVE_ROLE,
-                    members_ids=list(queryset.values_list("id", flat=True)),
                     roles_ids=[role.id],
                 )
                 self.message_user(
@@ -215,11 +311,88 @@ class DiscordMemberAdmin(admin.ModelAdmin):
 
 @admin.register(Task)
 class TaskAdmin(admin.ModelAdmin):
-    list_display = ["__str__", "created_at"]
-    list_filter = ["status", "task_type"]
+    list_display = ["__str__", "priority", "progress", "failed_count", "skipped_count", "created_at"]
+    list_filter = ["status", "task_type", "priority"]
+    readonly_fields = ["progress"]
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display()
+    def progress(self, obj):
+        if not obj.members_count:
+            return "-"
+        return f"{obj.processed_count}/{obj.members_count} ({obj.processed_count * 100 // obj.members_count}%)"
+
+    actions = ["retry_failed_action"]
+
+    @admin.action(description="Retry failed members")
+    def retry_failed_action(self, request, queryset):
+        tasks = queryset.filter(status=Task.TaskStatusChoices.FAILED)
+        for task in tasks:
+            # members with a successful result are skipped when the task runs again
+            with transaction.atomic():
+                task.results.filter(
+                    status__in=[
+                        TaskMemberResult.TaskMemberResultStatusChoices.FORBIDDEN,
+                        TaskMemberResult.TaskMemberResultStatusChoices.ERROR,
+                    ]
+                ).delete()
+                task.processed_count = task.results.count()
+                task.failed_count = 0
+                task.cursor = 0
+                task.locked_by = None
+                task.locked_until = None
+                task.queued_at = timezone.now()
+                task.finished_at = None
+                task.error = None
+                task.status = Task.TaskStatusChoices.IN_QUEUE
+                task.save()
+        tasks_count = len(tasks)
+        self.message_user(
+            request,
+            f"{tasks_count} failed task{pluralize(tasks_count)} will be retried shortly",
+            level=messages.SUCCESS,
+        )
+
+
+@admin.register(ImpersonationSuspect)
+class ImpersonationSuspectAdmin(admin.ModelAdmin):
+    list_display = ["name", "nick", "protected_name", "signal", "distance", "score", "status", "created_at"]
+    list_filter = ["status", "signal", "protected_name"]
+    search_fields = ["name", "nick", "=member_id"]
 
     def has_add_permission(self, request, obj=None):
         return False
 
     def has_change_permission(self, request, obj=None):
         return False
+
+    actions = ["ban_action", "dismiss_action"]
+
+    @admin.action(description="Ban selected suspects")
+    def ban_action(self, request, queryset):
+        members_ids = list(queryset.values_list("member_id", flat=True).distinct())
+        task = Task.objects.create(members_ids=members_ids, task_type=Task.TaskTypesChoices.BAN)
+        queryset.update(status=ImpersonationSuspect.SuspectStatusChoices.BANNED)
+        members_count = len(members_ids)
+        self.message_user(
+            request,
+            mark_safe(
+                f"{members_count} member{pluralize(members_count)} will be banned shortly, "
+                f"<a href='/discord/task/{task.id}/change/'>track progress here</a>"
+            ),
+            level=messages.SUCCESS,
+        )
+
+    @admin.action(description="Dismiss selected suspects")
+    def dismiss_action(self, request, queryset):
+        suspects_count = queryset.update(status=ImpersonationSuspect.SuspectStatusChoices.DISMISSED)
+        self.message_user(
+            request,
+            f"{suspects_count} suspect{pluralize(suspects_count)} dismissed, they will not be banned automatically",
+            level=messages.SUCCESS,
+        )
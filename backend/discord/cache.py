@@ -0,0 +1,33 @@
+from typing import Dict, Iterable
+
+import redis
+from django.conf import settings
+
+from discord.constants import CACHE_PREFIX, CACHE_SEPARATOR
+
+_client = None
+
+
+def get_client():
+    # cache is optional, leave REDIS_URL empty to disable it
+    global _client
+    if _client is None and settings.REDIS_URL:
+        _client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _client
+
+
+def member_key(member_id: int) -> str:
+    return f"{CACHE_PREFIX}member{CACHE_SEPARATOR}{member_id}"
+
+
+def get_members_messages_count(member_ids: Iterable[int]) -> Dict[int, int]:
+    """Read live messages counts written by the bot, members missing in the cache are omitted"""
+    client = get_client()
+    member_ids = list(member_ids)
+    if client is None or not member_ids:
+        return {}
+    try:
+        values = client.mget([member_key(_) for _ in member_ids])
+    except redis.RedisError:
+        return {}  # fall back to counts stored in the db
+    return {member_id: int(value) for member_id, value in zip(member_ids, values) if value is not None}
@@ -1 +1,4 @@
 SETTINGS_SINGLETON_ID = 1
+CACHE_PREFIX = "message:"
+CACHE_SEPARATOR = "-"
+TASKS_NOTIFY_CHANNEL = "discord_tasks"  # NOTIFY channel announcing queued tasks
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0002_remove_discordmember_raw_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelScan',
+            fields=[
+                ('channel_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('last_message_id', models.BigIntegerField(blank=True, null=True)),
+                ('messages_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChannelMessagesCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_id', models.BigIntegerField()),
+                ('member_id', models.BigIntegerField(db_index=True)),
+                ('messages_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('channel_id', 'member_id')},
+            },
+        ),
+    ]
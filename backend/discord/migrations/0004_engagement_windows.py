@@ -0,0 +1,55 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0003_channelscan_channelmessagescount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmember',
+            name='engagement_score_30d',
+            field=models.IntegerField(choices=[(0, '0'), (1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5')], default=0),
+        ),
+        migrations.AddField(
+            model_name='discordmember',
+            name='engagement_score_7d',
+            field=models.IntegerField(choices=[(0, '0'), (1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5')], default=0),
+        ),
+        migrations.AddField(
+            model_name='discordmember',
+            name='engagement_score_90d',
+            field=models.IntegerField(choices=[(0, '0'), (1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5')], default=0),
+        ),
+        migrations.AddField(
+            model_name='discordmember',
+            name='messages_count_30d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discordmember',
+            name='messages_count_7d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discordmember',
+            name='messages_count_90d',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MemberMessagesBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_id', models.BigIntegerField()),
+                ('day', models.DateField(db_index=True)),
+                ('messages_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('member_id', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0004_engagement_windows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='settings',
+            name='engagement_score_1_threshold',
+            field=models.IntegerField(default=1, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='settings',
+            name='engagement_score_2_threshold',
+            field=models.IntegerField(default=11, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='settings',
+            name='engagement_score_3_threshold',
+            field=models.IntegerField(default=21, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='settings',
+            name='engagement_score_4_threshold',
+            field=models.IntegerField(default=31, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+        migrations.AddField(
+            model_name='settings',
+            name='engagement_score_5_threshold',
+            field=models.IntegerField(default=51, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0005_engagement_score_thresholds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='cursor',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='failed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='members_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='processed_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='TaskMemberResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_id', models.BigIntegerField()),
+                ('status', models.CharField(choices=[('DONE', 'Done'), ('NOT_FOUND', 'Not Found'), ('FORBIDDEN', 'Forbidden'), ('ERROR', 'Error')], max_length=255)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='discord.task')),
+            ],
+            options={
+                'unique_together': {('task', 'member_id')},
+            },
+        ),
+        migrations.RunSQL(
+            "UPDATE discord_task SET members_count = jsonb_array_length(members_ids)",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0006_task_member_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='locked_by',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
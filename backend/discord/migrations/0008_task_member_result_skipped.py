@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0007_task_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskmemberresult',
+            name='status',
+            field=models.CharField(choices=[('DONE', 'Done'), ('NOT_FOUND', 'Not Found'), ('FORBIDDEN', 'Forbidden'), ('ERROR', 'Error'), ('SKIPPED', 'Skipped')], max_length=255),
+        ),
+    ]
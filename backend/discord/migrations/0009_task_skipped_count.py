@@ -0,0 +1,23 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0008_task_member_result_skipped'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='skipped_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='taskmemberresult',
+            name='status',
+            field=models.CharField(choices=[('DONE', 'Done'), ('NOT_FOUND', 'Not Found'), ('FORBIDDEN', 'Forbidden'), ('ERROR', 'Error'), ('SKIPPED', 'Skipped'), ('UNCHANGED', 'Unchanged')], max_length=255),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0009_task_skipped_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='priority',
+            field=models.SmallIntegerField(choices=[(0, 'High'), (1, 'Normal')], default=1),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='queued_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunSQL(
+            [
+                "UPDATE discord_task SET priority = 0 WHERE task_type IN ('KICK', 'BAN')",
+                "UPDATE discord_task SET queued_at = created_at",
+            ],
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:31
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0010_task_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='members_ids_array',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None),
+            preserve_default=False,
+        ),
+        # jsonb can not be cast to bigint[] with ALTER COLUMN ... USING, ids are copied into a new column instead
+        migrations.RunSQL(
+            "UPDATE discord_task SET members_ids_array = "
+            "ARRAY(SELECT jsonb_array_elements_text(members_ids)::bigint)",
+            "UPDATE discord_task SET members_ids = to_jsonb(members_ids_array)",
+        ),
+        migrations.RemoveField(
+            model_name='task',
+            name='members_ids',
+        ),
+        migrations.RenameField(
+            model_name='task',
+            old_name='members_ids_array',
+            new_name='members_ids',
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:26
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0011_task_members_ids_array'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='members_query',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='members_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None),
+        ),
+    ]
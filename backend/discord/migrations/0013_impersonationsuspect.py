@@ -0,0 +1,32 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0012_task_members_query'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpersonationSuspect',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_id', models.BigIntegerField()),
+                ('name', models.CharField(max_length=255)),
+                ('nick', models.CharField(blank=True, max_length=255, null=True)),
+                ('protected_name', models.CharField(max_length=255)),
+                ('distance', models.IntegerField()),
+                ('score', models.FloatField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('BANNED', 'Banned'), ('DISMISSED', 'Dismissed')], default='PENDING', max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'unique_together': {('member_id', 'protected_name')},
+            },
+        ),
+    ]
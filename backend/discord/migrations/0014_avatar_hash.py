@@ -0,0 +1,30 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0013_impersonationsuspect'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvatarHash',
+            fields=[
+                ('avatar', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('phash', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='impersonationsuspect',
+            name='signal',
+            field=models.CharField(choices=[('NAME', 'Name'), ('AVATAR', 'Avatar')], default='NAME', max_length=255),
+        ),
+        migrations.AlterUniqueTogether(
+            name='impersonationsuspect',
+            unique_together={('member_id', 'protected_name', 'signal')},
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:36
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0014_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discordmember',
+            name='roles_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='discordmember',
+            name='roles_names',
+            field=models.TextField(blank=True, default=''),
+        ),
+        # filled from the role links once, the bot keeps them up to date afterwards
+        migrations.RunSQL(
+            """
+            UPDATE discord_discordmember AS m SET roles_ids = s.roles_ids, roles_names = s.roles_names
+            FROM (
+                SELECT l.discordmember_id,
+                       array_agg(r.id ORDER BY r.id) AS roles_ids,
+                       string_agg(r.name, ', ' ORDER BY r.position DESC) AS roles_names
+                FROM discord_discordmember_roles AS l
+                JOIN discord_discordrole AS r ON r.id = l.discordrole_id
+                GROUP BY l.discordmember_id
+            ) AS s
+            WHERE s.discordmember_id = m.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='discordmember',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['roles_ids'], name='discord_dis_roles_i_2254dd_gin'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.4 on 2026-10-17 19:48
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0015_member_roles_ids'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='discordmember',
+            name='age_of_account',
+        ),
+    ]
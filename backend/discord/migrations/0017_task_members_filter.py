@@ -0,0 +1,29 @@
+# Generated by Django 3.2.4 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0016_remove_discordmember_age_of_account'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='members_filter',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        # stored SQL is not run anymore, tasks still waiting for their members have to be queued again
+        migrations.RunSQL(
+            "UPDATE discord_task SET status = 'FAILED', locked_by = NULL, locked_until = NULL, finished_at = now(), "
+            "error = 'Members of \"select all\" tasks are now resolved from filters, run the action again' "
+            "WHERE members_query IS NOT NULL AND status IN ('IN_QUEUE', 'STARTED')",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='task',
+            name='members_query',
+        ),
+    ]
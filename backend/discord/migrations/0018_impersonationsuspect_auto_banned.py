@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2026-10-17 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('discord', '0017_task_members_filter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='impersonationsuspect',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('BANNED', 'Banned'), ('AUTO_BANNED', 'Auto Banned'), ('DISMISSED', 'Dismissed')], default='PENDING', max_length=255),
+        ),
+    ]
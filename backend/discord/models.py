@@ -1,6 +1,12 @@
-from django.db import models
+from django.db import models, connection, transaction
+from django.utils import timezone
+from django.core.exceptions import ValidationError
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import MaxValueValidator, MinValueValidator
 
+from discord.constants import TASKS_NOTIFY_CHANNEL
+
 
 class Settings(models.Model):
     """Settings singleton table"""
@@ -8,6 +14,12 @@ class Settings(models.Model):
     delete_message_days_when_banned = models.IntegerField(
         default=1, validators=[MinValueValidator(0), MaxValueValidator(7)]
     )
+    # minimal messages count for every engagement score
+    engagement_score_1_threshold = models.IntegerField(default=1, validators=[MinValueValidator(1)])
+    engagement_score_2_threshold = models.IntegerField(default=11, validators=[MinValueValidator(1)])
+    engagement_score_3_threshold = models.IntegerField(default=21, validators=[MinValueValidator(1)])
+    engagement_score_4_threshold = models.IntegerField(default=31, validators=[MinValueValidator(1)])
+    engagement_score_5_threshold = models.IntegerField(default=51, validators=[MinValueValidator(1)])
 
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
@@ -20,6 +32,21 @@ class Settings(models.Model):
     def __str__(self):
         return str(self.pk)
 
+    @property
+    def engagement_score_thresholds(self):
+        return (
+            self.engagement_score_1_threshold,
+            self.engagement_score_2_threshold,
+            self.engagement_score_3_threshold,
+            self.engagement_score_4_threshold,
+            self.engagement_score_5_threshold,
+        )
+
+    def clean(self):
+        thresholds = self.engagement_score_thresholds
+        if any(lower >= higher for lower, higher in zip(thresholds, thresholds[1:])):
+            raise ValidationError("Engagement score thresholds should be strictly increasing")
+
 
 class DiscordRole(models.Model):
     """Discord role table"""
@@ -55,9 +82,18 @@ class DiscordMember(models.Model):
     discriminator = models.CharField(max_length=255)
     engagement_score = models.IntegerField(default=0, choices=EngagementScoreChoices.choices)  # db denormalization
     messages_count = models.IntegerField(default=0)
-    age_of_account = models.CharField(max_length=255)  # a little bit of db denormalization
+    # rolling windows over daily messages buckets, maintained by the bot
+    messages_count_7d = models.IntegerField(default=0)
+    messages_count_30d = models.IntegerField(default=0)
+    messages_count_90d = models.IntegerField(default=0)
+    engagement_score_7d = models.IntegerField(default=0, choices=EngagementScoreChoices.choices)
+    engagement_score_30d = models.IntegerField(default=0, choices=EngagementScoreChoices.choices)
+    engagement_score_90d = models.IntegerField(default=0, choices=EngagementScoreChoices.choices)
     nick = models.CharField(max_length=255, blank=True, null=True)
     roles = models.ManyToManyField(DiscordRole, related_name="members", blank=True)
+    # roles denormalized by the bot sync, the changelist filters and displays them without joining roles
+    roles_ids = ArrayField(models.BigIntegerField(), default=list, blank=True)
+    roles_names = models.TextField(default="", blank=True)  # names by position, as displayed in Discord
     pending = models.BooleanField(default=False)
     premium_since = models.DateTimeField(blank=True, null=True)
     joined_at = models.DateTimeField(blank=True, null=True)
@@ -65,11 +101,54 @@ class DiscordMember(models.Model):
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [GinIndex(fields=["roles_ids"])]
 
     def __str__(self):
         return self.username
 
 
+class ChannelScan(models.Model):
+    """Channel history scan progress table"""
+
+    channel_id = models.BigIntegerField(primary_key=True)
+    last_message_id = models.BigIntegerField(blank=True, null=True)  # high-water mark of the history scan
+    messages_count = models.IntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return str(self.channel_id)
+
+
+class ChannelMessagesCount(models.Model):
+    """Messages count per channel and member table"""
+
+    channel_id = models.BigIntegerField()
+    member_id = models.BigIntegerField(db_index=True)
+    messages_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ["channel_id", "member_id"]
+
+    def __str__(self):
+        return f"{self.channel_id} - {self.member_id}"
+
+
+class MemberMessagesBucket(models.Model):
+    """Daily messages count per member table"""
+
+    member_id = models.BigIntegerField()
+    day = models.DateField(db_index=True)
+    messages_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ["member_id", "day"]
+
+    def __str__(self):
+        return f"{self.member_id} - {self.day}"
+
+
 class Task(models.Model):
     """Task table"""
 
@@ -85,11 +164,29 @@ class Task(models.Model):
         FINISHED = "FINISHED"  # Task finished
         FAILED = "FAILED"  # Task failed
 
+    class TaskPriorityChoices(models.IntegerChoices):
+        HIGH = 0  # Security actions (kick, ban), run before anything else
+        NORMAL = 1  # Role changes
+
     task_type = models.CharField(choices=TaskTypesChoices.choices, max_length=255)
-    members_ids = models.JSONField()  # list of members ids
+    members_ids = ArrayField(models.BigIntegerField(), default=list, blank=True)  # bigint[] is far smaller than json
+    # "select all" actions store the changelist filters instead, the bot builds the query selecting members from them
+    members_filter = models.JSONField(blank=True, null=True)
     roles_ids = models.JSONField(default=list, blank=True)  # list of roles ids
     status = models.CharField(default=TaskStatusChoices.IN_QUEUE, choices=TaskStatusChoices.choices, max_length=255)
     error = models.TextField(blank=True, null=True)
+    members_count = models.IntegerField(default=0)
+    processed_count = models.IntegerField(default=0)  # members with a result in the ledger
+    failed_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)  # members left untouched because no API call was needed
+    cursor = models.IntegerField(default=0)  # every member before this position in members_ids has a result
+    locked_by = models.CharField(max_length=255, blank=True, null=True)  # worker holding the lease of a started task
+    locked_until = models.DateTimeField(blank=True, null=True)
+    priority = models.SmallIntegerField(choices=TaskPriorityChoices.choices, default=TaskPriorityChoices.NORMAL)
+    # order within the priority class, renewed when a large task goes back to the queue after a slice
+    queued_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
@@ -99,3 +196,87 @@ class Task(models.Model):
 
     def __str__(self):
         return f"{self.task_type} - {self.status} ({self.created_at})"
+
+    def save(self, *args, **kwargs):
+        if self.members_filter is None:
+            self.members_count = len(self.members_ids)
+        if self._state.adding and self.task_type in [self.TaskTypesChoices.KICK, self.TaskTypesChoices.BAN]:
+            self.priority = self.TaskPriorityChoices.HIGH
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.status == self.TaskStatusChoices.IN_QUEUE:
+                # wake up the bot, postgres delivers the notification once the task is committed
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", [TASKS_NOTIFY_CHANNEL, str(self.id)])
+
+
+class TaskMemberResult(models.Model):
+    """Outcome of a task action per member, lets an interrupted task resume where it stopped"""
+
+    class TaskMemberResultStatusChoices(models.TextChoices):
+        DONE = "DONE"  # Action applied
+        NOT_FOUND = "NOT_FOUND"  # Member left the guild
+        FORBIDDEN = "FORBIDDEN"  # Bot is not allowed to act on member
+        ERROR = "ERROR"  # Action failed
+        SKIPPED = "SKIPPED"  # Superseded by a kick or ban of the same member
+        UNCHANGED = "UNCHANGED"  # Member already had the requested roles
+
+    task = models.ForeignKey(Task, on_delete=models.CASCADE, related_name="results")
+    member_id = models.BigIntegerField()
+    status = models.CharField(choices=TaskMemberResultStatusChoices.choices, max_length=255)
+    error = models.TextField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ["task", "member_id"]
+
+    def __str__(self):
+        return f"{self.task_id} - {self.member_id} - {self.status}"
+
+
+class ImpersonationSuspect(models.Model):
+    """Members whose name or avatar is close to a protected one, reviewed by a moderator unless banned automatically"""
+
+    class SuspectStatusChoices(models.TextChoices):
+        PENDING = "PENDING"  # Waiting for a moderator review
+        BANNED = "BANNED"  # Confirmed impersonator
+        AUTO_BANNED = "AUTO_BANNED"  # Banned without review, the score is above the auto-ban threshold
+        DISMISSED = "DISMISSED"  # Legitimate name
+
+    class SuspectSignalChoices(models.TextChoices):
+        NAME = "NAME"  # Name or nick close to a protected name
+        AVATAR = "AVATAR"  # Avatar close to the avatar of a protected member
+
+    member_id = models.BigIntegerField()
+    name = models.CharField(max_length=255)
+    nick = models.CharField(max_length=255, blank=True, null=True)
+    protected_name = models.CharField(max_length=255)
+    signal = models.CharField(default=SuspectSignalChoices.NAME, choices=SuspectSignalChoices.choices, max_length=255)
+    # edit distance between normalized names, or number of differing bits between avatar hashes
+    distance = models.IntegerField()
+    score = models.FloatField()  # 1 for an exact copy, lower with every difference
+    status = models.CharField(
+        default=SuspectStatusChoices.PENDING, choices=SuspectStatusChoices.choices, max_length=255
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    modified_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ["member_id", "protected_name", "signal"]
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.name} - {self.protected_name}"
+
+
+class AvatarHash(models.Model):
+    """Perceptual hashes of avatars by Discord avatar hash, filled by the bot"""
+
+    avatar = models.CharField(max_length=255, primary_key=True)
+    phash = models.BigIntegerField()  # 64 bits difference hash, stored signed
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.avatar
@@ -1,3 +1,128 @@
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.admin.views.main import (
+    ALL_VAR,
+    ERROR_FLAG,
+    IS_POPUP_VAR,
+    ORDER_VAR,
+    PAGE_VAR,
+    SEARCH_VAR,
+    TO_FIELD_VAR,
+)
+from django.core.exceptions import ValidationError
+from django.db.models import Avg, Case, Count, DurationField, ExpressionWrapper, F, Max, Value, When
+from django.utils import timezone
+from django.utils.text import smart_split, unescape_string_literal
+
+from discord.models import DiscordMember, Task
+
+# changelist parameters that do not filter members
+CHANGELIST_PARAMS = {ALL_VAR, ERROR_FLAG, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR}
+# member changelist filters with a counterpart in the bot, their values are converted by the filtered field
+MEMBERS_FILTER_LOOKUPS = {
+    "engagement_score__exact",
+    "engagement_score_7d__exact",
+    "engagement_score_30d__exact",
+    "engagement_score_90d__exact",
+    "pending__exact",
+    "bot__exact",
+    "joined_at__gte",
+    "joined_at__lt",
+    "joined_at__isnull",
+    "created_at__gte",
+    "created_at__lt",
+}
+
+
+def engagement_score_case(field_name, thresholds):
+    # database side counterpart of the bot's calculate_engagement_score
+    return Case(
+        *[
+            When(**{f"{field_name}__gte": threshold}, then=Value(score))
+            for score, threshold in reversed(list(enumerate(thresholds, start=1)))
+        ],
+        default=Value(0),
+    )
+
+
+def rescore_members(thresholds):
+    """Re-score all members with a single UPDATE statement"""
+    return DiscordMember.objects.update(
+        engagement_score=engagement_score_case("messages_count", thresholds),
+        engagement_score_7d=engagement_score_case("messages_count_7d", thresholds),
+        engagement_score_30d=engagement_score_case("messages_count_30d", thresholds),
+        engagement_score_90d=engagement_score_case("messages_count_90d", thresholds),
+    )
+
+
+def task_latency_stats(since):
+    """Time from queueing to the first action of tasks created since a date, per priority"""
+    wait = ExpressionWrapper(F("started_at") - F("created_at"), output_field=DurationField())
+    return (
+        Task.objects.filter(created_at__gte=since, started_at__isnull=False)
+        .values("priority")
+        .annotate(
+            tasks_count=Count("id"),
+            avg_wait=Avg(wait),
+            max_wait=Max(wait),
+        )
+        .order_by("priority")
+    )
+
+
+def members_filter_spec(params):
+    """
+    Changelist filters of a "select all" member action as lookups and JSON values, the bot builds the query from them.
+    Returns None when a filter has no counterpart on the bot side.
+    """
+    members_filter = {}
+    for param, value in params.items():
+        if param in CHANGELIST_PARAMS:
+            continue
+        if param == SEARCH_VAR:
+            # same terms as the admin search, every term must be found in one of the search fields
+            terms = [
+                unescape_string_literal(bit) if bit.startswith(('"', "'")) and bit[0] == bit[-1] else bit
+                for bit in smart_split(value)
+            ]
+            if terms:
+                members_filter["search"] = terms
+        elif param == "role":
+            if value.isdigit():
+                members_filter["roles_ids__contains"] = [int(value)]
+        elif param == "copied_avatar":
+            if value == "yes":
+                members_filter["copied_avatar"] = True
+        elif param in MEMBERS_FILTER_LOOKUPS:
+            field_name, lookup = param.rsplit("__", 1)
+            if lookup == "isnull":
+                members_filter[param] = value.lower() not in ("", "false", "0")
+                continue
+            try:
+                value = DiscordMember._meta.get_field(field_name).to_python(value)
+            except ValidationError:
+                return None
+            if isinstance(value, datetime):
+                value = (timezone.make_aware(value) if timezone.is_naive(value) else value).isoformat()
+            members_filter[param] = value
+        else:
+            return None
+    return members_filter
+
+
+def humanize_readable_datetime(dt1, dt2) -> str:
+    """Kudos to https://stackoverflow.com/a/11157649/5751147"""
+    attrs = ["years", "months", "days", "hours"]
+    delta = relativedelta(dt1, dt2)
+    human_readable_attrs = [
+        "%d %s" % (getattr(delta, attr), attr if getattr(delta, attr) > 1 else attr[:-1])
+        for attr in attrs
+        if getattr(delta, attr)
+    ]
+    return " ".join(human_readable_attrs)
+
+
 def keyset_pagination_iterator(input_queryset, batch_size=500):
     all_queryset = input_queryset.order_by("pk")
     last_pk = None
@@ -0,0 +1,214 @@
+import io
+import os
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+from PIL import Image
+
+from app.models import AvatarHash
+from app.constants import AVATAR_FETCH_SIZE, AVATAR_FETCH_CONCURRENCY
+
+HASH_BITS = 64
+
+
+def difference_hash(image_bytes: bytes) -> int:
+    """64 bits perceptual hash, every bit tells if a pixel of a 9x8 grayscale thumbnail is brighter than the next one"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        # animated avatars are hashed on their first frame
+        pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    phash = 0
+    for row in range(8):
+        for column in range(8):
+            phash = phash << 1 | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return phash
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def to_signed(phash: int) -> int:
+    # postgres bigint is signed
+    return phash - (1 << HASH_BITS) if phash >= 1 << (HASH_BITS - 1) else phash
+
+
+def to_unsigned(phash: int) -> int:
+    return phash & ((1 << HASH_BITS) - 1)
+
+
+class AvatarFetcher:
+    """Downloads avatar images from the Discord CDN"""
+
+    async def fetch(self, user: discord.abc.User) -> bytes:
+        return await user.avatar_url_as(format="png", size=AVATAR_FETCH_SIZE).read()
+
+
+class DirectoryAvatarFetcher(AvatarFetcher):
+    """Reads avatar images from <directory>/<avatar hash>.png, a local stand-in for the Discord CDN"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def fetch(self, user: discord.abc.User) -> bytes:
+        with open(os.path.join(self.directory, f"{user.avatar}.png"), "rb") as file:
+            return file.read()
+
+
+class AvatarHasher:
+    """
+    Perceptual hashes of avatars, cached in memory and in the database by Discord avatar hash.
+    Discord gives a new avatar hash to every uploaded avatar, an unchanged avatar is never fetched again.
+    """
+
+    def __init__(self, fetcher: AvatarFetcher):
+        self.fetcher = fetcher
+        self.hashes: Optional[Dict[str, int]] = None  # avatar hash, perceptual hash
+        self.semaphore = asyncio.Semaphore(AVATAR_FETCH_CONCURRENCY)
+
+    async def load(self) -> Dict[str, int]:
+        if self.hashes is None:
+            self.hashes = {
+                avatar: to_unsigned(phash) for avatar, phash in await AvatarHash.all().values_list("avatar", "phash")
+            }
+        return self.hashes
+
+    async def hash(self, user: discord.abc.User) -> Optional[int]:
+        # default avatars are shared by every member without an avatar, they say nothing about a member
+        if user.avatar is None:
+            return None
+        hashes = await self.load()
+        if user.avatar not in hashes:
+            try:
+                async with self.semaphore:
+                    image_bytes = await self.fetcher.fetch(user)
+                phash = difference_hash(image_bytes)
+            except (discord.HTTPException, OSError) as e:
+                # avatar replaced since the member was cached or not an image, hashed again on the next change
+                logging.debug(f":::discord_management: unable to hash avatar {user.avatar}: {e}")
+                return None
+            await AvatarHash.get_or_create(avatar=user.avatar, defaults={"phash": to_signed(phash)})
+            hashes[user.avatar] = phash
+        return hashes[user.avatar]
+
+    async def hash_many(self, users: Iterable[discord.abc.User]) -> Dict[int, Optional[int]]:
+        """Perceptual hashes by user id, uncached avatars are fetched concurrently, each of them once"""
+        users = list(users)
+        hashes = await self.load()
+        uncached = {_.avatar: _ for _ in users if _.avatar is not None and _.avatar not in hashes}
+        await asyncio.gather(*[self.hash(_) for _ in uncached.values()])
+        return {user.id: hashes.get(user.avatar) for user in users}
+
+
+class HammingIndex:
+    """
+    Multi-index hashing, finds 64 bits hashes within a Hamming distance without comparing with all of them.
+    Hashes are split in max_distance + 1 chunks, by the pigeonhole principle two hashes within the distance
+    have at least one identical chunk, only hashes sharing a chunk with the query are compared.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        chunks_count = max_distance + 1
+        self.bounds = [
+            (HASH_BITS * i // chunks_count, HASH_BITS * (i + 1) // chunks_count) for i in range(chunks_count)
+        ]
+        self.tables: List[Dict[int, Set[int]]] = [{} for _ in self.bounds]
+
+    def chunks(self, phash: int) -> List[int]:
+        return [(phash >> start) & ((1 << (end - start)) - 1) for start, end in self.bounds]
+
+    def add(self, phash: int) -> None:
+        for table, chunk in zip(self.tables, self.chunks(phash)):
+            table.setdefault(chunk, set()).add(phash)
+        return None
+
+    def remove(self, phash: int) -> None:
+        for table, chunk in zip(self.tables, self.chunks(phash)):
+            table[chunk].discard(phash)
+            if not table[chunk]:
+                del table[chunk]
+        return None
+
+    def search(self, phash: int) -> List[Tuple[int, int]]:
+        candidates = set()
+        for table, chunk in zip(self.tables, self.chunks(phash)):
+            candidates |= table.get(chunk, set())
+        return [
+            (candidate, distance)
+            for candidate in candidates
+            for distance in [hamming(phash, candidate)]
+            if distance <= self.max_distance
+        ]
+
+
+class AvatarSuspect:
+    """Member whose avatar is a near duplicate of the avatar of a protected member"""
+
+    def __init__(self, member_id: int, protected_id: int, distance: int, max_distance: int):
+        self.member_id = member_id
+        self.protected_id = protected_id
+        self.distance = distance
+        # 1 for an identical hash, lower with every differing bit relative to the tolerated distance
+        self.score = 1 - distance / (max_distance + 1)
+
+
+class AvatarDetector:
+    """
+    Finds members whose avatar copies the avatar of a protected member.
+    Perceptual hashes of members avatars are indexed, a sweep runs one index search per protected member.
+    """
+
+    def __init__(self, protected_ids: Iterable[int], max_distance: int):
+        self.protected_ids = set(protected_ids)
+        self.max_distance = max_distance
+        self.members: Dict[int, int] = {}  # member id, perceptual hash
+        self.hashes: Dict[int, Set[int]] = {}  # perceptual hash, members ids
+        self.index = HammingIndex(max_distance)
+
+    def update(self, member_id: int, phash: Optional[int]) -> None:
+        if self.members.get(member_id) == phash:
+            return None
+        self.forget(member_id)
+        if phash is None:
+            return None
+        self.members[member_id] = phash
+        if phash not in self.hashes:
+            self.hashes[phash] = set()
+            self.index.add(phash)
+        self.hashes[phash].add(member_id)
+        return None
+
+    def forget(self, member_id: int) -> None:
+        phash = self.members.pop(member_id, None)
+        if phash is not None:
+            self.hashes[phash].discard(member_id)
+            if not self.hashes[phash]:
+                del self.hashes[phash]
+                self.index.remove(phash)
+        return None
+
+    def match(self, member_id: int) -> List[AvatarSuspect]:
+        """Protected members whose avatar is close to the avatar of a single member"""
+        phash = self.members.get(member_id)
+        if phash is None or member_id in self.protected_ids:
+            return []
+        return [
+            AvatarSuspect(member_id, protected_id, distance, self.max_distance)
+            for protected_id in self.protected_ids
+            if protected_id in self.members
+            for distance in [hamming(phash, self.members[protected_id])]
+            if distance <= self.max_distance
+        ]
+
+    def suspects(self) -> List[AvatarSuspect]:
+        """Every indexed member with an avatar close to the avatar of a protected member"""
+        return [
+            AvatarSuspect(member_id, protected_id, distance, self.max_distance)
+            for protected_id in self.protected_ids
+            if protected_id in self.members
+            for phash, distance in self.index.search(self.members[protected_id])
+            for member_id in self.hashes[phash]
+            if member_id not in self.protected_ids
+        ]
@@ -0,0 +1,102 @@
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from tortoise.fields import Field
+from tortoise.models import Model
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.utils import normalize_db_value
+
+
+def to_copy_value(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    return normalize_db_value(value)
+
+
+def field_default(field: Field) -> Any:
+    return field.default() if callable(field.default) else field.default
+
+
+def build_copy_records(model: Type[Model], rows: Dict[int, dict]) -> Tuple[List[str], List[tuple]]:
+    """
+    Turn rows keyed by primary key into COPY records without instantiating models.
+    Columns missing in a row get the model field default, because Django does not create db defaults.
+    """
+    fields = [
+        (model._meta.fields_map[field_name], column) for field_name, column in model._meta.fields_db_projection.items()
+    ]
+    records = [
+        tuple(
+            pk if field.pk else to_copy_value(row.get(field.model_field_name, field_default(field)))
+            for field, column in fields
+        )
+        for pk, row in rows.items()
+    ]
+    return [column for _, column in fields], records
+
+
+async def copy_records(
+    connection: BaseDBAsyncClient, table: str, columns: List[str], records: Iterable[tuple]
+) -> None:
+    """Stream records into a table with COPY through the underlying asyncpg connection"""
+    records = list(records)
+    if not records:
+        return None
+    async with connection.acquire_connection() as asyncpg_connection:
+        await asyncpg_connection.copy_records_to_table(table, records=records, columns=columns)
+    return None
+
+
+async def copy_rows(
+    connection: BaseDBAsyncClient, model: Type[Model], rows: Dict[int, dict], table: Optional[str] = None
+) -> None:
+    columns, records = build_copy_records(model, rows)
+    await copy_records(connection, table or model._meta.db_table, columns, records)
+    return None
+
+
+async def update_rows(connection: BaseDBAsyncClient, model: Type[Model], rows: Dict[int, dict]) -> None:
+    """
+    Write changed fields of rows keyed by primary key, rows changing the same fields share one prepared statement.
+    QuerySet.update renders lists as string literals, parameters keep array columns writable.
+    """
+    statements: Dict[Tuple[str, ...], List[tuple]] = {}
+    for pk, changed_fields in rows.items():
+        statements.setdefault(tuple(sorted(changed_fields)), []).append(
+            (pk, *[to_copy_value(changed_fields[_]) for _ in sorted(changed_fields)])
+        )
+    projection = model._meta.fields_db_projection
+    for field_names, values in statements.items():
+        assignments = ", ".join(f"{projection[_]} = ${index}" for index, _ in enumerate(field_names, start=2))
+        await connection.execute_many(
+            f"UPDATE {model._meta.db_table} SET {assignments} WHERE {model._meta.db_pk_column} = $1", values
+        )
+    return None
+
+
+async def merge_staging_rows(
+    connection: BaseDBAsyncClient, model: Type[Model], staging_table: str, synced_fields: List[str]
+) -> list:
+    """
+    Upsert rows of a staging table created like the model table, returns the new and changed rows.
+    New rows get every staged column, staged rows hold the defaults of the fields that are not synced.
+    Existing rows are only compared and updated on the synced fields.
+    """
+    if not synced_fields:
+        return []
+    projection = model._meta.fields_db_projection
+    pk = model._meta.db_pk_column
+    columns = ", ".join(projection.values())
+    synced_columns = [projection[_] for _ in synced_fields]
+    _, rows = await connection.execute_query(
+        f"""
+        INSERT INTO {model._meta.db_table} AS t ({columns})
+        SELECT {columns} FROM {staging_table}
+        ON CONFLICT ({pk}) DO UPDATE SET {", ".join(f"{_} = EXCLUDED.{_}" for _ in synced_columns)}
+        WHERE ({", ".join(f"t.{_}" for _ in synced_columns)}) IS DISTINCT FROM
+        ({", ".join(f"EXCLUDED.{_}" for _ in synced_columns)})
+        RETURNING t.{pk}
+        """
+    )
+    return rows
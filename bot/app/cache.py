@@ -0,0 +1,72 @@
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+
+from app.constants import CACHE_INDEX, CACHE_PREFIX, CACHE_SEPARATOR
+
+if TYPE_CHECKING:
+    import aioredis
+
+
+def member_key(member_id: int) -> str:
+    return f"{CACHE_PREFIX}member{CACHE_SEPARATOR}{member_id}"
+
+
+def channel_key(channel_id: int) -> str:
+    return f"{CACHE_PREFIX}channel{CACHE_SEPARATOR}{channel_id}"
+
+
+class MessagesCountCache:
+    """
+    Live messages counts shared between bot processes and the backend.
+    Counters are stored as `message:member-<id>` and `message:channel-<id>` keys,
+    members are also ranked by messages count in the `message` sorted set.
+    Accepts any aioredis compatible client, e.g. an in-process fake in tests.
+    """
+
+    def __init__(self, redis: "aioredis.Redis"):
+        self.redis = redis
+
+    @classmethod
+    def from_url(cls, url: str) -> Optional["MessagesCountCache"]:
+        # cache is optional, leave REDIS_URL empty to disable it
+        if not url:
+            return None
+        # aioredis 2.0.0a1 does not import on Python 3.11, a bot running without the cache must not need it
+        import aioredis
+
+        return cls(aioredis.from_url(url, decode_responses=True))
+
+    async def set_counts(self, members_messages_count: Dict[int, int], channels_messages_count: Dict[int, int]) -> None:
+        # replace counts with the ones calculated by a full history scan
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(CACHE_INDEX)
+        if members_messages_count:
+            pipe.mset({member_key(_): count for _, count in members_messages_count.items()})
+            pipe.zadd(CACHE_INDEX, {str(_): count for _, count in members_messages_count.items()})
+        if channels_messages_count:
+            pipe.mset({channel_key(_): count for _, count in channels_messages_count.items()})
+        await pipe.execute()
+        return None
+
+    async def increment_counts(self, pending_messages_count: Dict[Tuple[int, int], int]) -> None:
+        # apply a batch of (channel, member) deltas in a single round trip
+        pipe = self.redis.pipeline(transaction=True)
+        for (channel_id, member_id), delta in pending_messages_count.items():
+            pipe.incrby(member_key(member_id), delta)
+            pipe.incrby(channel_key(channel_id), delta)
+            pipe.zincrby(CACHE_INDEX, delta, str(member_id))
+        await pipe.execute()
+        return None
+
+    async def get_members_messages_count(self, member_ids: Iterable[int]) -> Dict[int, int]:
+        member_ids = list(member_ids)
+        if not member_ids:
+            return {}
+        values = await self.redis.mget([member_key(_) for _ in member_ids])
+        return {member_id: int(value) for member_id, value in zip(member_ids, values) if value is not None}
+
+    async def get_channels_messages_count(self, channel_ids: Iterable[int]) -> Dict[int, int]:
+        channel_ids = list(channel_ids)
+        if not channel_ids:
+            return {}
+        values = await self.redis.mget([channel_key(_) for _ in channel_ids])
+        return {channel_id: int(value) for channel_id, value in zip(channel_ids, values) if value is not None}
@@ -24,9 +24,64 @@ class TaskStatusChoices(str, Enum):
     FAILED = "FAILED"  # Task failed
 
 
+class TaskPriorityChoices(int, Enum):
+    HIGH = 0  # Security actions (kick, ban), run before anything else
+    NORMAL = 1  # Role changes
+
+
+class TaskMemberResultStatusChoices(str, Enum):
+    DONE = "DONE"  # Action applied
+    NOT_FOUND = "NOT_FOUND"  # Member left the guild
+    FORBIDDEN = "FORBIDDEN"  # Bot is not allowed to act on member
+    ERROR = "ERROR"  # Action failed
+    SKIPPED = "SKIPPED"  # Superseded by a kick or ban of the same member
+    UNCHANGED = "UNCHANGED"  # Member already had the requested roles
+
+
+class SuspectStatusChoices(str, Enum):
+    PENDING = "PENDING"  # Waiting for a moderator review
+    BANNED = "BANNED"  # Confirmed impersonator
+    AUTO_BANNED = "AUTO_BANNED"  # Banned without review, the score is above the auto-ban threshold
+    DISMISSED = "DISMISSED"  # Legitimate name
+
+
+class RaidActionChoices(str, Enum):
+    QUARANTINE = "quarantine"  # Assign the quarantine role to raiders
+    BAN = "ban"  # Ban raiders
+    OFF = "off"  # Only log raids
+
+
+class SuspectSignalChoices(str, Enum):
+    NAME = "NAME"  # Name or nick close to a protected name
+    AVATAR = "AVATAR"  # Avatar close to the avatar of a protected member
+
+
+class SyncModeChoices(str, Enum):
+    DIFF = "diff"  # Write only changed members, roles and role links
+    FULL = "full"  # Wipe tables and reload everything
+    STAGING = "staging"  # Load a snapshot into staging tables and merge it with short set-based statements
+
+
 SETTINGS_SINGLETON_ID = 1
 EVERYONE_ROLE = "@everyone"
 MUTED_ROLE = "Muted"
 CACHE_INDEX = "message"
 CACHE_PREFIX = "message:"
 CACHE_SEPARATOR = "-"
+TASKS_NOTIFY_CHANNEL = "discord_tasks"  # NOTIFY channel announcing queued tasks
+TASKS_LISTEN_RETRY_SECONDS = 30  # queue poll interval while the NOTIFY connection is down, retried after each poll
+SYNC_DB_BATCH_SIZE = 1000
+HISTORY_SCAN_CHECKPOINT_SIZE = 1000  # messages scanned between two persisted checkpoints
+ENGAGEMENT_SCORE_THRESHOLDS = (1, 11, 21, 31, 51)  # minimal messages count for engagement scores from 1 to 5
+ENGAGEMENT_WINDOWS_DAYS = (7, 30, 90)  # rolling windows, every window has its own DiscordMember columns
+TASK_RESULTS_BATCH_SIZE = 100  # member results persisted together with task progress
+TASK_LEASE_SECONDS = 60  # a started task without a heartbeat for this long is taken over by another worker
+TASK_LEASE_RENEW_SECONDS = 15
+TASKS_CLAIM_BATCH_SIZE = 20  # tasks claimed together are coalesced into one plan per member
+MEMBERS_QUERY_BATCH_SIZE = 5000  # members ids fetched per round trip when a task filter is resolved
+TASK_SLICE_SIZE = 500  # members processed per claimed batch before its tasks go back to the queue
+RAID_MAX_WINDOW_JOINS = 1000  # joins kept in the raid detection window, bounds its memory during huge raids
+RAID_CREATED_BUCKET_SECONDS = 3600  # accounts created within the same hour share a creation feature
+RAID_NAME_STEM_LENGTH = 5  # raiders usually share a name stem and differ by a counter or a suffix
+AVATAR_FETCH_SIZE = 64  # pixels, the smallest avatar size is enough for a 9x8 thumbnail
+AVATAR_FETCH_CONCURRENCY = 8  # avatars downloaded at the same time when the sweep meets many new avatars
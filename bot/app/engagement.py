@@ -0,0 +1,150 @@
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.constants import ENGAGEMENT_WINDOWS_DAYS
+
+
+def engagement_score_sql(expression: str, thresholds: Sequence[int]) -> str:
+    """SQL counterpart of `calculate_engagement_score`"""
+    whens = " ".join(
+        f"WHEN {expression} >= {int(threshold)} THEN {score}"
+        for score, threshold in reversed(list(enumerate(thresholds, start=1)))
+    )
+    return f"CASE {whens} ELSE 0 END"
+
+
+def window_sums_sql(source: str) -> str:
+    return ", ".join(
+        f"COALESCE(SUM({source}.messages_count) FILTER (WHERE {source}.day > $1::date - {days}), 0) AS count_{days}d"
+        for days in ENGAGEMENT_WINDOWS_DAYS
+    )
+
+
+def in_window(day: date, today: date, days: int) -> bool:
+    # a window of n days holds today and the n - 1 days before it
+    return day > today - timedelta(days=days)
+
+
+def leaving_day(today: date, days: int) -> date:
+    # the bucket that leaves a window when it moves to today
+    return today - timedelta(days=days)
+
+
+def pruned_day(today: date) -> date:
+    # buckets of this day and older are outside every window
+    return today - timedelta(days=max(ENGAGEMENT_WINDOWS_DAYS))
+
+
+def expired_days(last_day: date, today: date) -> Iterator[date]:
+    # windows are moved one day at a time, every day missed since the last move has its bucket subtracted
+    day = last_day
+    while day < today:
+        day += timedelta(days=1)
+        yield day
+
+
+def window_deltas(buckets: Dict[Tuple[int, date], int], today: date) -> Dict[int, Dict[int, int]]:
+    """Messages count to add to each rolling window by member, days that already left a window are skipped"""
+    deltas: Dict[int, Dict[int, int]] = {}
+    for (member_id, day), delta in buckets.items():
+        member_deltas = deltas.setdefault(member_id, dict.fromkeys(ENGAGEMENT_WINDOWS_DAYS, 0))
+        for days in ENGAGEMENT_WINDOWS_DAYS:
+            if in_window(day, today, days):
+                member_deltas[days] += delta
+    return deltas
+
+
+async def save_messages_buckets(connection: BaseDBAsyncClient, buckets: Dict[Tuple[int, date], int]) -> None:
+    # daily messages count per member, older buckets are removed once they leave every window
+    if not buckets:
+        return None
+    await connection.execute_query(
+        """
+        INSERT INTO discord_membermessagesbucket (member_id, day, messages_count)
+        SELECT member_id, day, messages_count
+        FROM unnest($1::bigint[], $2::date[], $3::int[]) AS t (member_id, day, messages_count)
+        ON CONFLICT (member_id, day) DO UPDATE
+        SET messages_count = discord_membermessagesbucket.messages_count + EXCLUDED.messages_count
+        """,
+        [
+            [member_id for member_id, _ in buckets],
+            [day for _, day in buckets],
+            list(buckets.values()),
+        ],
+    )
+    return None
+
+
+async def add_to_engagement_windows(
+    connection: BaseDBAsyncClient, buckets: Dict[Tuple[int, date], int], today: date, thresholds: Sequence[int]
+) -> None:
+    # apply fresh deltas to rolling windows
+    if not buckets:
+        return None
+    deltas = window_deltas(buckets, today)
+    assignments = ", ".join(
+        f"messages_count_{days}d = m.messages_count_{days}d + t.count_{days}d, "
+        f"engagement_score_{days}d = "
+        f"{engagement_score_sql(f'(m.messages_count_{days}d + t.count_{days}d)', thresholds)}"
+        for days in ENGAGEMENT_WINDOWS_DAYS
+    )
+    arrays = ", ".join(f"${index}::int[]" for index, _ in enumerate(ENGAGEMENT_WINDOWS_DAYS, start=2))
+    columns = ", ".join(f"count_{days}d" for days in ENGAGEMENT_WINDOWS_DAYS)
+    await connection.execute_query(
+        f"""
+        UPDATE discord_discordmember AS m SET {assignments}
+        FROM unnest($1::bigint[], {arrays}) AS t (member_id, {columns})
+        WHERE m.id = t.member_id
+        """,
+        [list(deltas), *[[_[days] for _ in deltas.values()] for days in ENGAGEMENT_WINDOWS_DAYS]],
+    )
+    return None
+
+
+async def expire_engagement_windows(connection: BaseDBAsyncClient, today: date, thresholds: Sequence[int]) -> None:
+    # subtract the bucket that has just left each window
+    for days in ENGAGEMENT_WINDOWS_DAYS:
+        engagement_score = engagement_score_sql(f"(m.messages_count_{days}d - b.messages_count)", thresholds)
+        await connection.execute_query(
+            f"""
+            UPDATE discord_discordmember AS m
+            SET messages_count_{days}d = m.messages_count_{days}d - b.messages_count,
+                engagement_score_{days}d = {engagement_score}
+            FROM discord_membermessagesbucket AS b
+            WHERE b.member_id = m.id AND b.day = $1::date
+            """,
+            [leaving_day(today, days)],
+        )
+    await connection.execute_query(
+        "DELETE FROM discord_membermessagesbucket WHERE day <= $1::date", [pruned_day(today)]
+    )
+    return None
+
+
+async def refresh_engagement_windows(
+    connection: BaseDBAsyncClient, today: date, thresholds: Sequence[int], member_ids: Optional[List[int]] = None
+) -> None:
+    # recalculate windows from daily buckets (at most one per day of the longest window), not from full history
+    assignments = ", ".join(
+        f"messages_count_{days}d = t.count_{days}d, "
+        f"engagement_score_{days}d = {engagement_score_sql(f't.count_{days}d', thresholds)}"
+        for days in ENGAGEMENT_WINDOWS_DAYS
+    )
+    await connection.execute_query(
+        f"""
+        UPDATE discord_discordmember AS m SET {assignments}
+        FROM (
+            SELECT dm.id AS member_id, {window_sums_sql("b")}
+            FROM discord_discordmember AS dm
+            LEFT JOIN discord_membermessagesbucket AS b
+            ON b.member_id = dm.id AND b.day > $1::date - {max(ENGAGEMENT_WINDOWS_DAYS)}
+            WHERE $2::bigint[] IS NULL OR dm.id = ANY($2::bigint[])
+            GROUP BY dm.id
+        ) AS t
+        WHERE m.id = t.member_id
+        """,
+        [today, member_ids],
+    )
+    return None
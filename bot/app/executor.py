@@ -0,0 +1,90 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+class AdaptiveLimiter:
+    """
+    Bounds concurrent Discord actions, additive increase on success and multiplicative decrease on rate limits.
+    discord.py already serializes requests of the same route bucket, the limiter keeps the overall
+    pressure below the point where Discord starts answering with 429.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.resume_at = 0.0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        # back off after a rate limit, until the retry time has passed
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self) -> None:
+        self.successes += 1
+        if self.successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self.successes = 0
+
+    def on_rate_limited(self, retry_after: float) -> None:
+        self.limit = max(self.minimum, self.limit // 2)
+        self.successes = 0
+        self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+        logging.info(f":::discord_management: rate limited, concurrency lowered to {self.limit}")
+
+
+class RateLimitListener(logging.Handler):
+    """Forwards 429 responses reported by discord.py's HTTP client to a limiter"""
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        super().__init__(level=logging.WARNING)
+        self.limiter = limiter
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = str(record.msg)
+        if message.startswith("We are being rate limited") or message.startswith("Global rate limit"):
+            self.limiter.on_rate_limited(float(record.args[0]))
+
+
+async def run_worker_pool(
+    items: Iterable[T], handler: Callable[[T], Awaitable[None]], workers_count: int, limiter: AdaptiveLimiter
+) -> int:
+    """
+    Process items with a bounded pool of workers, returns the number of processed items.
+    The first unexpected exception cancels the remaining workers and is re-raised.
+    """
+    iterator = iter(items)
+    processed = 0
+
+    async def worker():
+        nonlocal processed
+        for item in iterator:
+            async with limiter:
+                await handler(item)
+            limiter.on_success()
+            processed += 1
+
+    workers = [asyncio.create_task(worker()) for _ in range(workers_count)]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for _ in workers:
+            _.cancel()
+    return processed
@@ -1,14 +1,27 @@
+import time
 import logging
 import asyncio
+from typing import Dict, List, Optional, Set, Tuple
 
 import discord
 from sentry_sdk import capture_exception, Hub
 from discord.ext import commands, tasks
+from tortoise.transactions import in_transaction
 
 import config
 from constants import GUILD_INDEX
-from app.models import Task
-from app.constants import TaskTypesChoices
+from app.models import Task, ImpersonationSuspect
+from app.notifications import notify_task_queued
+from app.raid import RaidDetector
+from app.avatars import AvatarDetector, AvatarFetcher, AvatarHasher, AvatarSuspect, DirectoryAvatarFetcher
+from app.impersonation import ImpersonationDetector, Suspect
+from app.constants import (
+    TaskTypesChoices,
+    TaskPriorityChoices,
+    SuspectStatusChoices,
+    SuspectSignalChoices,
+    RaidActionChoices,
+)
 
 
 class AntiFraudCog(commands.Cog):
@@ -16,12 +29,24 @@ class AntiFraudCog(commands.Cog):
         self.bot: commands.Bot = bot
         self.anti_fraud_lock = asyncio.Lock()
         self.guild: discord.Guild = None
+        self.impersonation_detector = ImpersonationDetector(
+            config.BAN_USERNAMES_SIMILAR_TO, config.WHITELISTED_IDS, config.ANTIFRAUD_MAX_DISTANCE
+        )
+        self.avatar_hasher = AvatarHasher(
+            DirectoryAvatarFetcher(config.AVATARS_DIR) if config.AVATARS_DIR else AvatarFetcher()
+        )
+        # whitelisted members are the protected ones, their avatars must not be copied
+        self.avatar_detector = AvatarDetector(config.WHITELISTED_IDS, config.ANTIFRAUD_AVATAR_MAX_DISTANCE)
+        self.raid_detector = RaidDetector(
+            config.RAID_WINDOW_SECONDS, config.RAID_CLUSTER_SIZE, config.RAID_NEW_ACCOUNT_DAYS, config.WHITELISTED_IDS
+        )
+        self.queued_ban_ids: Set[int] = set()  # members with a ban task queued by this cog
         self.anti_fraud_task.start()
 
     def cog_unload(self):
         self.anti_fraud_task.cancel()
 
-    @tasks.loop(seconds=config.TASKS_SCAN_SECONDS)
+    @tasks.loop(seconds=config.ANTIFRAUD_SWEEP_SECONDS)
     async def anti_fraud_task(self):
         with Hub(Hub.current):
             # ensure that only one instance of job is running, other instances will be discarded
@@ -41,25 +66,215 @@ class AntiFraudCog(commands.Cog):
         if self.guild is None:
             self.guild = self.bot.guilds[GUILD_INDEX]
 
-    async def ban_copycats(self) -> None:
-        # ban users impersonating other users, configurable via WHITELISTED_IDS and BAN_USERNAMES_SIMILAR_TO
-        member_ids_to_ban = set()
-        # search for impersonators
-        for member in self.bot.discord_members:
-            is_member_suspected = (
-                config.BAN_USERNAMES_SIMILAR_TO in member.name.lower()
-                or config.BAN_USERNAMES_SIMILAR_TO in str(member.nick).lower()
+    def is_checked_guild(self, guild: discord.Guild) -> bool:
+        return self.guild is not None and guild.id == self.guild.id
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if self.is_checked_guild(member.guild):
+            await self.check_raid(member)
+            await self.check_member(member)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if self.is_checked_guild(after.guild) and before.nick != after.nick:
+            await self.check_member(after)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # usernames and avatars are global, they are reported as user updates instead of member updates
+        if self.guild is not None and (before.name != after.name or before.avatar != after.avatar):
+            member = self.guild.get_member(after.id)
+            if member:
+                await self.check_member(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        self.impersonation_detector.forget(member.id)
+        self.avatar_detector.forget(member.id)
+        self.queued_ban_ids.discard(member.id)
+
+    async def check_member(self, member: discord.Member) -> None:
+        # ban an impersonator as soon as the name appears, instead of waiting for the next sweep
+        with Hub(Hub.current):
+            try:
+                if member.id in self.queued_ban_ids:
+                    return None
+                await self.handle_suspects(
+                    self.impersonation_detector.exact_match(member) + self.impersonation_detector.fuzzy_match(member)
+                )
+                if member.id not in self.queued_ban_ids:
+                    self.avatar_detector.update(member.id, await self.avatar_hasher.hash(member))
+                    await self.handle_avatar_suspects(self.avatar_detector.match(member.id))
+            except Exception as e:
+                logging.debug(f":::discord_management: {e}")
+                capture_exception(e)
+        return None
+
+    async def check_raid(self, member: discord.Member) -> None:
+        # raiders are handled in bulk as soon as their cluster is complete, later members of the cluster one by one
+        with Hub(Hub.current):
+            try:
+                raiders_ids = self.raid_detector.add(member, time.monotonic())
+                if not raiders_ids:
+                    return None
+                logging.warning(f":::discord_management: raid detected, {len(raiders_ids)} new raiders")
+                if config.RAID_ACTION == RaidActionChoices.BAN:
+                    await self.queue_ban(raiders_ids)
+                elif config.RAID_ACTION == RaidActionChoices.QUARANTINE and config.RAID_QUARANTINE_ROLE_ID:
+                    await self.queue_task(TaskTypesChoices.ASSIGN_ROLE, raiders_ids, [config.RAID_QUARANTINE_ROLE_ID])
+            except Exception as e:
+                logging.debug(f":::discord_management: {e}")
+                capture_exception(e)
+        return None
+
+    async def queue_task(
+        self, task_type: TaskTypesChoices, member_ids: List[int], roles_ids: Optional[List[int]] = None
+    ) -> None:
+        # high priority task, the tasks cog is woken up by the notification and runs it right away
+        async with in_transaction() as connection:
+            task = await Task.create(
+                members_ids=member_ids,
+                roles_ids=roles_ids or [],
+                task_type=task_type,
+                priority=TaskPriorityChoices.HIGH,
+                using_db=connection,
             )
-            is_member_whitelisted = int(member.id) in config.WHITELISTED_IDS
-            if is_member_suspected and not is_member_whitelisted:
-                member_ids_to_ban.add(member.id)
-        # ban impersonators
-        member_ids_to_ban_list = list(member_ids_to_ban)
-        # prevent duplicate ban tasks
-        if member_ids_to_ban_list and not await Task.exists(
-            members_ids=member_ids_to_ban_list, task_type=TaskTypesChoices.BAN
-        ):
-            await Task.create(members_ids=member_ids_to_ban_list, task_type=TaskTypesChoices.BAN)
+            await notify_task_queued(connection, task.id)
+        return None
+
+    async def queue_ban(self, member_ids: List[int]) -> None:
+        await self.queue_task(TaskTypesChoices.BAN, member_ids)
+        self.queued_ban_ids.update(member_ids)
+        return None
+
+    def get_member(self, member_id: int) -> Optional[discord.Member]:
+        # a member who just joined may not be synced yet
+        member = self.bot.discord_members.get(member_id)
+        if member is None and self.guild is not None:
+            member = self.guild.get_member(member_id)
+        return member
+
+    @staticmethod
+    def is_autoban(suspect: Suspect) -> bool:
+        # an exact copy is always banned, whatever the threshold of close variants
+        return suspect.distance == 0 or suspect.score >= config.ANTIFRAUD_AUTOBAN_SCORE
+
+    async def handle_suspects(self, suspects: List[Suspect]) -> None:
+        # names containing a protected name and close variants above the score threshold are banned,
+        # other variants are reviewed by a moderator, a dismissed suspect is not banned again for the same name
+        closest_suspects: Dict[Tuple[int, str], Suspect] = {}
+        for suspect in suspects:
+            key = (suspect.member_id, suspect.protected_name)
+            if suspect.member_id not in self.queued_ban_ids and (
+                key not in closest_suspects or suspect.distance < closest_suspects[key].distance
+            ):
+                closest_suspects[key] = suspect
+        suspects = list(closest_suspects.values())
+        if not suspects:
+            return None
+        statuses = {
+            (member_id, protected_name): status
+            for member_id, protected_name, status in await ImpersonationSuspect.filter(
+                member_id__in={_.member_id for _ in suspects}, signal=SuspectSignalChoices.NAME
+            ).values_list("member_id", "protected_name", "status")
+        }
+        members = {_.member_id: self.get_member(_.member_id) for _ in suspects}
+        suspects = [
+            _
+            for _ in suspects
+            if members[_.member_id]
+            and statuses.get((_.member_id, _.protected_name)) != SuspectStatusChoices.DISMISSED
+        ]
+        member_ids_to_ban = {_.member_id for _ in suspects if self.is_autoban(_)}
+        banned_suspects, new_suspects = {}, {}
+        for suspect in suspects:
+            member = members[suspect.member_id]
+            key = (suspect.member_id, suspect.protected_name)
+            if self.is_autoban(suspect):
+                banned_suspects[key] = dict(
+                    name=member.name,
+                    nick=member.nick,
+                    distance=suspect.distance,
+                    score=suspect.score,
+                    status=SuspectStatusChoices.AUTO_BANNED,
+                )
+            elif suspect.member_id not in member_ids_to_ban and key not in statuses:
+                new_suspects[key] = ImpersonationSuspect(
+                    member_id=suspect.member_id,
+                    name=member.name,
+                    nick=member.nick,
+                    protected_name=suspect.protected_name,
+                    distance=suspect.distance,
+                    score=suspect.score,
+                )
+        if not banned_suspects and not new_suspects:
+            return None
+        # the suspect row is the audit trail of an automatic ban, it is written along with the ban task
+        async with in_transaction() as connection:
+            for (member_id, protected_name), defaults in banned_suspects.items():
+                await ImpersonationSuspect.update_or_create(
+                    defaults,
+                    using_db=connection,
+                    member_id=member_id,
+                    protected_name=protected_name,
+                    signal=SuspectSignalChoices.NAME,
+                )
+            if new_suspects:
+                await ImpersonationSuspect.bulk_create(list(new_suspects.values()), using_db=connection)
+            if member_ids_to_ban:
+                await self.queue_ban(list(member_ids_to_ban))
+        return None
+
+    async def handle_avatar_suspects(self, suspects: List[AvatarSuspect]) -> None:
+        # a copied avatar alone is not a proof, suspects are always reviewed by a moderator
+        suspects = [_ for _ in suspects if _.member_id not in self.queued_ban_ids]
+        if not suspects:
+            return None
+        reviewed = set(
+            await ImpersonationSuspect.filter(
+                member_id__in={_.member_id for _ in suspects}, signal=SuspectSignalChoices.AVATAR
+            ).values_list("member_id", "protected_name")
+        )
+        new_suspects = {}
+        for suspect in suspects:
+            member = self.bot.discord_members.get(suspect.member_id)
+            protected_member = self.bot.discord_members.get(suspect.protected_id)
+            if not member or not protected_member:
+                continue
+            key = (suspect.member_id, protected_member.name)
+            if key not in reviewed:
+                new_suspects[key] = ImpersonationSuspect(
+                    member_id=suspect.member_id,
+                    name=member.name,
+                    nick=member.nick,
+                    protected_name=protected_member.name,
+                    signal=SuspectSignalChoices.AVATAR,
+                    distance=suspect.distance,
+                    score=suspect.score,
+                )
+        if new_suspects:
+            await ImpersonationSuspect.bulk_create(list(new_suspects.values()))
+        return None
+
+    async def ban_copycats(self) -> None:
+        # safety sweep over all members, configurable via WHITELISTED_IDS and BAN_USERNAMES_SIMILAR_TO,
+        # impersonators are normally banned by the join and update hooks
+        # names containing a protected name, names are only normalized again when they changed,
+        # and names within an edit distance of protected names, one index search per protected name
+        await self.handle_suspects(
+            [
+                suspect
+                for member in self.bot.discord_members.values()
+                for suspect in self.impersonation_detector.exact_match(member)
+            ]
+            + self.impersonation_detector.fuzzy_suspects()
+        )
+        # avatars close to protected members avatars, only new avatars are downloaded
+        phashes = await self.avatar_hasher.hash_many(self.bot.discord_members.values())
+        for member_id, phash in phashes.items():
+            self.avatar_detector.update(member_id, phash)
+        await self.handle_avatar_suspects(self.avatar_detector.suspects())
         return None
 
 
@@ -1,19 +1,48 @@
+import time
 import logging
 import asyncio
 from collections import defaultdict
-from typing import List, Dict
-from datetime import datetime
+from typing import List, Dict, Optional, Set, Tuple
+from datetime import datetime, date
 
 import discord
 from sentry_sdk import capture_exception, Hub
+from tortoise.functions import Sum
+from tortoise.backends.base.client import BaseDBAsyncClient
 from tortoise.transactions import in_transaction
 from discord.ext import commands, tasks
 
 import config
 from constants import GUILD_INDEX
-from app.utils import calculate_engagement_score, humanize_readable_datetime
-from app.models import DiscordMember, DiscordRole, DiscordRoleMember
-from app.constants import EVERYONE_ROLE
+from app.utils import calculate_engagement_score, diff_rows, chunks
+from app.bulk import copy_rows, copy_records, merge_staging_rows, update_rows
+from app.cache import MessagesCountCache
+from app.engagement import (
+    expired_days,
+    pruned_day,
+    save_messages_buckets,
+    add_to_engagement_windows,
+    expire_engagement_windows,
+    refresh_engagement_windows,
+)
+from app.models import Settings, DiscordMember, DiscordRole, DiscordRoleMember, ChannelScan, ChannelMessagesCount
+from app.constants import (
+    EVERYONE_ROLE,
+    SYNC_DB_BATCH_SIZE,
+    HISTORY_SCAN_CHECKPOINT_SIZE,
+    ENGAGEMENT_SCORE_THRESHOLDS,
+    SETTINGS_SINGLETON_ID,
+    SyncModeChoices,
+)
+
+# channels with message history, threads are exposed by discord.py 2.x only
+HISTORY_CHANNEL_TYPES = {discord.ChannelType.text, discord.ChannelType.news} | {
+    getattr(discord.ChannelType, _)
+    for _ in ("news_thread", "public_thread", "private_thread")
+    if hasattr(discord.ChannelType, _)
+}
+
+ROLE_MEMBER_COLUMNS = ["discordmember_id", "discordrole_id"]
 
 
 class SyncDiscord(commands.Cog):
@@ -22,112 +51,685 @@ class SyncDiscord(commands.Cog):
         self.sync_users_and_roles_lock = asyncio.Lock()
         self.sync_message_data_lock = asyncio.Lock()
         self.guild: discord.Guild = None
-        self.bot.discord_members = []
+        self.bot.discord_members = {}  # id, member
         self.bot.members_messages_count = defaultdict(lambda: 0, {})  # id, messages_count
         self.roles: List[discord.Role]
+        # member events received while a reconciliation runs (None for a removal), the latest one per member wins,
+        # they are applied over the reconciled snapshot instead of waiting for it, the first reconciliation
+        # runs after the history scan so members joining meanwhile are written with their messages count
+        self.reconciling = True
+        self.buffered_members: Dict[int, Optional[discord.Member]] = {}
+        # write-behind buffer of live messages, flushed to the db in batches
+        self.message_data_ready = asyncio.Event()
+        self.scanned_channels: Dict[int, int] = {}  # channel id, high-water mark
+        self.pending_messages_count: Dict[Tuple[int, int], int] = defaultdict(lambda: 0, {})  # (channel, member), delta
+        self.pending_messages_buckets: Dict[Tuple[int, date], int] = defaultdict(lambda: 0, {})  # (member, day), delta
+        self.pending_messages_events = 0
+        self.engagement_day: date = None  # last day rolling windows were moved to
+        self.engagement_score_thresholds: Tuple[int, ...] = ENGAGEMENT_SCORE_THRESHOLDS
+        self.bot.messages_count_cache = MessagesCountCache.from_url(config.REDIS_URL)
         self.sync_users_and_roles_to_db.start()
+        self.flush_messages_count_job.start()
+        self.expire_engagement_windows_job.start()
 
     def cog_unload(self):
         self.sync_users_and_roles_to_db.cancel()
+        self.flush_messages_count_job.cancel()
+        self.expire_engagement_windows_job.cancel()
 
     @tasks.loop(seconds=config.SYNC_DISCORD_SECONDS)
     async def sync_users_and_roles_to_db(self):
         with Hub(Hub.current):
-            # ensure that only one instance of job is running, other instances will be discarded
-            if not self.sync_users_and_roles_lock.locked():
-                await self.sync_users_and_roles_lock.acquire()
+            # role events hold the lock for a single write, the job waits for it instead of skipping its run,
+            # otherwise member events would stay buffered until the next run
+            async with self.sync_users_and_roles_lock:
+                self.reconciling = True
                 try:
                     await self.fetch_users_and_roles()
+                    await self.load_engagement_score_thresholds()
+                    await self.load_shared_messages_count()
                     await self.save_users_and_roles_to_db()
                 except Exception as e:
                     logging.debug(f":::discord_management: {e}")
                     capture_exception(e)
                 finally:
-                    self.sync_users_and_roles_lock.release()
+                    await self.apply_buffered_members()
 
     @sync_users_and_roles_to_db.before_loop
     async def before_sync_users_and_roles_to_db(self):
         await self.bot.wait_until_ready()
         if self.guild is None:
             self.guild = self.bot.guilds[GUILD_INDEX]
+        await self.load_engagement_score_thresholds()
         await self.fetch_message_data()
+        await self.seed_messages_count_cache()
+        await self.refresh_engagement_windows()
+        self.message_data_ready.set()
+
+    @tasks.loop(seconds=config.MESSAGES_FLUSH_MS / 1000)
+    async def flush_messages_count_job(self):
+        await self.try_flush_messages_count()
+
+    @flush_messages_count_job.before_loop
+    async def before_flush_messages_count_job(self):
+        await self.message_data_ready.wait()
+
+    @tasks.loop(hours=1)
+    async def expire_engagement_windows_job(self):
+        with Hub(Hub.current):
+            try:
+                await self.expire_engagement_windows()
+            except Exception as e:
+                logging.debug(f":::discord_management: {e}")
+                capture_exception(e)
+
+    @expire_engagement_windows_job.before_loop
+    async def before_expire_engagement_windows_job(self):
+        await self.message_data_ready.wait()
+
+    async def load_engagement_score_thresholds(self) -> None:
+        # thresholds are configurable in the admin, the backend re-scores stored members when they change
+        settings, _ = await Settings.get_or_create(id=SETTINGS_SINGLETON_ID)
+        self.engagement_score_thresholds = settings.engagement_score_thresholds
+        return None
+
+    async def refresh_engagement_windows(self, member_ids: List[int] = None) -> None:
+        today = datetime.utcnow().date()
+        async with in_transaction() as connection:
+            await refresh_engagement_windows(connection, today, self.engagement_score_thresholds, member_ids)
+        if member_ids is None:
+            self.engagement_day = today
+        return None
+
+    async def expire_engagement_windows(self) -> None:
+        # move rolling windows day by day, only buckets leaving a window are touched
+        today = datetime.utcnow().date()
+        await self.load_engagement_score_thresholds()
+        for day in expired_days(self.engagement_day, today):
+            async with self.sync_message_data_lock:
+                async with in_transaction() as connection:
+                    await expire_engagement_windows(connection, day, self.engagement_score_thresholds)
+            self.engagement_day = day
+        return None
 
     async def fetch_message_data(self) -> None:
-        # calculate messages count
+        # start from messages counts persisted by previous scans
         _members_messages_count: Dict[int, int] = defaultdict(lambda: 0, {})
-        for channel in self.guild.channels:
+        for member_id, messages_count in (
+            await ChannelMessagesCount.annotate(total=Sum("messages_count"))
+            .group_by("member_id")
+            .values_list("member_id", "total")
+        ):
+            _members_messages_count[member_id] = messages_count
+        # scan only messages newer than the persisted high-water mark of each channel, several channels at a time
+        channels = [
+            channel
+            for channel in [*self.guild.channels, *getattr(self.guild, "threads", [])]
+            if channel.type in HISTORY_CHANNEL_TYPES
+        ]
+        semaphore = asyncio.Semaphore(config.HISTORY_SCAN_CONCURRENCY)
+        started_at = time.monotonic()
+        scanned_messages = await asyncio.gather(
+            *[self.scan_channel_history(channel, _members_messages_count, semaphore) for channel in channels]
+        )
+        elapsed = time.monotonic() - started_at
+        logging.info(
+            f":::discord_management: scanned {sum(scanned_messages)} messages in {len(channels)} channels "
+            f"in {elapsed:.0f}s ({sum(scanned_messages) / max(elapsed, 1):.1f} messages/sec)"
+        )
+        # switch between cached and fresh message data
+        self.bot.members_messages_count = _members_messages_count
+        return None
+
+    async def scan_channel_history(
+        self, channel: discord.abc.Messageable, members_messages_count: Dict[int, int], semaphore: asyncio.Semaphore
+    ) -> int:
+        # discord.py rate limits every channel route bucket on its own, the semaphore bounds overall parallelism
+        async with semaphore:
+            scan, _ = await ChannelScan.get_or_create(channel_id=channel.id)
+            after = discord.Object(id=scan.last_message_id) if scan.last_message_id else None
+            # scan oldest first, so that an interrupted scan resumes from the last checkpoint
+            checkpoint_messages_count: Dict[int, int] = defaultdict(lambda: 0, {})
+            checkpoint_buckets: Dict[Tuple[int, date], int] = defaultdict(lambda: 0, {})
+            oldest_bucket_day = pruned_day(datetime.utcnow().date())
+            last_message_id, unsaved_messages, scanned_messages = None, 0, 0
+            started_at = time.monotonic()
             try:
-                if hasattr(channel, "history") and channel.type is discord.ChannelType.text:
-                    async for message in channel.history(limit=None):
-                        _members_messages_count[message.author.id] += 1
+                async for message in channel.history(limit=None, after=after, oldest_first=True):
+                    checkpoint_messages_count[message.author.id] += 1
+                    members_messages_count[message.author.id] += 1
+                    if message.created_at.date() > oldest_bucket_day:
+                        checkpoint_buckets[(message.author.id, message.created_at.date())] += 1
+                    last_message_id = message.id
+                    unsaved_messages += 1
+                    scanned_messages += 1
+                    if unsaved_messages >= HISTORY_SCAN_CHECKPOINT_SIZE:
+                        await self.save_channel_scan_checkpoint(
+                            scan, checkpoint_messages_count, checkpoint_buckets, last_message_id
+                        )
+                        checkpoint_messages_count.clear()
+                        checkpoint_buckets.clear()
+                        unsaved_messages = 0
+                        logging.info(
+                            f":::discord_management: #{channel} scanned {scanned_messages} messages "
+                            f"({scanned_messages / max(time.monotonic() - started_at, 1):.1f} messages/sec)"
+                        )
             except discord.Forbidden:
                 pass  # silently ignore private channels
-        # switch between cached and fresh message data
-        self.bot.members_messages_count = _members_messages_count
+            if unsaved_messages:
+                await self.save_channel_scan_checkpoint(
+                    scan, checkpoint_messages_count, checkpoint_buckets, last_message_id
+                )
+            # from now on live messages of this channel are persisted by the write-behind flush
+            self.scanned_channels[channel.id] = scan.last_message_id or 0
+        return scanned_messages
+
+    async def save_channel_scan_checkpoint(
+        self,
+        scan: ChannelScan,
+        checkpoint_messages_count: Dict[int, int],
+        checkpoint_buckets: Dict[Tuple[int, date], int],
+        last_message_id: int,
+    ) -> None:
+        # persist partial counts together with the high-water mark, so they never get out of sync
+        async with in_transaction() as connection:
+            await connection.execute_query(
+                """
+                INSERT INTO discord_channelmessagescount (channel_id, member_id, messages_count)
+                SELECT $1, member_id, messages_count
+                FROM unnest($2::bigint[], $3::int[]) AS t (member_id, messages_count)
+                ON CONFLICT (channel_id, member_id) DO UPDATE
+                SET messages_count = discord_channelmessagescount.messages_count + EXCLUDED.messages_count
+                """,
+                [scan.channel_id, list(checkpoint_messages_count.keys()), list(checkpoint_messages_count.values())],
+            )
+            await save_messages_buckets(connection, checkpoint_buckets)
+            scan.last_message_id = last_message_id
+            scan.messages_count += sum(checkpoint_messages_count.values())
+            await scan.save(update_fields=["last_message_id", "messages_count", "modified_at"], using_db=connection)
+        return None
+
+    async def seed_messages_count_cache(self) -> None:
+        if self.bot.messages_count_cache is None:
+            return None
+        await self.bot.messages_count_cache.set_counts(
+            self.bot.members_messages_count,
+            dict(await ChannelScan.all().values_list("channel_id", "messages_count")),
+        )
+        return None
+
+    async def load_shared_messages_count(self) -> None:
+        # pick up messages counted by other bot processes
+        if self.bot.messages_count_cache is None:
+            return None
+        shared_messages_count = await self.bot.messages_count_cache.get_members_messages_count(
+            self.bot.discord_members.keys()
+        )
+        # deltas that are not flushed yet are not in the cache
+        for (_, member_id), delta in self.pending_messages_count.items():
+            if member_id in shared_messages_count:
+                shared_messages_count[member_id] += delta
+        self.bot.members_messages_count.update(shared_messages_count)
         return None
 
     async def fetch_users_and_roles(self) -> None:
         # fetch all roles
         self.roles = await self.guild.fetch_roles()
         # fetch all members
-        self.bot.discord_members = []
+        discord_members = {}
         async for member in self.guild.fetch_members(limit=None):
-            self.bot.discord_members.append(member)
+            discord_members[member.id] = member
+        self.bot.discord_members = discord_members
         return None
 
+    def build_role_row(self, role: discord.Role) -> dict:
+        return {
+            "name": role.name,
+            "position": role.position,
+            "created_at": role.created_at,
+        }
+
+    def build_member_row(self, member: discord.Member) -> dict:
+        roles = [_ for _ in reversed(member.roles) if _.name != EVERYONE_ROLE]  # highest role first
+        return {
+            "bot": member.bot,
+            "avatar_url": str(member.avatar_url),
+            "name": member.name,
+            "username": f"{member.name}#{member.discriminator}",
+            "discriminator": member.discriminator,
+            "engagement_score": calculate_engagement_score(
+                self.bot.members_messages_count[member.id], self.engagement_score_thresholds
+            ),
+            "messages_count": self.bot.members_messages_count[member.id],
+            "nick": member.nick,
+            "roles_ids": sorted(_.id for _ in roles),
+            "roles_names": ", ".join(_.name for _ in roles),
+            "pending": member.pending,
+            "premium_since": member.premium_since,
+            "joined_at": member.joined_at,
+            "created_at": member.created_at,
+        }
+
+    def build_role_rows(self) -> Dict[int, dict]:
+        return {_.id: self.build_role_row(_) for _ in self.roles if _.name != EVERYONE_ROLE}
+
+    def build_member_rows(self) -> Dict[int, dict]:
+        return {_.id: self.build_member_row(_) for _ in self.bot.discord_members.values()}
+
+    def build_role_member_pairs(self) -> Set[Tuple[int, int]]:
+        return {
+            (member.id, role.id)
+            for member in self.bot.discord_members.values()
+            for role in member.roles
+            if role.name != EVERYONE_ROLE
+        }
+
     async def save_users_and_roles_to_db(self) -> None:
-        async with in_transaction():
+        if config.SYNC_MODE == SyncModeChoices.FULL:
+            await self.reload_users_and_roles_in_db()
+        elif config.SYNC_MODE == SyncModeChoices.DIFF:
+            await self.diff_users_and_roles_in_db()
+        else:
+            await self.stage_users_and_roles_in_db()
+        return None
+
+    async def reload_users_and_roles_in_db(self) -> None:
+        async with in_transaction() as connection:
             # clean up db
             await DiscordRoleMember.all().delete()
             await DiscordRole.all().delete()
             await DiscordMember.all().delete()
             # sync roles
-            await DiscordRole.bulk_create(
+            await copy_rows(connection, DiscordRole, self.build_role_rows())
+            # sync members
+            await copy_rows(connection, DiscordMember, self.build_member_rows())
+            # sync member roles
+            await copy_records(
+                connection, DiscordRoleMember._meta.db_table, ROLE_MEMBER_COLUMNS, self.build_role_member_pairs()
+            )
+            await refresh_engagement_windows(connection, datetime.utcnow().date(), self.engagement_score_thresholds)
+        return None
+
+    async def diff_users_and_roles_in_db(self) -> None:
+        # compare fetched state with the stored one and write only what changed
+        fresh_roles = self.build_role_rows()
+        fresh_members = self.build_member_rows()
+        fresh_pairs = self.build_role_member_pairs()
+        stored_roles = {_["id"]: _ for _ in await DiscordRole.all().values()}
+        stored_members = {_["id"]: _ for _ in await DiscordMember.all().values()}
+        stored_pairs = {
+            (member_id, role_id): pk
+            for pk, member_id, role_id in await DiscordRoleMember.all().values_list(
+                "id", "discordmember_id", "discordrole_id"
+            )
+        }
+        roles_to_create, roles_to_update, roles_to_delete = diff_rows(stored_roles, fresh_roles)
+        members_to_create, members_to_update, members_to_delete = diff_rows(stored_members, fresh_members)
+        pairs_to_create = fresh_pairs - stored_pairs.keys()
+        pairs_to_delete = [pk for pair, pk in stored_pairs.items() if pair not in fresh_pairs]
+        async with in_transaction() as connection:
+            # remove stale rows, role links first
+            for batch in chunks(pairs_to_delete, SYNC_DB_BATCH_SIZE):
+                await DiscordRoleMember.filter(id__in=batch).delete()
+            for batch in chunks(members_to_delete, SYNC_DB_BATCH_SIZE):
+                await DiscordMember.filter(id__in=batch).delete()
+            for batch in chunks(roles_to_delete, SYNC_DB_BATCH_SIZE):
+                await DiscordRole.filter(id__in=batch).delete()
+            # update changed rows, only changed fields are written
+            await update_rows(connection, DiscordRole, roles_to_update)
+            await update_rows(connection, DiscordMember, members_to_update)
+            # insert new rows
+            await copy_rows(connection, DiscordRole, roles_to_create)
+            await copy_rows(connection, DiscordMember, members_to_create)
+            await copy_records(connection, DiscordRoleMember._meta.db_table, ROLE_MEMBER_COLUMNS, pairs_to_create)
+            if members_to_create:
+                await refresh_engagement_windows(
+                    connection, datetime.utcnow().date(), self.engagement_score_thresholds, list(members_to_create)
+                )
+        logging.info(
+            f":::discord_management: synced "
+            f"roles +{len(roles_to_create)} ~{len(roles_to_update)} -{len(roles_to_delete)}, "
+            f"members +{len(members_to_create)} ~{len(members_to_update)} -{len(members_to_delete)}, "
+            f"role links +{len(pairs_to_create)} -{len(pairs_to_delete)}"
+        )
+        return None
+
+    async def stage_users_and_roles_in_db(self) -> None:
+        fresh_roles = self.build_role_rows()
+        fresh_members = self.build_member_rows()
+        role_columns = list(next(iter(fresh_roles.values()), {}).keys())
+        member_columns = list(next(iter(fresh_members.values()), {}).keys())
+        async with in_transaction() as connection:
+            # staging tables are private to this transaction, loading them does not touch the live tables
+            await connection.execute_script(
+                """
+                CREATE TEMP TABLE staging_discordrole (LIKE discord_discordrole INCLUDING DEFAULTS) ON COMMIT DROP;
+                CREATE TEMP TABLE staging_discordmember (LIKE discord_discordmember INCLUDING DEFAULTS) ON COMMIT DROP;
+                CREATE TEMP TABLE staging_discordmember_roles (discordmember_id bigint, discordrole_id bigint)
+                ON COMMIT DROP;
+                """
+            )
+            await copy_rows(connection, DiscordRole, fresh_roles, table="staging_discordrole")
+            await copy_rows(connection, DiscordMember, fresh_members, table="staging_discordmember")
+            await copy_records(
+                connection, "staging_discordmember_roles", ROLE_MEMBER_COLUMNS, self.build_role_member_pairs()
+            )
+            await connection.execute_script(
+                "ANALYZE staging_discordrole; ANALYZE staging_discordmember; ANALYZE staging_discordmember_roles;"
+            )
+            new_member_ids = [
+                _["id"]
+                for _ in await connection.execute_query_dict(
+                    """
+                    SELECT s.id FROM staging_discordmember AS s
+                    WHERE NOT EXISTS (SELECT 1 FROM discord_discordmember AS m WHERE m.id = s.id)
+                    """
+                )
+            ]
+            # merge with short set-based statements, only changed rows are written and locked
+            changed_roles = await merge_staging_rows(connection, DiscordRole, "staging_discordrole", role_columns)
+            changed_members = await merge_staging_rows(
+                connection, DiscordMember, "staging_discordmember", member_columns
+            )
+            _, deleted_links = await connection.execute_query(
+                """
+                DELETE FROM discord_discordmember_roles AS l
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM staging_discordmember_roles AS s
+                    WHERE s.discordmember_id = l.discordmember_id AND s.discordrole_id = l.discordrole_id
+                )
+                RETURNING l.id
+                """
+            )
+            _, created_links = await connection.execute_query(
+                """
+                INSERT INTO discord_discordmember_roles (discordmember_id, discordrole_id)
+                SELECT s.discordmember_id, s.discordrole_id FROM staging_discordmember_roles AS s
+                ON CONFLICT (discordmember_id, discordrole_id) DO NOTHING
+                RETURNING id
+                """
+            )
+            _, deleted_members = await connection.execute_query(
+                """
+                DELETE FROM discord_discordmember AS m
+                WHERE NOT EXISTS (SELECT 1 FROM staging_discordmember AS s WHERE s.id = m.id)
+                RETURNING m.id
+                """
+            )
+            _, deleted_roles = await connection.execute_query(
+                """
+                DELETE FROM discord_discordrole AS r
+                WHERE NOT EXISTS (SELECT 1 FROM staging_discordrole AS s WHERE s.id = r.id)
+                RETURNING r.id
+                """
+            )
+            if new_member_ids:
+                await refresh_engagement_windows(
+                    connection, datetime.utcnow().date(), self.engagement_score_thresholds, new_member_ids
+                )
+        logging.info(
+            f":::discord_management: synced "
+            f"roles ~{len(changed_roles)} -{len(deleted_roles)}, "
+            f"members ~{len(changed_members)} (+{len(new_member_ids)}) -{len(deleted_members)}, "
+            f"role links +{len(created_links)} -{len(deleted_links)}"
+        )
+        return None
+
+    def is_synced_guild(self, guild: discord.Guild) -> bool:
+        return self.guild is not None and guild.id == self.guild.id
+
+    async def save_member_to_db(self, member: discord.Member) -> None:
+        # write a single member and its role links through to the db
+        role_ids = {_.id for _ in member.roles if _.name != EVERYONE_ROLE}
+        async with in_transaction() as connection:
+            _, created = await DiscordMember.update_or_create(
+                id=member.id, defaults=self.build_member_row(member)
+            )
+            if created:
+                await refresh_engagement_windows(
+                    connection, datetime.utcnow().date(), self.engagement_score_thresholds, [member.id]
+                )
+            stored_role_ids = set(
+                await DiscordRoleMember.filter(discordmember_id=member.id).values_list("discordrole_id", flat=True)
+            )
+            if stored_role_ids - role_ids:
+                await DiscordRoleMember.filter(
+                    discordmember_id=member.id, discordrole_id__in=list(stored_role_ids - role_ids)
+                ).delete()
+            await DiscordRoleMember.bulk_create(
                 [
-                    DiscordRole(
-                        id=_.id,
-                        name=_.name,
-                        position=_.position,
-                        created_at=_.created_at,
-                    )
-                    for _ in self.roles
-                    if _.name != EVERYONE_ROLE
+                    DiscordRoleMember(discordmember_id=member.id, discordrole_id=role_id)
+                    for role_id in role_ids - stored_role_ids
                 ]
             )
-            # sync members
-            await DiscordMember.bulk_create(
+        return None
+
+    async def refresh_members_roles(self, connection: BaseDBAsyncClient, role_id: int) -> None:
+        # recompute denormalized roles of the members having a renamed, moved or deleted role,
+        # they are found through the GIN index on roles_ids
+        await connection.execute_query(
+            """
+            UPDATE discord_discordmember AS m
+            SET roles_ids = ARRAY(
+                    SELECT r.id FROM discord_discordrole AS r WHERE r.id = ANY(m.roles_ids) ORDER BY r.id
+                ),
+                roles_names = COALESCE(
+                    (
+                        SELECT string_agg(r.name, ', ' ORDER BY r.position DESC)
+                        FROM discord_discordrole AS r WHERE r.id = ANY(m.roles_ids)
+                    ),
+                    ''
+                )
+            WHERE m.roles_ids @> ARRAY[$1]::bigint[]
+            """,
+            [role_id],
+        )
+        return None
+
+    async def delete_member_from_db(self, member_id: int) -> None:
+        async with in_transaction():
+            await DiscordRoleMember.filter(discordmember_id=member_id).delete()
+            await DiscordMember.filter(id=member_id).delete()
+        return None
+
+    async def store_member(self, member_id: int, member: Optional[discord.Member]) -> None:
+        if member is None:
+            self.bot.discord_members.pop(member_id, None)
+            await self.delete_member_from_db(member_id)
+        else:
+            self.bot.discord_members[member_id] = member
+            await self.save_member_to_db(member)
+        return None
+
+    async def write_member(self, member_id: int, member: Optional[discord.Member]) -> None:
+        # a running reconciliation would overwrite this change with its older snapshot, the event is replayed after it
+        if self.reconciling:
+            self.buffered_members[member_id] = member
+            # the in-memory cache is fresh meanwhile, it is overwritten by the snapshot and fixed up by the replay
+            if member is None:
+                self.bot.discord_members.pop(member_id, None)
+            else:
+                self.bot.discord_members[member_id] = member
+            return None
+        await self.store_member(member_id, member)
+        return None
+
+    async def apply_buffered_members(self) -> None:
+        while self.buffered_members:
+            member_id, member = self.buffered_members.popitem()
+            try:
+                await self.store_member(member_id, member)
+            except Exception as e:
+                logging.debug(f":::discord_management: {e}")
+                capture_exception(e)
+        # no await since the buffer was found empty, events from now on are written through
+        self.reconciling = False
+        return None
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member) -> None:
+        if self.is_synced_guild(member.guild):
+            await self.write_member(member.id, member)
+        return None
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        if self.is_synced_guild(after.guild):
+            await self.write_member(after.id, after)
+        return None
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member) -> None:
+        if self.is_synced_guild(member.guild):
+            await self.write_member(member.id, None)
+        return None
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role: discord.Role) -> None:
+        if not self.is_synced_guild(role.guild) or role.name == EVERYONE_ROLE:
+            return None
+        async with self.sync_users_and_roles_lock:
+            await DiscordRole.update_or_create(id=role.id, defaults=self.build_role_row(role))
+        return None
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before: discord.Role, after: discord.Role) -> None:
+        if not self.is_synced_guild(after.guild) or after.name == EVERYONE_ROLE:
+            return None
+        async with self.sync_users_and_roles_lock:
+            async with in_transaction() as connection:
+                await DiscordRole.update_or_create(id=after.id, defaults=self.build_role_row(after))
+                if before.name != after.name or before.position != after.position:
+                    await self.refresh_members_roles(connection, after.id)
+        return None
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role) -> None:
+        if not self.is_synced_guild(role.guild):
+            return None
+        async with self.sync_users_and_roles_lock:
+            async with in_transaction() as connection:
+                await DiscordRoleMember.filter(discordrole_id=role.id).delete()
+                await DiscordRole.filter(id=role.id).delete()
+                await self.refresh_members_roles(connection, role.id)
+        return None
+
+    async def try_flush_messages_count(self) -> None:
+        with Hub(Hub.current):
+            try:
+                await self.flush_messages_count()
+            except Exception as e:
+                logging.debug(f":::discord_management: {e}")
+                capture_exception(e)
+
+    async def flush_messages_count(self) -> None:
+        async with self.sync_message_data_lock:
+            if not self.pending_messages_count:
+                return None
+            await self.load_engagement_score_thresholds()
+            # swap buffers, so that listeners keep counting while the batch is written
+            pending_messages_count = self.pending_messages_count
+            self.pending_messages_count = defaultdict(lambda: 0, {})
+            pending_messages_buckets = self.pending_messages_buckets
+            self.pending_messages_buckets = defaultdict(lambda: 0, {})
+            self.pending_messages_events = 0
+            high_water_marks = {_: self.scanned_channels[_] for _, __ in pending_messages_count}
+            try:
+                await self.save_messages_count(pending_messages_count, pending_messages_buckets, high_water_marks)
+            except Exception:
+                # keep the batch for the next flush
+                for key, delta in pending_messages_count.items():
+                    self.pending_messages_count[key] += delta
+                for key, delta in pending_messages_buckets.items():
+                    self.pending_messages_buckets[key] += delta
+                raise
+            if self.bot.messages_count_cache is not None:
+                await self.bot.messages_count_cache.increment_counts(pending_messages_count)
+        return None
+
+    async def save_messages_count(
+        self,
+        pending_messages_count: Dict[Tuple[int, int], int],
+        pending_messages_buckets: Dict[Tuple[int, date], int],
+        high_water_marks: Dict[int, int],
+    ) -> None:
+        channels_messages_count: Dict[int, int] = defaultdict(lambda: 0, {})
+        for (channel_id, _), delta in pending_messages_count.items():
+            channels_messages_count[channel_id] += delta
+        member_ids = list({member_id for _, member_id in pending_messages_count})
+        members_messages_count = [self.bot.members_messages_count[_] for _ in member_ids]
+        async with in_transaction() as connection:
+            await connection.execute_query(
+                """
+                INSERT INTO discord_channelmessagescount (channel_id, member_id, messages_count)
+                SELECT channel_id, member_id, messages_count
+                FROM unnest($1::bigint[], $2::bigint[], $3::int[]) AS t (channel_id, member_id, messages_count)
+                ON CONFLICT (channel_id, member_id) DO UPDATE
+                SET messages_count = discord_channelmessagescount.messages_count + EXCLUDED.messages_count
+                """,
                 [
-                    DiscordMember(
-                        id=_.id,
-                        bot=_.bot,
-                        avatar_url=_.avatar_url,
-                        name=_.name,
-                        username=f"{_.name}#{_.discriminator}",
-                        discriminator=_.discriminator,
-                        engagement_score=calculate_engagement_score(self.bot.members_messages_count[_.id]),
-                        messages_count=self.bot.members_messages_count[_.id],
-                        age_of_account=humanize_readable_datetime(datetime.now(), _.created_at),
-                        nick=_.nick,
-                        pending=_.pending,
-                        premium_since=_.premium_since,
-                        joined_at=_.joined_at,
-                        created_at=_.created_at,
-                    )
-                    for _ in self.bot.discord_members
-                ]
+                    [channel_id for channel_id, _ in pending_messages_count],
+                    [member_id for _, member_id in pending_messages_count],
+                    list(pending_messages_count.values()),
+                ],
             )
-            # sync member roles
-            bulk_create_list = []
-            for member in self.bot.discord_members:
-                for role in member.roles:
-                    if role.name != EVERYONE_ROLE:
-                        bulk_create_list.append(
-                            DiscordRoleMember(
-                                discordmember_id=member.id,
-                                discordrole_id=role.id,
-                            )
-                        )
-            await DiscordRoleMember.bulk_create(bulk_create_list)
+            await connection.execute_query(
+                """
+                UPDATE discord_channelscan
+                SET last_message_id = GREATEST(discord_channelscan.last_message_id, t.last_message_id),
+                    messages_count = discord_channelscan.messages_count + t.messages_count,
+                    modified_at = now()
+                FROM unnest($1::bigint[], $2::bigint[], $3::int[]) AS t (channel_id, last_message_id, messages_count)
+                WHERE discord_channelscan.channel_id = t.channel_id
+                """,
+                [
+                    list(channels_messages_count.keys()),
+                    [high_water_marks[_] for _ in channels_messages_count],
+                    list(channels_messages_count.values()),
+                ],
+            )
+            # refresh denormalized counters without waiting for the next members sync
+            await connection.execute_query(
+                """
+                UPDATE discord_discordmember
+                SET messages_count = t.messages_count, engagement_score = t.engagement_score
+                FROM unnest($1::bigint[], $2::int[], $3::int[]) AS t (id, messages_count, engagement_score)
+                WHERE discord_discordmember.id = t.id
+                """,
+                [
+                    member_ids,
+                    members_messages_count,
+                    [
+                        int(calculate_engagement_score(_, self.engagement_score_thresholds))
+                        for _ in members_messages_count
+                    ],
+                ],
+            )
+            await save_messages_buckets(connection, pending_messages_buckets)
+            await add_to_engagement_windows(
+                connection, pending_messages_buckets, self.engagement_day, self.engagement_score_thresholds
+            )
+        return None
+
+    def count_live_message(self, message: discord.Message, delta: int) -> None:
+        self.bot.members_messages_count[message.author.id] += delta
+        high_water_mark = self.scanned_channels.get(message.channel.id)
+        if high_water_mark is None:
+            return None  # channel history is not scanned yet, the scan will count this message
+        if delta > 0 and message.id > high_water_mark:
+            self.scanned_channels[message.channel.id] = message.id
+        elif delta < 0 and message.id > high_water_mark:
+            return None  # message was never persisted
+        self.pending_messages_count[(message.channel.id, message.author.id)] += delta
+        if message.created_at.date() > pruned_day(datetime.utcnow().date()):
+            self.pending_messages_buckets[(message.author.id, message.created_at.date())] += delta
+        self.pending_messages_events += 1
+        if (
+            self.pending_messages_events >= config.MESSAGES_FLUSH_EVENTS
+            and self.message_data_ready.is_set()
+            and not self.sync_message_data_lock.locked()
+        ):
+            asyncio.create_task(self.try_flush_messages_count())
         return None
 
     @commands.Cog.listener()
@@ -136,7 +738,7 @@ class SyncDiscord(commands.Cog):
         if not message.guild:
             return None
         # handle counting new messages
-        self.bot.members_messages_count[message.author.id] += 1
+        self.count_live_message(message, 1)
         return None
 
     @commands.Cog.listener()
@@ -145,7 +747,7 @@ class SyncDiscord(commands.Cog):
         if not message.guild:
             return None
         # handle counting deleted messages
-        self.bot.members_messages_count[message.author.id] -= 1
+        self.count_live_message(message, -1)
         return None
 
 
@@ -1,14 +1,37 @@
 import logging
 import asyncio
+from contextlib import suppress
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import discord
+from tortoise import timezone
 from sentry_sdk import capture_exception, Hub
 from discord.ext import commands, tasks
 
 import config
-from constants import GUILD_INDEX
+from constants import GUILD_INDEX, TORTOISE_ORM
 from app.models import Task, Settings
-from app.constants import TaskStatusChoices, TaskTypesChoices, SETTINGS_SINGLETON_ID
+from app.executor import AdaptiveLimiter, RateLimitListener, run_worker_pool
+from app.task_ledger import TaskLedger
+from app.task_queue import (
+    TaskLease,
+    TaskLeaseLost,
+    claim_tasks,
+    resolve_members_filter,
+    save_resolved_members,
+    update_leased_task,
+)
+from app.task_planner import MemberPlan, TasksPlan
+from app.notifications import TasksListener
+from app.constants import (
+    TaskStatusChoices,
+    TaskTypesChoices,
+    TaskMemberResultStatusChoices,
+    SETTINGS_SINGLETON_ID,
+    TASKS_CLAIM_BATCH_SIZE,
+    TASKS_LISTEN_RETRY_SECONDS,
+    TASK_SLICE_SIZE,
+)
 
 
 class TasksCog(commands.Cog):
@@ -16,12 +39,21 @@ class TasksCog(commands.Cog):
         self.bot: commands.Bot = bot
         self.lock = asyncio.Lock()
         self.guild: discord.Guild
+        # adapt concurrency of member actions to rate limits reported by discord.py
+        self.limiter = AdaptiveLimiter(maximum=config.TASKS_CONCURRENCY)
+        self.rate_limit_listener = RateLimitListener(self.limiter)
+        logging.getLogger("discord.http").addHandler(self.rate_limit_listener)
+        self.tasks_listener = TasksListener(TORTOISE_ORM["connections"]["default"])
+        # ledgers of the tasks re-queued by the last batch, a task claimed again keeps its results in memory
+        self.ledgers: Dict[int, TaskLedger] = {}
         self.execute_tasks_job.start()
 
     def cog_unload(self):
         self.execute_tasks_job.cancel()
+        logging.getLogger("discord.http").removeHandler(self.rate_limit_listener)
+        self.bot.loop.create_task(self.tasks_listener.close())
 
-    @tasks.loop(seconds=config.TASKS_SCAN_SECONDS)
+    @tasks.loop(seconds=0)
     async def execute_tasks_job(self):
         with Hub(Hub.current):
             # ensure that only one instance of job is running, other instances will be discarded
@@ -34,6 +66,14 @@ class TasksCog(commands.Cog):
                     capture_exception(e)
                 finally:
                     self.lock.release()
+            # sleep until the backend queues a task, or until the safety net poll
+            try:
+                await self.tasks_listener.wait(config.TASKS_POLL_SECONDS)
+            except Exception as e:
+                # an exception escaping the loop would stop the executor for good, fall back to polling
+                logging.warning(f":::discord_management: unable to wait for queued tasks: {e}")
+                capture_exception(e)
+                await asyncio.sleep(TASKS_LISTEN_RETRY_SECONDS)
 
     @execute_tasks_job.before_loop
     async def before_execute_tasks_job(self):
@@ -41,42 +81,195 @@ class TasksCog(commands.Cog):
         self.guild = self.bot.guilds[GUILD_INDEX]
 
     async def execute_tasks(self) -> None:
-        tasks = await Task.filter(status=TaskStatusChoices.IN_QUEUE)
         settings, _ = await Settings.get_or_create(id=SETTINGS_SINGLETON_ID)
+        # claim a few tasks at a time, other bot processes drain the same queue in parallel
+        while True:
+            tasks = await claim_tasks(config.WORKER_ID, TASKS_CLAIM_BATCH_SIZE)
+            if not tasks:
+                break
+            await self.execute_claimed_tasks(tasks, settings)
+
+    async def execute_claimed_tasks(self, tasks: List[Task], settings: Settings) -> None:
+        # an error fails the task it comes from, the other claimed tasks go on
+        errors: Dict[int, Exception] = {}
+        ledgers: Dict[int, TaskLedger] = {}
+        previous_ledgers, self.ledgers = self.ledgers, {}
+        try:
+            for task in tasks:
+                try:
+                    ledgers[task.id] = await self.prepare_task(task, previous_ledgers.get(task.id))
+                except TaskLeaseLost:
+                    raise
+                except Exception as e:
+                    errors[task.id] = e
+            # the whole batch is a slice of at most TASK_SLICE_SIZE members shared in queue order,
+            # urgent tasks queued meanwhile wait for this slice only
+            slices, budget = {}, TASK_SLICE_SIZE
+            for task_id, ledger in ledgers.items():
+                slices[task_id] = ledger.pending_members_ids(budget)
+                budget -= len(slices[task_id])
+            plan = TasksPlan([task for task in tasks if task.id in ledgers], slices)
+            # members whose cached roles already match are skipped without an API call
+            unchanged = plan.drop_unchanged(self.get_members_roles_ids(plan.members))
+            logging.info(
+                f":::discord_management: tasks {list(ledgers)} planned with {plan.calls_count} "
+                f"API calls, {plan.saved_calls_count} saved ({len(unchanged)} members already up to date)"
+            )
+            async with TaskLease(tasks, config.WORKER_ID) as lease:
+
+                async def record(
+                    task_id: int,
+                    member_id: int,
+                    status: TaskMemberResultStatusChoices,
+                    error: Optional[str] = None,
+                ) -> None:
+                    if task_id in errors:
+                        return None
+                    try:
+                        await ledgers[task_id].record(member_id, status, error)
+                    except TaskLeaseLost:
+                        raise
+                    except Exception as e:
+                        errors[task_id] = e
+                    return None
+
+                for member_plan in unchanged:
+                    for task_id in member_plan.tasks_ids:
+                        await record(task_id, member_plan.member_id, TaskMemberResultStatusChoices.UNCHANGED)
+
+                async def execute(member_plan: MemberPlan) -> None:
+                    lease.check()
+                    status, error = await self.execute_member_plan(member_plan, settings)
+                    for task_id in member_plan.tasks_ids:
+                        await record(task_id, member_plan.member_id, status, error)
+                    for task_id in member_plan.superseded_tasks_ids:
+                        await record(task_id, member_plan.member_id, TaskMemberResultStatusChoices.SKIPPED)
+
+                try:
+                    await run_worker_pool(plan.members.values(), execute, config.TASKS_CONCURRENCY, self.limiter)
+                finally:
+                    for task_id, ledger in ledgers.items():
+                        try:
+                            with suppress(TaskLeaseLost):
+                                await ledger.flush()
+                        except Exception as e:
+                            errors.setdefault(task_id, e)
+        except TaskLeaseLost as e:
+            logging.warning(f":::discord_management: {e}")
+            return None
+        except Exception as e:
+            # not caused by a single task, they stay leased and are taken over once the lease expires
+            logging.warning(f":::discord_management: tasks {[task.id for task in tasks]} interrupted: {e}")
+            capture_exception(e)
+            return None
         for task in tasks:
             try:
-                # set task status to "started"
-                task.status = TaskStatusChoices.STARTED
-                await task.save(update_fields=["status", "modified_at"])
-                for member_id in task.members_ids:
-                    try:
-                        member = self.guild.get_member(member_id)
-                        if not member:
-                            member = await self.guild.fetch_member(member_id)
-                        if task.task_type == TaskTypesChoices.KICK:
-                            await self.guild.kick(user=member, reason="Discord_Management")
-                        elif task.task_type == TaskTypesChoices.ASSIGN_ROLE:
-                            roles = [self.guild.get_role(_) for _ in task.roles_ids]
-                            await member.add_roles(*roles, reason="Discord_Management")
-                        elif task.task_type == TaskTypesChoices.REMOVE_ROLE:
-                            roles = [self.guild.get_role(_) for _ in task.roles_ids]
-                            await member.remove_roles(*roles, reason="Discord_Management")
-                        elif task.task_type == TaskTypesChoices.BAN:
-                            await self.guild.ban(
-                                user=member,
-                                reason="Discord_Management",
-                                delete_message_days=settings.delete_message_days_when_banned,
-                            )
-                    except discord.errors.NotFound:
-                        pass  # ignore errors related to not found members
-                # set task status to "finished"
-                task.status = TaskStatusChoices.FINISHED
-                await task.save(update_fields=["status", "modified_at"])
+                await self.finish_task_slice(task, ledgers.get(task.id), errors.get(task.id), bool(slices.get(task.id)))
+            except TaskLeaseLost as e:
+                logging.warning(f":::discord_management: {e}")
             except Exception as e:
-                task.error = str(e)
-                task.status = TaskStatusChoices.FAILED
-                await task.save(update_fields=["error", "status", "modified_at"])
                 capture_exception(e)
+        return None
+
+    async def prepare_task(self, task: Task, previous_ledger: Optional[TaskLedger] = None) -> TaskLedger:
+        if task.members_filter is not None:
+            # "select all" targets are resolved once, later slices and retries reuse the stored ids
+            task.members_ids = await resolve_members_filter(task.members_filter)
+            task.members_filter = None
+            task.members_count = len(task.members_ids)
+            await save_resolved_members(task)
+        elif task.members_count != len(task.members_ids):
+            task.members_count = len(task.members_ids)
+            await update_leased_task(task, members_count=task.members_count)
+        if previous_ledger is not None and previous_ledger.task.processed_count == task.processed_count:
+            # nobody processed members of the task since this worker ran its previous slice
+            return TaskLedger(task, previous_ledger.done_ids)
+        # members processed before an interruption or by a crashed worker are skipped
+        return await TaskLedger.load(task)
+
+    async def finish_task_slice(
+        self, task: Task, ledger: Optional[TaskLedger], error: Optional[Exception], had_turn: bool
+    ) -> None:
+        if error is not None:
+            capture_exception(error)
+            await update_leased_task(
+                task,
+                status=TaskStatusChoices.FAILED,
+                error=str(error),
+                locked_by=None,
+                locked_until=None,
+                finished_at=timezone.now(),
+            )
+            return None
+        if had_turn:
+            logging.info(
+                f":::discord_management: task {task.id} ran {ledger.actions_count} actions "
+                f"in {ledger.recorded_at - ledger.started_at:.1f}s ({ledger.actions_per_second:.1f} actions/sec), "
+                f"{task.processed_count} of {task.members_count} members processed"
+            )
+        if ledger.pending_members_ids(1):
+            # back to the end of its priority class for the next slice, tasks left out of the slice keep their turn
+            await update_leased_task(
+                task,
+                status=TaskStatusChoices.IN_QUEUE,
+                locked_by=None,
+                locked_until=None,
+                queued_at=timezone.now() if had_turn else task.queued_at,
+            )
+            self.ledgers[task.id] = ledger
+            return None
+        # set task status to "finished", or "failed" when some members could not be processed
+        if task.failed_count:
+            status = TaskStatusChoices.FAILED
+            error_message = f"{task.failed_count} of {task.members_count} members failed"
+        else:
+            status = TaskStatusChoices.FINISHED
+            error_message = None
+        await update_leased_task(
+            task, status=status, error=error_message, locked_by=None, locked_until=None, finished_at=timezone.now()
+        )
+        return None
+
+    def get_members_roles_ids(self, members_ids: Iterable[int]) -> Dict[int, Set[int]]:
+        # roles of members known to the gateway cache, kept up to date by member update events
+        members_roles_ids = {}
+        for member_id in members_ids:
+            member = self.guild.get_member(member_id)
+            if member:
+                members_roles_ids[member_id] = {role.id for role in member.roles[1:]}  # skip @everyone
+        return members_roles_ids
+
+    async def execute_member_plan(
+        self, member_plan: MemberPlan, settings: Settings
+    ) -> Tuple[TaskMemberResultStatusChoices, Optional[str]]:
+        try:
+            member = self.guild.get_member(member_plan.member_id)
+            if not member:
+                member = await self.guild.fetch_member(member_plan.member_id)
+            if member_plan.punishment == TaskTypesChoices.KICK:
+                await self.guild.kick(user=member, reason="Discord_Management")
+            elif member_plan.punishment == TaskTypesChoices.BAN:
+                await self.guild.ban(
+                    user=member,
+                    reason="Discord_Management",
+                    delete_message_days=settings.delete_message_days_when_banned,
+                )
+            else:
+                # every role change of every claimed task is applied with a single request
+                roles_ids = {role.id for role in member.roles[1:]}  # skip @everyone
+                if member_plan.is_unchanged(roles_ids):
+                    return TaskMemberResultStatusChoices.UNCHANGED, None
+                roles_ids = (roles_ids - member_plan.remove_roles_ids) | member_plan.add_roles_ids
+                await member.edit(roles=[discord.Object(id=_) for _ in roles_ids], reason="Discord_Management")
+        except discord.errors.NotFound:
+            return TaskMemberResultStatusChoices.NOT_FOUND, None  # member already left the guild
+        except discord.errors.Forbidden as e:
+            return TaskMemberResultStatusChoices.FORBIDDEN, str(e)
+        except Exception as e:
+            # a single member must not fail the whole task, it can be retried from the admin
+            capture_exception(e)
+            return TaskMemberResultStatusChoices.ERROR, str(e)
+        return TaskMemberResultStatusChoices.DONE, None
 
 
 def setup(bot):
@@ -0,0 +1,242 @@
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import discord
+
+# characters commonly used to imitate latin letters, applied after NFKC normalization and casefolding
+CONFUSABLES = str.maketrans(
+    {
+        **dict(zip("авеёкмнорстухіїјѕԁԛԝ", "abeekmhopctyxlljsdqw")),  # cyrillic
+        **dict(zip("αβεηικνορτυχ", "abenlkvoptux")),  # greek
+        **dict(zip("ᴀʙᴄᴅᴇɢʜɪᴊᴋʟᴍɴᴏᴘʀꜱᴛᴜᴠᴡʏᴢ", "abcdeghljklmnoprstuvwyz")),  # small capitals
+        **dict(zip("0134578@$|!", "oleastbasll")),  # digits and symbols
+        "i": "l",  # "i" and "l" are hard to tell apart in most fonts
+    }
+)
+# sequences rendered like a single letter
+CONFUSABLE_SEQUENCES = (("rn", "m"), ("vv", "w"))
+
+
+def normalize_name(name: str) -> str:
+    """Skeleton of a name: compatibility forms, case, accents, homoglyphs and separators are folded away"""
+    name = unicodedata.normalize("NFKD", unicodedata.normalize("NFKC", name).casefold())
+    name = "".join(_ for _ in name if not unicodedata.combining(_)).translate(CONFUSABLES)
+    name = "".join(_ for _ in name if _.isalnum())
+    for sequence, replacement in CONFUSABLE_SEQUENCES:
+        name = name.replace(sequence, replacement)
+    return name
+
+
+class AhoCorasick:
+    """Finds every pattern occurring in a text in a single pass, whatever the number of patterns"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.transitions: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[Set[str]] = [set()]
+        for pattern in patterns:
+            self.add(pattern)
+        self.build()
+
+    def add(self, pattern: str) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self.transitions[state]:
+                self.transitions.append({})
+                self.fail.append(0)
+                self.outputs.append(set())
+                self.transitions[state][char] = len(self.transitions) - 1
+            state = self.transitions[state][char]
+        self.outputs[state].add(pattern)
+        return None
+
+    def build(self) -> None:
+        # breadth first, the fail link of a state points to its longest proper suffix present in the trie
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.transitions[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.transitions[fail].get(char, 0)
+                self.outputs[next_state] |= self.outputs[self.fail[next_state]]
+        return None
+
+    def search(self, text: str) -> Set[str]:
+        matches = set()
+        state = 0
+        for char in text:
+            while state and char not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(char, 0)
+            matches |= self.outputs[state]
+        return matches
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"##{word}##"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigrams to words, finds words within an edit distance without comparing with all of them.
+    One edit destroys at most three trigrams of a word, so a word within distance k of a query shares
+    at least len(trigrams(query)) - 3k of its trigrams, only those candidates are compared.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Set[str]] = {}
+
+    def add(self, word: str) -> None:
+        for trigram in trigrams(word):
+            self.postings.setdefault(trigram, set()).add(word)
+        return None
+
+    def remove(self, word: str) -> None:
+        for trigram in trigrams(word):
+            self.postings[trigram].discard(word)
+            if not self.postings[trigram]:
+                del self.postings[trigram]
+        return None
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[str, int]]:
+        word_trigrams = trigrams(word)
+        min_shared = len(word_trigrams) - 3 * max_distance
+        shared: Dict[str, int] = {}
+        for trigram in word_trigrams:
+            for candidate in self.postings.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        if min_shared <= 0:
+            # short words within the distance may share no trigram at all, every word is a candidate
+            for candidate in set().union(*self.postings.values()):
+                shared.setdefault(candidate, 0)
+        found = []
+        for candidate, count in shared.items():
+            if count >= min_shared and abs(len(candidate) - len(word)) <= max_distance:
+                distance = levenshtein(word, candidate)
+                if distance <= max_distance:
+                    found.append((candidate, distance))
+        return found
+
+
+class Suspect:
+    """Member whose name is close to a protected name without containing it"""
+
+    def __init__(self, member_id: int, protected_name: str, skeleton: str, distance: int):
+        self.member_id = member_id
+        self.protected_name = protected_name
+        self.skeleton = skeleton
+        self.distance = distance
+        # 1 for an exact skeleton, lower with every edit relative to the protected name length
+        self.score = 1 - distance / len(normalize_name(protected_name))
+
+
+class ImpersonationDetector:
+    """
+    Matches member names and nicks against protected names after confusable normalization.
+    Normalized names are cached per member and recomputed only when the name or the nick changes,
+    they are also indexed by trigrams to find names within an edit distance of protected names.
+    """
+
+    def __init__(self, protected_names: Iterable[str], whitelisted_ids: Iterable[int], max_distance: int = 0):
+        self.protected_names = {normalize_name(_): _ for _ in protected_names if normalize_name(_)}
+        self.automaton = AhoCorasick(self.protected_names)
+        self.whitelisted_ids = set(whitelisted_ids)
+        self.max_distance = max_distance
+        self.cache: Dict[int, Tuple[Tuple[str, Optional[str]], Set[str], Set[str]]] = {}
+        self.skeletons: Dict[str, Set[int]] = {}  # normalized name, members ids
+        self.index = TrigramIndex()
+
+    def allowed_distance(self, skeleton: str) -> int:
+        # short names tolerate fewer edits, otherwise almost any short name would be a suspect
+        return min(self.max_distance, len(skeleton) // 4)
+
+    def update(self, member: discord.Member) -> Set[str]:
+        names = (member.name, member.nick)
+        cached = self.cache.get(member.id)
+        if cached is not None and cached[0] == names:
+            return cached[1]
+        if cached is not None:
+            self.unindex(member.id, cached[2])
+        skeletons = {normalize_name(_) for _ in names if _ is not None} - {""}
+        matches = set()
+        for skeleton in skeletons:
+            matches |= {self.protected_names[_] for _ in self.automaton.search(skeleton)}
+            if skeleton not in self.skeletons:
+                self.skeletons[skeleton] = set()
+                self.index.add(skeleton)
+            self.skeletons[skeleton].add(member.id)
+        self.cache[member.id] = (names, matches, skeletons)
+        return matches
+
+    def match(self, member: discord.Member) -> Set[str]:
+        """Protected names contained in the name or nick of a member, empty for whitelisted members"""
+        if member.id in self.whitelisted_ids or not self.protected_names:
+            return set()
+        return self.update(member)
+
+    def exact_match(self, member: discord.Member) -> List[Suspect]:
+        """Protected names contained in the name or nick of a member, as suspects at distance 0"""
+        if not self.match(member):
+            return []
+        return [
+            Suspect(member.id, self.protected_names[_], skeleton, 0)
+            for skeleton in self.cache[member.id][2]
+            for _ in self.automaton.search(skeleton)
+        ]
+
+    def fuzzy_match(self, member: discord.Member) -> List[Suspect]:
+        """Protected names within the allowed edit distance of the name or nick of a single member"""
+        if member.id in self.whitelisted_ids or not self.protected_names or not self.max_distance:
+            return []
+        self.update(member)
+        return [
+            Suspect(member.id, protected_name, skeleton, distance)
+            for skeleton in self.cache[member.id][2]
+            for protected_skeleton, protected_name in self.protected_names.items()
+            for distance in [levenshtein(skeleton, protected_skeleton)]
+            if 0 < distance <= self.allowed_distance(protected_skeleton)
+        ]
+
+    def fuzzy_suspects(self) -> List[Suspect]:
+        """Every indexed member within the allowed edit distance of a protected name, one index search per name"""
+        if not self.max_distance:
+            return []
+        return [
+            Suspect(member_id, protected_name, skeleton, distance)
+            for protected_skeleton, protected_name in self.protected_names.items()
+            for skeleton, distance in self.index.search(protected_skeleton, self.allowed_distance(protected_skeleton))
+            if distance > 0
+            for member_id in self.skeletons[skeleton]
+            if member_id not in self.whitelisted_ids
+        ]
+
+    def unindex(self, member_id: int, skeletons: Set[str]) -> None:
+        for skeleton in skeletons:
+            self.skeletons[skeleton].discard(member_id)
+            if not self.skeletons[skeleton]:
+                del self.skeletons[skeleton]
+                self.index.remove(skeleton)
+        return None
+
+    def forget(self, member_id: int) -> None:
+        cached = self.cache.pop(member_id, None)
+        if cached is not None:
+            self.unindex(member_id, cached[2])
+        return None
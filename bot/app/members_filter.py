@@ -0,0 +1,53 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.constants import SuspectSignalChoices, SuspectStatusChoices
+
+# lookups a "select all" member action can store, every lookup is a fixed condition and its value a parameter
+MEMBERS_FILTER_LOOKUPS: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+    "roles_ids__contains": ("m.roles_ids @> {}::bigint[]", lambda value: [int(_) for _ in value]),
+    **{
+        f"{field}__exact": (f"m.{field} = {{}}::int", int)
+        for field in ("engagement_score", "engagement_score_7d", "engagement_score_30d", "engagement_score_90d")
+    },
+    **{f"{field}__exact": (f"m.{field} = {{}}::boolean", bool) for field in ("pending", "bot")},
+    **{
+        f"{field}__{lookup}": (f"m.{field} {operator} {{}}::timestamptz", datetime.fromisoformat)
+        for field in ("joined_at", "created_at")
+        for lookup, operator in (("gte", ">="), ("lt", "<"))
+    },
+    "joined_at__isnull": ("(m.joined_at IS NULL) = {}::boolean", bool),
+}
+SEARCH_FIELDS = ("name", "discriminator", "nick", "username")  # search fields of the member changelist
+
+
+def like_pattern(term: str) -> str:
+    # the term is matched literally anywhere in the field, like the icontains lookup of the admin search
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def members_filter_sql(members_filter: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """
+    Query selecting ids of the members matched by a task filter, the counterpart of the member changelist filters.
+    A filter only holds lookups and values, unknown lookups are rejected.
+    """
+    conditions, args = [], []
+    for lookup, value in members_filter.items():
+        if lookup == "search":
+            # every term must be found in one of the search fields
+            for term in value:
+                args.append(like_pattern(term))
+                conditions.append("(" + " OR ".join(f"m.{_} ILIKE ${len(args)}" for _ in SEARCH_FIELDS) + ")")
+        elif lookup == "copied_avatar":
+            args += [SuspectSignalChoices.AVATAR.value, SuspectStatusChoices.DISMISSED.value]
+            conditions.append(
+                f"m.id IN (SELECT member_id FROM discord_impersonationsuspect "
+                f"WHERE signal = ${len(args) - 1} AND status <> ${len(args)})"
+            )
+        elif lookup in MEMBERS_FILTER_LOOKUPS:
+            condition, to_python = MEMBERS_FILTER_LOOKUPS[lookup]
+            args.append(to_python(value))
+            conditions.append(condition.format(f"${len(args)}"))
+        else:
+            raise ValueError(f"unknown members filter lookup {lookup!r}")
+    return f"SELECT m.id FROM discord_discordmember AS m WHERE {' AND '.join(conditions) or 'TRUE'}", args
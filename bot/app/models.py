@@ -1,7 +1,24 @@
+from typing import Tuple
+
 from tortoise import fields
 from tortoise.models import Model
 
-from app.constants import EngagementScoreChoices, TaskTypesChoices, TaskStatusChoices
+from app.constants import (
+    EngagementScoreChoices,
+    TaskTypesChoices,
+    TaskStatusChoices,
+    TaskPriorityChoices,
+    TaskMemberResultStatusChoices,
+    SuspectStatusChoices,
+    SuspectSignalChoices,
+    ENGAGEMENT_SCORE_THRESHOLDS,
+)
+
+
+class BigIntArrayField(fields.Field, list):
+    """Postgres bigint[] column, asyncpg encodes and decodes it natively"""
+
+    SQL_TYPE = "bigint[]"
 
 
 class Settings(Model):
@@ -9,6 +26,12 @@ class Settings(Model):
 
     id = fields.BigIntField(pk=True)
     delete_message_days_when_banned = fields.IntField(default=1)
+    # minimal messages count for every engagement score
+    engagement_score_1_threshold = fields.IntField(default=ENGAGEMENT_SCORE_THRESHOLDS[0])
+    engagement_score_2_threshold = fields.IntField(default=ENGAGEMENT_SCORE_THRESHOLDS[1])
+    engagement_score_3_threshold = fields.IntField(default=ENGAGEMENT_SCORE_THRESHOLDS[2])
+    engagement_score_4_threshold = fields.IntField(default=ENGAGEMENT_SCORE_THRESHOLDS[3])
+    engagement_score_5_threshold = fields.IntField(default=ENGAGEMENT_SCORE_THRESHOLDS[4])
 
     created_at = fields.DatetimeField(auto_now_add=True)
     modified_at = fields.DatetimeField(auto_now=True)
@@ -20,6 +43,16 @@ class Settings(Model):
     def __str__(self):
         return str(self.id)
 
+    @property
+    def engagement_score_thresholds(self) -> Tuple[int, ...]:
+        return (
+            self.engagement_score_1_threshold,
+            self.engagement_score_2_threshold,
+            self.engagement_score_3_threshold,
+            self.engagement_score_4_threshold,
+            self.engagement_score_5_threshold,
+        )
+
 
 class DiscordRole(Model):
     """Role table"""
@@ -50,9 +83,17 @@ class DiscordMember(Model):
     discriminator = fields.CharField(max_length=255)
     engagement_score = fields.IntEnumField(default=0, enum_type=EngagementScoreChoices)  # db denormalization
     messages_count = fields.IntField(default=0)
-    age_of_account = fields.CharField(max_length=255)  # a little bit of db denormalization
+    # rolling windows over daily messages buckets, see app.engagement
+    messages_count_7d = fields.IntField(default=0)
+    messages_count_30d = fields.IntField(default=0)
+    messages_count_90d = fields.IntField(default=0)
+    engagement_score_7d = fields.IntEnumField(default=0, enum_type=EngagementScoreChoices)
+    engagement_score_30d = fields.IntEnumField(default=0, enum_type=EngagementScoreChoices)
+    engagement_score_90d = fields.IntEnumField(default=0, enum_type=EngagementScoreChoices)
     nick = fields.CharField(max_length=255, null=True)
     roles = fields.ManyToManyField("app.DiscordRole", related_name="members", through="discord_discordmember_roles")
+    roles_ids = BigIntArrayField(default=list)  # denormalized roles, written by the sync with the role links
+    roles_names = fields.TextField(default="")
     pending = fields.BooleanField(default=False)
     premium_since = fields.DatetimeField(null=True)
     joined_at = fields.DatetimeField(null=True)
@@ -81,13 +122,75 @@ class DiscordRoleMember(Model):
         return self.id
 
 
+class ChannelScan(Model):
+    """Channel history scan progress table"""
+
+    channel_id = fields.BigIntField(pk=True)
+    last_message_id = fields.BigIntField(null=True)  # high-water mark of the history scan
+    messages_count = fields.IntField(default=0)
+
+    created_at = fields.DatetimeField(auto_now_add=True)
+    modified_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "discord_channelscan"
+
+    def __str__(self):
+        return str(self.channel_id)
+
+
+class ChannelMessagesCount(Model):
+    """Messages count per channel and member table"""
+
+    id = fields.BigIntField(pk=True)
+    channel_id = fields.BigIntField()
+    member_id = fields.BigIntField(index=True)
+    messages_count = fields.IntField(default=0)
+
+    class Meta:
+        table = "discord_channelmessagescount"
+        unique_together = ("channel_id", "member_id")
+
+    def __str__(self):
+        return f"{self.channel_id} - {self.member_id}"
+
+
+class MemberMessagesBucket(Model):
+    """Daily messages count per member table"""
+
+    id = fields.BigIntField(pk=True)
+    member_id = fields.BigIntField()
+    day = fields.DateField(index=True)
+    messages_count = fields.IntField(default=0)
+
+    class Meta:
+        table = "discord_membermessagesbucket"
+        unique_together = ("member_id", "day")
+
+    def __str__(self):
+        return f"{self.member_id} - {self.day}"
+
+
 class Task(Model):
     id = fields.BigIntField(pk=True)
     task_type = fields.CharEnumField(enum_type=TaskTypesChoices)
-    members_ids = fields.JSONField()
+    members_ids = BigIntArrayField(default=list)
+    members_filter = fields.JSONField(null=True)  # changelist filters of "select all", resolved when the task runs
     roles_ids = fields.JSONField(default=list)
     status = fields.CharEnumField(enum_type=TaskStatusChoices, default=TaskStatusChoices.IN_QUEUE)
     error = fields.TextField()
+    members_count = fields.IntField(default=0)
+    processed_count = fields.IntField(default=0)  # members with a result in the ledger
+    failed_count = fields.IntField(default=0)
+    skipped_count = fields.IntField(default=0)  # members left untouched because no API call was needed
+    cursor = fields.IntField(default=0)  # every member before this position in members_ids has a result
+    locked_by = fields.CharField(max_length=255, null=True)  # worker holding the lease of a started task
+    locked_until = fields.DatetimeField(null=True)
+    priority = fields.IntEnumField(enum_type=TaskPriorityChoices, default=TaskPriorityChoices.NORMAL)
+    # order within the priority class, renewed when a large task goes back to the queue after a slice
+    queued_at = fields.DatetimeField(auto_now_add=True)
+    started_at = fields.DatetimeField(null=True)
+    finished_at = fields.DatetimeField(null=True)
 
     created_at = fields.DatetimeField(auto_now_add=True)
     modified_at = fields.DatetimeField(auto_now=True)
@@ -98,3 +201,61 @@ class Task(Model):
 
     def __str__(self):
         return f"{self.task_type} - {self.status} ({self.created_at})"
+
+
+class TaskMemberResult(Model):
+    """Outcome of a task action per member, lets an interrupted task resume where it stopped"""
+
+    id = fields.BigIntField(pk=True)
+    task = fields.ForeignKeyField("app.Task", related_name="results")
+    member_id = fields.BigIntField()
+    status = fields.CharEnumField(enum_type=TaskMemberResultStatusChoices)
+    error = fields.TextField(null=True)
+
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "discord_taskmemberresult"
+        unique_together = ("task_id", "member_id")
+
+    def __str__(self):
+        return f"{self.task_id} - {self.member_id} - {self.status}"
+
+
+class ImpersonationSuspect(Model):
+    """Members whose name or avatar is close to a protected one, reviewed by a moderator unless banned automatically"""
+
+    id = fields.BigIntField(pk=True)
+    member_id = fields.BigIntField()
+    name = fields.CharField(max_length=255)
+    nick = fields.CharField(max_length=255, null=True)
+    protected_name = fields.CharField(max_length=255)
+    signal = fields.CharEnumField(enum_type=SuspectSignalChoices, default=SuspectSignalChoices.NAME)
+    distance = fields.IntField()
+    score = fields.FloatField()
+    status = fields.CharEnumField(enum_type=SuspectStatusChoices, default=SuspectStatusChoices.PENDING)
+
+    created_at = fields.DatetimeField(auto_now_add=True)
+    modified_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "discord_impersonationsuspect"
+        unique_together = ("member_id", "protected_name", "signal")
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.name} - {self.protected_name}"
+
+
+class AvatarHash(Model):
+    """Perceptual hashes of avatars by Discord avatar hash, an avatar is downloaded once"""
+
+    avatar = fields.CharField(max_length=255, pk=True)
+    phash = fields.BigIntField()  # 64 bits difference hash, stored signed
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "discord_avatarhash"
+
+    def __str__(self):
+        return self.avatar
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from typing import Optional
+
+import asyncpg
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.constants import TASKS_NOTIFY_CHANNEL, TASKS_LISTEN_RETRY_SECONDS
+
+
+async def notify_task_queued(connection: BaseDBAsyncClient, task_id: int) -> None:
+    # delivered to listeners when the surrounding transaction commits
+    await connection.execute_query("SELECT pg_notify($1, $2)", [TASKS_NOTIFY_CHANNEL, str(task_id)])
+    return None
+
+
+class TasksListener:
+    """
+    Wakes the tasks executor as soon as a task is queued, through Postgres LISTEN/NOTIFY.
+    Uses its own asyncpg connection, a pooled one would be held forever.
+    When the connection is lost, the queue is polled every TASKS_LISTEN_RETRY_SECONDS until it is re-established.
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.connection: Optional[asyncpg.Connection] = None
+        self.queued = asyncio.Event()
+
+    async def listen(self) -> bool:
+        if self.connection is not None and not self.connection.is_closed():
+            return True
+        await self.close()
+        try:
+            self.connection = await asyncpg.connect(self.dsn)
+            await self.connection.add_listener(TASKS_NOTIFY_CHANNEL, self.on_notification)
+            self.connection.add_termination_listener(self.on_termination)
+        except Exception as e:
+            # whatever the failure, the executor keeps polling and the next wait tries again
+            logging.warning(f":::discord_management: unable to listen for queued tasks: {e}")
+            await self.close()
+            return False
+        # tasks may have been queued while nobody was listening
+        self.queued.set()
+        return True
+
+    def on_notification(self, connection: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        self.queued.set()
+
+    def on_termination(self, connection: asyncpg.Connection) -> None:
+        # notifications sent from now on are lost, the queue is polled before listening again
+        logging.warning(":::discord_management: connection listening for queued tasks was closed")
+        self.queued.set()
+
+    async def wait(self, timeout: float) -> None:
+        if not await self.listen():
+            timeout = min(timeout, TASKS_LISTEN_RETRY_SECONDS)
+        try:
+            await asyncio.wait_for(self.queued.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.queued.clear()
+        return None
+
+    async def close(self) -> None:
+        connection, self.connection = self.connection, None
+        if connection is not None and not connection.is_closed():
+            connection.remove_termination_listener(self.on_termination)
+            try:
+                await connection.close(timeout=TASKS_LISTEN_RETRY_SECONDS)
+            except Exception:
+                connection.terminate()
+        return None
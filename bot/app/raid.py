@@ -0,0 +1,93 @@
+import re
+import datetime
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Set, Tuple
+
+import discord
+
+from app.impersonation import normalize_name
+from app.constants import RAID_NAME_STEM_LENGTH, RAID_CREATED_BUCKET_SECONDS, RAID_MAX_WINDOW_JOINS
+
+
+def raid_features(member: discord.Member) -> Set[Tuple[str, object]]:
+    """Features shared by accounts registered together: creation time, name stem and avatar"""
+    created_at = member.created_at.replace(tzinfo=datetime.timezone.utc)
+    features: Set[Tuple[str, object]] = {("created_at", int(created_at.timestamp()) // RAID_CREATED_BUCKET_SECONDS)}
+    # digits are dropped before normalization, otherwise counters would be folded into letters
+    stem = normalize_name(re.sub(r"\d+", "", member.name))[:RAID_NAME_STEM_LENGTH]
+    if len(stem) >= 3:
+        features.add(("name", stem))
+    # members without an avatar share the default one, it says nothing about them
+    if member.avatar is not None:
+        features.add(("avatar", member.avatar))
+    return features
+
+
+class JoinWindow:
+    """
+    Sliding window over recent joins of new accounts with a running count of each feature.
+    Every join costs O(1) amortized: it is appended, expired joins are popped from the left and counts adjusted.
+    The window holds at most max_joins joins, memory stays constant whatever the guild size or the raid size.
+    """
+
+    def __init__(self, window_seconds: float, max_joins: int, cluster_size: int):
+        self.window_seconds = window_seconds
+        self.max_joins = max_joins
+        self.cluster_size = cluster_size
+        self.joins: Deque[Tuple[float, int, Set[Tuple[str, object]]]] = deque()
+        self.counts: Dict[Tuple[str, object], int] = {}
+        self.reported: Set[Tuple[str, object]] = set()  # features of clusters already reported
+        self.flagged_ids: Set[int] = set()  # members of the window already reported as raiders
+
+    def expire(self, now: float) -> None:
+        while self.joins and (now - self.joins[0][0] > self.window_seconds or len(self.joins) >= self.max_joins):
+            _, member_id, features = self.joins.popleft()
+            self.flagged_ids.discard(member_id)
+            for feature in features:
+                self.counts[feature] -= 1
+                if not self.counts[feature]:
+                    del self.counts[feature]
+                    self.reported.discard(feature)
+        return None
+
+    def add(self, now: float, member_id: int, features: Set[Tuple[str, object]]) -> List[int]:
+        """Record a join and return members of the clusters it completes that were not reported yet"""
+        self.expire(now)
+        self.joins.append((now, member_id, features))
+        clusters = set()
+        for feature in features:
+            self.counts[feature] = self.counts.get(feature, 0) + 1
+            if self.counts[feature] >= self.cluster_size:
+                clusters.add(feature)
+        new_clusters = clusters - self.reported
+        if new_clusters:
+            # the window is only scanned when a cluster reaches its size, once per cluster
+            self.reported |= new_clusters
+            raiders_ids = [joined_id for _, joined_id, joined_features in self.joins if new_clusters & joined_features]
+        elif clusters:
+            # later members of a reported cluster are reported on their own
+            raiders_ids = [member_id]
+        else:
+            return []
+        raiders_ids = [_ for _ in dict.fromkeys(raiders_ids) if _ not in self.flagged_ids]
+        self.flagged_ids.update(raiders_ids)
+        return raiders_ids
+
+
+class RaidDetector:
+    """Flags clusters of new accounts joining within a short window with a similar creation time, name or avatar"""
+
+    def __init__(self, window_seconds: float, cluster_size: int, new_account_days: int, whitelisted_ids: Iterable[int]):
+        self.window = JoinWindow(window_seconds, RAID_MAX_WINDOW_JOINS, cluster_size)
+        self.new_account_age = datetime.timedelta(days=new_account_days)
+        self.whitelisted_ids = set(whitelisted_ids)
+
+    def add(self, member: discord.Member, now: float) -> List[int]:
+        """Record a join at a monotonic time, return ids of members found to be part of a raid"""
+        # established accounts are not raiders, they do not enter the window at all
+        if member.id in self.whitelisted_ids or member.bot:
+            return []
+        joined_at = member.joined_at or datetime.datetime.utcnow()
+        if joined_at - member.created_at > self.new_account_age:
+            return []
+        return self.window.add(now, member.id, raid_features(member))
@@ -0,0 +1,90 @@
+import time
+import asyncio
+from typing import List, Optional, Set
+
+from tortoise.transactions import in_transaction
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.models import Task, TaskMemberResult
+from app.task_queue import get_connection, update_leased_task
+from app.constants import TaskMemberResultStatusChoices, TASK_RESULTS_BATCH_SIZE
+
+FAILED_STATUSES = (TaskMemberResultStatusChoices.FORBIDDEN, TaskMemberResultStatusChoices.ERROR)
+SKIPPED_STATUSES = (TaskMemberResultStatusChoices.SKIPPED, TaskMemberResultStatusChoices.UNCHANGED)
+
+
+class TaskLedger:
+    """
+    Per member results of a task, persisted in batches together with the task progress while its lease is held.
+    Members that already have a result are skipped when an interrupted or retried task runs again.
+    """
+
+    def __init__(self, task: Task, done_ids: Set[int]):
+        self.task = task
+        self.done_ids = done_ids
+        self.results: List[TaskMemberResult] = []
+        self.lock = asyncio.Lock()
+        # throughput of the task in the current slice, tasks of a batch run together at their own pace
+        self.started_at = time.monotonic()
+        self.recorded_at = self.started_at
+        self.actions_count = 0  # members that took an API call, unchanged and superseded members are not counted
+
+    @classmethod
+    async def load(cls, task: Task, using_db: Optional[BaseDBAsyncClient] = None) -> "TaskLedger":
+        # members before the cursor all have a result, only results of the members after it are read
+        _, rows = await (using_db or get_connection()).execute_query(
+            "SELECT member_id FROM discord_taskmemberresult WHERE task_id = $1 AND member_id = ANY($2::bigint[])",
+            [task.id, task.members_ids[task.cursor :]],
+        )
+        return cls(task, {_["member_id"] for _ in rows})
+
+    def pending_members_ids(self, limit: Optional[int] = None) -> List[int]:
+        # members before the cursor all have a result, duplicated ids are processed once,
+        # the scan stops at the limit instead of walking the rest of a large task for every slice
+        members_ids, pending_ids = self.task.members_ids, {}
+        index = self.task.cursor
+        while index < len(members_ids) and (limit is None or len(pending_ids) < limit):
+            if members_ids[index] not in self.done_ids:
+                pending_ids[members_ids[index]] = None
+            index += 1
+        return list(pending_ids)
+
+    async def record(
+        self, member_id: int, status: TaskMemberResultStatusChoices, error: Optional[str] = None
+    ) -> None:
+        self.results.append(TaskMemberResult(task_id=self.task.id, member_id=member_id, status=status, error=error))
+        self.recorded_at = time.monotonic()
+        if status not in SKIPPED_STATUSES:
+            self.actions_count += 1
+        if len(self.results) >= TASK_RESULTS_BATCH_SIZE:
+            await self.flush()
+        return None
+
+    @property
+    def actions_per_second(self) -> float:
+        elapsed = self.recorded_at - self.started_at
+        return self.actions_count / elapsed if elapsed > 0 else 0.0
+
+    async def flush(self) -> None:
+        async with self.lock:
+            results, self.results = self.results, []
+            if not results:
+                return None
+            self.done_ids.update(_.member_id for _ in results)
+            self.task.processed_count += len(results)
+            self.task.failed_count += sum(_.status in FAILED_STATUSES for _ in results)
+            self.task.skipped_count += sum(_.status in SKIPPED_STATUSES for _ in results)
+            members_ids = self.task.members_ids
+            while self.task.cursor < len(members_ids) and members_ids[self.task.cursor] in self.done_ids:
+                self.task.cursor += 1
+            async with in_transaction() as connection:
+                await TaskMemberResult.bulk_create(results, using_db=connection)
+                await update_leased_task(
+                    self.task,
+                    using_db=connection,
+                    processed_count=self.task.processed_count,
+                    failed_count=self.task.failed_count,
+                    skipped_count=self.task.skipped_count,
+                    cursor=self.task.cursor,
+                )
+        return None
@@ -0,0 +1,96 @@
+from typing import Dict, List, Optional, Set
+
+from app.models import Task
+from app.constants import TaskTypesChoices
+
+PUNISHMENTS = (TaskTypesChoices.BAN, TaskTypesChoices.KICK)  # by precedence, a ban supersedes a kick
+
+
+class MemberPlan:
+    """Net effect of every claimed task on a single member, executed with one API call"""
+
+    def __init__(self, member_id: int):
+        self.member_id = member_id
+        self.punishment: Optional[TaskTypesChoices] = None
+        self.add_roles_ids: Set[int] = set()
+        self.remove_roles_ids: Set[int] = set()
+        self.tasks_ids: List[int] = []  # tasks applied by the API call
+        self.superseded_tasks_ids: List[int] = []  # tasks dropped because the member is kicked or banned
+
+    def add(self, task: Task) -> None:
+        if task.task_type in PUNISHMENTS:
+            if self.punishment is None or PUNISHMENTS.index(task.task_type) < PUNISHMENTS.index(self.punishment):
+                self.punishment = task.task_type
+        elif task.task_type == TaskTypesChoices.ASSIGN_ROLE:
+            # role changes are applied in queue order, the latest change of a role wins
+            self.add_roles_ids.update(task.roles_ids)
+            self.remove_roles_ids.difference_update(task.roles_ids)
+        elif task.task_type == TaskTypesChoices.REMOVE_ROLE:
+            self.remove_roles_ids.update(task.roles_ids)
+            self.add_roles_ids.difference_update(task.roles_ids)
+        self.tasks_ids.append(task.id)
+        return None
+
+    def is_unchanged(self, roles_ids: Set[int]) -> bool:
+        # member already has every role to add and none of the roles to remove
+        return (
+            self.punishment is None
+            and self.add_roles_ids <= roles_ids
+            and self.remove_roles_ids.isdisjoint(roles_ids)
+        )
+
+    def supersede(self, tasks: Dict[int, Task]) -> None:
+        # a removed member keeps no roles, only the strongest punishment is executed
+        if self.punishment is None:
+            return None
+        self.superseded_tasks_ids = [_ for _ in self.tasks_ids if tasks[_].task_type != self.punishment]
+        self.tasks_ids = [_ for _ in self.tasks_ids if tasks[_].task_type == self.punishment]
+        self.add_roles_ids.clear()
+        self.remove_roles_ids.clear()
+        return None
+
+
+def unplanned_calls_count(task: Task) -> int:
+    # kick and ban take one call per member, role tasks one call per member and role
+    if task.task_type in PUNISHMENTS:
+        return 1
+    return len(task.roles_ids)
+
+
+class TasksPlan:
+    """
+    Coalesces claimed tasks into one plan per member.
+    Tasks must be given in queue order, members are given per task without the ones already processed.
+    """
+
+    def __init__(self, tasks: List[Task], pending_members_ids: Dict[int, List[int]]):
+        self.members: Dict[int, MemberPlan] = {}
+        self.unplanned_calls_count = 0
+        tasks_by_id = {task.id: task for task in tasks}
+        for task in tasks:
+            for member_id in pending_members_ids[task.id]:
+                if member_id not in self.members:
+                    self.members[member_id] = MemberPlan(member_id)
+                self.members[member_id].add(task)
+                self.unplanned_calls_count += unplanned_calls_count(task)
+        for member_plan in self.members.values():
+            member_plan.supersede(tasks_by_id)
+
+    def drop_unchanged(self, members_roles_ids: Dict[int, Set[int]]) -> List[MemberPlan]:
+        """Remove and return plans of members whose known roles already match, they need no API call"""
+        unchanged = [
+            member_plan
+            for member_id, member_plan in self.members.items()
+            if member_id in members_roles_ids and member_plan.is_unchanged(members_roles_ids[member_id])
+        ]
+        for member_plan in unchanged:
+            del self.members[member_plan.member_id]
+        return unchanged
+
+    @property
+    def calls_count(self) -> int:
+        return len(self.members)
+
+    @property
+    def saved_calls_count(self) -> int:
+        return self.unplanned_calls_count - self.calls_count
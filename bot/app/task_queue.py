@@ -0,0 +1,155 @@
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from tortoise import Tortoise, timezone
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from app.models import Task
+from app.members_filter import members_filter_sql
+from app.constants import (
+    TaskStatusChoices,
+    TaskTypesChoices,
+    TASK_LEASE_SECONDS,
+    TASK_LEASE_RENEW_SECONDS,
+    MEMBERS_QUERY_BATCH_SIZE,
+)
+
+
+class TaskLeaseLost(Exception):
+    """Raised when another worker took over the task because its lease expired"""
+
+
+def get_connection() -> BaseDBAsyncClient:
+    return Tortoise.get_connection("default")
+
+
+async def claim_tasks(worker_id: str, limit: int) -> List[Task]:
+    """
+    Atomically lease the most urgent runnable tasks to this worker, concurrent workers skip locked rows.
+    Started tasks whose lease expired belong to a crashed worker and are taken over.
+    queued_at only shares turns between tasks, a role change waits until every older unfinished task
+    changing the same role the other way on some of its members is done, whatever their slices.
+    """
+    rows = await get_connection().execute_query_dict(
+        """
+        UPDATE discord_task
+        SET status = $1, locked_by = $2, locked_until = now() + $3 * interval '1 second',
+            started_at = COALESCE(started_at, now()), modified_at = now()
+        WHERE id IN (
+            SELECT t.id FROM discord_task AS t
+            WHERE (t.status = $4 OR (t.status = $1 AND (t.locked_until IS NULL OR t.locked_until < now())))
+            AND NOT EXISTS (
+                SELECT 1 FROM discord_task AS o
+                WHERE o.id < t.id AND o.status IN ($1, $4)
+                AND ((o.task_type = $6 AND t.task_type = $7) OR (o.task_type = $7 AND t.task_type = $6))
+                AND EXISTS (
+                    SELECT 1 FROM jsonb_array_elements(o.roles_ids) AS r WHERE t.roles_ids @> jsonb_build_array(r)
+                )
+                -- members of an unresolved filter are unknown, they may overlap
+                AND (o.members_filter IS NOT NULL OR t.members_filter IS NOT NULL OR o.members_ids && t.members_ids)
+            )
+            ORDER BY t.priority, t.queued_at
+            LIMIT $5
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+        """,
+        [
+            TaskStatusChoices.STARTED.value,
+            worker_id,
+            TASK_LEASE_SECONDS,
+            TaskStatusChoices.IN_QUEUE.value,
+            limit,
+            TaskTypesChoices.ASSIGN_ROLE.value,
+            TaskTypesChoices.REMOVE_ROLE.value,
+        ],
+    )
+    if not rows:
+        return []
+    return await Task.filter(id__in=[_["id"] for _ in rows]).order_by("priority", "queued_at", "id")
+
+
+async def resolve_members_filter(members_filter: Dict[str, Any]) -> List[int]:
+    """Stream ids of the members selected by a task filter through a server-side cursor"""
+    query, args = members_filter_sql(members_filter)
+    members_ids = []
+    async with get_connection().acquire_connection() as connection:
+        async with connection.transaction():
+            async for record in connection.cursor(query, *args, prefetch=MEMBERS_QUERY_BATCH_SIZE):
+                members_ids.append(record[0])
+    return members_ids
+
+
+async def save_resolved_members(task: Task) -> None:
+    # ids are sent as a parameter, QuerySet.update would render the list as a string literal
+    rows_affected, _ = await get_connection().execute_query(
+        "UPDATE discord_task SET members_ids = $1::bigint[], members_filter = NULL, members_count = $2, "
+        "modified_at = now() WHERE id = $3 AND locked_by = $4",
+        [task.members_ids, task.members_count, task.id, task.locked_by],
+    )
+    if not rows_affected:
+        raise TaskLeaseLost(f"task {task.id} was taken over by another worker")
+    return None
+
+
+async def update_leased_task(task: Task, using_db: Optional[BaseDBAsyncClient] = None, **values) -> None:
+    # writes are fenced by the lease owner, a worker that lost its lease cannot overwrite the new owner's progress
+    rows_affected = (
+        await Task.filter(id=task.id, locked_by=task.locked_by)
+        .using_db(using_db or get_connection())
+        .update(modified_at=timezone.now(), **values)
+    )
+    if not rows_affected:
+        raise TaskLeaseLost(f"task {task.id} was taken over by another worker")
+    return None
+
+
+async def renew_tasks_lease(tasks: List[Task], worker_id: str) -> bool:
+    rows_affected, _ = await get_connection().execute_query(
+        "UPDATE discord_task SET locked_until = now() + $1 * interval '1 second' "
+        "WHERE id = ANY($2::bigint[]) AND locked_by = $3",
+        [TASK_LEASE_SECONDS, [task.id for task in tasks], worker_id],
+    )
+    return rows_affected == len(tasks)
+
+
+class TaskLease:
+    """
+    Heartbeat keeping claimed tasks leased while they run.
+    The lease counts as lost when another worker owns one of the tasks or when it could not be renewed in time.
+    """
+
+    def __init__(self, tasks: List[Task], worker_id: str):
+        self.tasks = tasks
+        self.worker_id = worker_id
+        self.lost = False
+        self.renewed_at = time.monotonic()
+        self.heartbeat: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "TaskLease":
+        self.heartbeat = asyncio.create_task(self.renew())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.heartbeat.cancel()
+
+    async def renew(self) -> None:
+        while not self.lost:
+            await asyncio.sleep(TASK_LEASE_RENEW_SECONDS)
+            try:
+                if await renew_tasks_lease(self.tasks, self.worker_id):
+                    self.renewed_at = time.monotonic()
+                else:
+                    self.lost = True
+            except Exception as e:
+                logging.warning(f":::discord_management: unable to renew lease of tasks: {e}")
+                self.lost = time.monotonic() - self.renewed_at >= TASK_LEASE_SECONDS
+        logging.warning(f":::discord_management: lease of tasks {[task.id for task in self.tasks]} lost")
+        return None
+
+    def check(self) -> None:
+        if self.lost:
+            raise TaskLeaseLost(f"tasks {[task.id for task in self.tasks]} were taken over by another worker")
+        return None
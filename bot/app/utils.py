@@ -1,9 +1,11 @@
-from dateutil.relativedelta import relativedelta
+from bisect import bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
 
 import sentry_sdk
 from discord.ext import commands
 
-from app.constants import EngagementScoreChoices
+from app.constants import EngagementScoreChoices, ENGAGEMENT_SCORE_THRESHOLDS
 
 
 def use_sentry(client, **sentry_args):
@@ -37,28 +39,44 @@ def use_sentry(client, **sentry_args):
             raise error
 
 
-def calculate_engagement_score(messages_count: int) -> int:
-    if messages_count >= 1 and messages_count < 11:
-        return EngagementScoreChoices.ONE
-    elif messages_count >= 11 and messages_count < 21:
-        return EngagementScoreChoices.TWO
-    elif messages_count >= 21 and messages_count < 31:
-        return EngagementScoreChoices.THREE
-    elif messages_count >= 31 and messages_count < 51:
-        return EngagementScoreChoices.FOUR
-    elif messages_count >= 51:
-        return EngagementScoreChoices.FIVE
-    else:
-        return EngagementScoreChoices.ZERO
+def calculate_engagement_score(messages_count: int, thresholds: Sequence[int] = ENGAGEMENT_SCORE_THRESHOLDS) -> int:
+    # thresholds are ascending minimal messages counts of scores 1..5
+    return EngagementScoreChoices(bisect_right(thresholds, messages_count))
 
 
-def humanize_readable_datetime(dt1, dt2) -> str:
-    """Kudos to https://stackoverflow.com/a/11157649/5751147"""
-    attrs = ["years", "months", "days", "hours"]
-    delta = relativedelta(dt1, dt2)
-    human_readable_attrs = [
-        "%d %s" % (getattr(delta, attr), attr if getattr(delta, attr) > 1 else attr[:-1])
-        for attr in attrs
-        if getattr(delta, attr)
-    ]
-    return " ".join(human_readable_attrs)
+def normalize_db_value(value: Any) -> Any:
+    """Make values coming from discord.py and from the db comparable (discord.py uses naive UTC datetimes)"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+    return value
+
+
+def diff_rows(
+    stored_rows: Dict[int, dict], fresh_rows: Dict[int, dict]
+) -> Tuple[Dict[int, dict], Dict[int, dict], List[int]]:
+    """
+    Compare rows stored in the db with freshly fetched rows, both keyed by primary key.
+    Returns rows to create, changed fields of rows to update and primary keys to delete.
+    """
+    to_create, to_update = {}, {}
+    for pk, fresh_row in fresh_rows.items():
+        stored_row = stored_rows.get(pk)
+        if stored_row is None:
+            to_create[pk] = fresh_row
+            continue
+        changed_fields = {
+            field: value
+            for field, value in fresh_row.items()
+            if normalize_db_value(stored_row.get(field)) != normalize_db_value(value)
+        }
+        if changed_fields:
+            to_update[pk] = changed_fields
+    to_delete = [pk for pk in stored_rows if pk not in fresh_rows]
+    return to_create, to_update, to_delete
+
+
+def chunks(items: Sequence, size: int) -> Iterator[Sequence]:
+    for index in range(0, len(items), size):
+        yield items[index : index + size]  # noqa: E203
@@ -0,0 +1,107 @@
+"""
+Compare Tortoise bulk_create with COPY for member and role link snapshots.
+Needs the Postgres database from docker-compose, every run is rolled back.
+Run from the bot directory: python -m benchmarks.bulk_load
+"""
+import time
+import asyncio
+from datetime import datetime, timedelta
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from constants import TORTOISE_ORM
+from app.bulk import copy_rows, copy_records
+from app.models import DiscordMember, DiscordRole, DiscordRoleMember
+
+SIZES = [10_000, 100_000, 500_000]
+ROLES_COUNT = 20
+ROLES_PER_MEMBER = 2
+
+
+class Rollback(Exception):
+    pass
+
+
+def build_rows(size: int):
+    now = datetime.utcnow()
+    roles = {
+        role_id: {"name": f"role-{role_id}", "position": role_id, "created_at": now}
+        for role_id in range(1, ROLES_COUNT + 1)
+    }
+    members = {
+        member_id: {
+            "bot": False,
+            "avatar_url": f"https://cdn.discordapp.com/avatars/{member_id}/avatar.png",
+            "name": f"member-{member_id}",
+            "username": f"member-{member_id}#0001",
+            "discriminator": "0001",
+            "engagement_score": member_id % 6,
+            "messages_count": member_id % 100,
+            "nick": None,
+            "pending": False,
+            "premium_since": None,
+            "joined_at": now,
+            "created_at": now - timedelta(days=member_id % 1000),
+            "roles_ids": roles_ids,
+            "roles_names": ", ".join(roles[_]["name"] for _ in roles_ids),
+        }
+        for member_id in range(10 ** 17, 10 ** 17 + size)
+        for roles_ids in [sorted({(member_id + offset) % ROLES_COUNT + 1 for offset in range(ROLES_PER_MEMBER)})]
+    }
+    pairs = [(member_id, role_id) for member_id, row in members.items() for role_id in row["roles_ids"]]
+    return roles, members, pairs
+
+
+async def load_with_bulk_create(connection, roles, members, pairs):
+    await DiscordRole.bulk_create([DiscordRole(id=pk, **row) for pk, row in roles.items()], using_db=connection)
+    await DiscordMember.bulk_create(
+        [DiscordMember(id=pk, **row) for pk, row in members.items()], batch_size=1000, using_db=connection
+    )
+    await DiscordRoleMember.bulk_create(
+        [DiscordRoleMember(discordmember_id=member_id, discordrole_id=role_id) for member_id, role_id in pairs],
+        batch_size=1000,
+        using_db=connection,
+    )
+
+
+async def load_with_copy(connection, roles, members, pairs):
+    await copy_rows(connection, DiscordRole, roles)
+    await copy_rows(connection, DiscordMember, members)
+    await copy_records(connection, DiscordRoleMember._meta.db_table, ["discordmember_id", "discordrole_id"], pairs)
+
+
+async def measure(loader, rows) -> float:
+    try:
+        async with in_transaction() as connection:
+            await connection.execute_query("SET CONSTRAINTS ALL DEFERRED")
+            await connection.execute_query("DELETE FROM discord_discordmember_roles")
+            await connection.execute_query("DELETE FROM discord_discordmember")
+            await connection.execute_query("DELETE FROM discord_discordrole")
+            started_at = time.perf_counter()
+            await loader(connection, *rows)
+            elapsed = time.perf_counter() - started_at
+            raise Rollback()
+    except Rollback:
+        pass
+    return elapsed
+
+
+async def main():
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        print(f"{'members':>10} {'bulk_create, s':>15} {'COPY, s':>10} {'speedup':>8}")
+        for size in SIZES:
+            rows = build_rows(size)
+            bulk_create_elapsed = await measure(load_with_bulk_create, rows)
+            copy_elapsed = await measure(load_with_copy, rows)
+            print(
+                f"{size:>10} {bulk_create_elapsed:>15.2f} {copy_elapsed:>10.2f} "
+                f"{bulk_create_elapsed / copy_elapsed:>7.1f}x"
+            )
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
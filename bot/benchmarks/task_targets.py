@@ -0,0 +1,62 @@
+"""
+Compare storing task members ids as json with a bigint[] column: stored size and time to fetch and decode.
+Needs the Postgres database from docker-compose, tables are temporary.
+Run from the bot directory: python -m benchmarks.task_targets
+"""
+import json
+import time
+import asyncio
+
+from tortoise import Tortoise
+
+from constants import TORTOISE_ORM
+
+SIZES = [1_000, 10_000, 150_000]
+REPEATS = 10
+
+
+async def measure_fetch(connection, column: str, decode) -> float:
+    started_at = time.perf_counter()
+    for _ in range(REPEATS):
+        value = await connection.fetchval(f"SELECT {column} FROM task_targets_benchmark")
+        decode(value)
+    return (time.perf_counter() - started_at) / REPEATS
+
+
+async def main():
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        async with Tortoise.get_connection("default").acquire_connection() as connection:
+            print(
+                f"{'members':>10} {'json, KiB':>10} {'bigint[], KiB':>14} "
+                f"{'json fetch, ms':>15} {'bigint[] fetch, ms':>19}"
+            )
+            for size in SIZES:
+                members_ids = list(range(8 * 10 ** 17, 8 * 10 ** 17 + size))
+                await connection.execute(
+                    "CREATE TEMPORARY TABLE task_targets_benchmark (members_json jsonb, members_array bigint[])"
+                )
+                try:
+                    await connection.execute(
+                        "INSERT INTO task_targets_benchmark VALUES ($1::text::jsonb, $2::bigint[])",
+                        json.dumps(members_ids),
+                        members_ids,
+                    )
+                    json_size, array_size = await connection.fetchrow(
+                        "SELECT pg_column_size(members_json), pg_column_size(members_array) FROM task_targets_benchmark"
+                    )
+                    # asyncpg returns jsonb as text that still has to be parsed, bigint[] arrives as a list
+                    json_elapsed = await measure_fetch(connection, "members_json", json.loads)
+                    array_elapsed = await measure_fetch(connection, "members_array", list)
+                finally:
+                    await connection.execute("DROP TABLE task_targets_benchmark")
+                print(
+                    f"{size:>10} {json_size / 1024:>10.0f} {array_size / 1024:>14.0f} "
+                    f"{json_elapsed * 1000:>15.1f} {array_elapsed * 1000:>19.1f}"
+                )
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 from distutils.util import strtobool
 
@@ -11,9 +12,49 @@ SENTRY_API_KEY = os.getenv("SENTRY_API_KEY", "")
 LOG_LEVEL = os.getenv("BOT_LOG_LEVEL", "INFO")
 # should the bot log to file or to stdout
 LOG_TO_FILE = strtobool(os.getenv("BOT_LOG_TO_FILE", "False"))
-SYNC_DISCORD_SECONDS = int(os.getenv("BOT_SYNC_DISCORD_SECONDS", 60))
-TASKS_SCAN_SECONDS = int(os.getenv("BOT_TASKS_SCAN_SECONDS", 60))
+# members and roles are kept up to date by gateway events, full REST fetch is only a periodic reconciliation
+SYNC_DISCORD_SECONDS = int(os.getenv("BOT_SYNC_DISCORD_SECONDS", 3600))
+# how many channels are scanned for message history at the same time
+HISTORY_SCAN_CONCURRENCY = int(os.getenv("BOT_HISTORY_SCAN_CONCURRENCY", 4))
+# live messages counts are flushed to the db every MESSAGES_FLUSH_MS or every MESSAGES_FLUSH_EVENTS events
+MESSAGES_FLUSH_MS = int(os.getenv("BOT_MESSAGES_FLUSH_MS", 5000))
+MESSAGES_FLUSH_EVENTS = int(os.getenv("BOT_MESSAGES_FLUSH_EVENTS", 500))
+# "staging" merges a snapshot loaded into staging tables, "diff" writes only changed rows found in python,
+# "full" wipes and reloads members and roles on every sync
+SYNC_MODE = os.getenv("BOT_SYNC_MODE", "staging")
+# replaced by BOT_ANTIFRAUD_SWEEP_SECONDS and BOT_TASKS_POLL_SECONDS, still used when they are not set
+_tasks_scan_seconds = os.getenv("BOT_TASKS_SCAN_SECONDS")
+# impersonators are checked on join and profile updates, the full sweep is only a safety net
+ANTIFRAUD_SWEEP_SECONDS = int(os.getenv("BOT_ANTIFRAUD_SWEEP_SECONDS") or _tasks_scan_seconds or 3600)
+# queued tasks wake the bot through postgres NOTIFY, polling is only a safety net
+TASKS_POLL_SECONDS = int(os.getenv("BOT_TASKS_POLL_SECONDS") or _tasks_scan_seconds or 600)
+# maximal number of member actions (kick/ban/roles) running at the same time
+TASKS_CONCURRENCY = int(os.getenv("BOT_TASKS_CONCURRENCY", 8))
+# identifies this bot process in task leases, several processes can execute tasks at the same time
+WORKER_ID = os.getenv("BOT_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# extra processes raising task throughput only execute tasks, sync, message counting and antifraud run once
+EXECUTOR_ONLY = strtobool(os.getenv("BOT_EXECUTOR_ONLY", "False"))
 _whitelisted_ids_str = os.getenv("WHITELISTED_IDS", "814589660692349019,880589163110477854")
-WHITELISTED_IDS = list(map(int, _whitelisted_ids_str.split(",")))
-BAN_USERNAMES_SIMILAR_TO = os.getenv("BAN_USERNAMES_SIMILAR_TO", "")
+WHITELISTED_IDS = set(map(int, _whitelisted_ids_str.split(",")))
+# comma separated protected names, members imitating one of them are banned
+_ban_usernames_similar_to_str = os.getenv("BAN_USERNAMES_SIMILAR_TO", "")
+BAN_USERNAMES_SIMILAR_TO = [_.strip() for _ in _ban_usernames_similar_to_str.split(",") if _.strip()]
+# names within this edit distance of a protected name are suspects (at most a quarter of the name length), 0 disables
+ANTIFRAUD_MAX_DISTANCE = int(os.getenv("BOT_ANTIFRAUD_MAX_DISTANCE", 2))
+# suspects scoring at least this are banned right away, others are sent to the review queue
+ANTIFRAUD_AUTOBAN_SCORE = float(os.getenv("BOT_ANTIFRAUD_AUTOBAN_SCORE", 0.9))
+# avatars within this many differing bits (of 64) of a protected member's avatar are suspects, 0 for exact copies
+ANTIFRAUD_AVATAR_MAX_DISTANCE = int(os.getenv("BOT_ANTIFRAUD_AVATAR_MAX_DISTANCE", 6))
+# leave empty string to download avatars from Discord, otherwise they are read from <AVATARS_DIR>/<avatar hash>.png
+AVATARS_DIR = os.getenv("BOT_AVATARS_DIR", "")
+# at least RAID_CLUSTER_SIZE new accounts joining within RAID_WINDOW_SECONDS with the same creation hour,
+# name stem or avatar are raiders, accounts older than RAID_NEW_ACCOUNT_DAYS are never considered
+RAID_WINDOW_SECONDS = int(os.getenv("BOT_RAID_WINDOW_SECONDS", 60))
+RAID_CLUSTER_SIZE = int(os.getenv("BOT_RAID_CLUSTER_SIZE", 5))
+RAID_NEW_ACCOUNT_DAYS = int(os.getenv("BOT_RAID_NEW_ACCOUNT_DAYS", 7))
+# "quarantine" assigns RAID_QUARANTINE_ROLE_ID to raiders, "ban" bans them, "off" only logs raids
+RAID_ACTION = os.getenv("BOT_RAID_ACTION", "quarantine")
+RAID_QUARANTINE_ROLE_ID = int(os.getenv("BOT_RAID_QUARANTINE_ROLE_ID") or 0)
 PROJECT_NAME = os.getenv("PROJECT_NAME", "")
+# leave empty string if you don't use redis, otherwise live messages counts are shared through it
+REDIS_URL = os.getenv("REDIS_URL", "")
@@ -14,7 +14,8 @@ if __name__ == "__main__":
     # initialize bot params
     intents = Intents.default()
     intents.members = True
-    intents.messages = True
+    # an executor only process has no use for message events
+    intents.messages = not config.EXECUTOR_ONLY
     activity = Activity(type=ActivityType.watching, name=f"{config.PROJECT_NAME} discord".upper())
     bot = commands.Bot(command_prefix="!butler.", help_command=None, intents=intents, activity=activity)
 
@@ -36,7 +37,8 @@ if __name__ == "__main__":
         handlers=[file_handler if config.LOG_TO_FILE else stdout_handler],
     )
     bot.loop.run_until_complete(Tortoise.init(config=TORTOISE_ORM))
-    bot.load_extension("app.extensions.sync_discord")
     bot.load_extension("app.extensions.tasks")
-    bot.load_extension("app.extensions.antifraud")
+    if not config.EXECUTOR_ONLY:
+        bot.load_extension("app.extensions.sync_discord")
+        bot.load_extension("app.extensions.antifraud")
     bot.run(config.TOKEN)
@@ -0,0 +1,37 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+# tests run from the bot directory, like run.py, modules are imported as `app.<module>`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database migrated with `python backend/manage.py migrate`, tests needing Postgres are skipped without it
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+class Rollback(Exception):
+    pass
+
+
+@pytest.fixture
+def in_rollback():
+    """Run a test coroutine with a connection to the test database, everything it writes is rolled back"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    from tortoise import Tortoise
+    from tortoise.transactions import in_transaction
+
+    async def run_test(test):
+        await Tortoise.init(db_url=TEST_DATABASE_URL, modules={"app": ["app.models"]})
+        try:
+            async with in_transaction() as connection:
+                await test(connection)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            await Tortoise.close_connections()
+
+    return lambda test: asyncio.run(run_test(test))
@@ -0,0 +1,98 @@
+import io
+import random
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from app.avatars import (  # noqa: E402
+    AvatarDetector,
+    HammingIndex,
+    difference_hash,
+    hamming,
+    to_signed,
+    to_unsigned,
+)
+
+MAX_DISTANCE = 6  # BOT_ANTIFRAUD_AVATAR_MAX_DISTANCE default
+
+
+def make_avatar(seed: int, size: int = 128) -> Image.Image:
+    # random blocks, smooth enough to survive rescaling like real avatars
+    generator = random.Random(seed)
+    blocks = Image.new("RGB", (8, 8))
+    blocks.putdata([tuple(generator.randrange(256) for _ in range(3)) for _ in range(64)])
+    return blocks.resize((size, size), Image.BILINEAR)
+
+
+def to_bytes(image: Image.Image, image_format: str = "PNG", **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def add_noise(image: Image.Image, seed: int, amplitude: int = 8) -> Image.Image:
+    generator = random.Random(seed)
+    return Image.eval(image, lambda value: max(0, min(255, value + generator.randint(-amplitude, amplitude))))
+
+
+def test_near_duplicates_are_within_distance():
+    for seed in range(20):
+        original = make_avatar(seed)
+        phash = difference_hash(to_bytes(original))
+        copies = [
+            to_bytes(original.resize((64, 64), Image.BICUBIC)),
+            to_bytes(original.resize((512, 512), Image.NEAREST)),
+            to_bytes(add_noise(original, seed)),
+            to_bytes(original, "JPEG", quality=70),
+        ]
+        for copy in copies:
+            assert hamming(phash, difference_hash(copy)) <= MAX_DISTANCE
+
+
+def test_distinct_avatars_are_not_within_distance():
+    phashes = [difference_hash(to_bytes(make_avatar(seed))) for seed in range(30)]
+    for i, a in enumerate(phashes):
+        for b in phashes[i + 1 :]:  # noqa: E203
+            assert hamming(a, b) > MAX_DISTANCE
+
+
+def test_signed_round_trip():
+    for phash in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+        assert -(1 << 63) <= to_signed(phash) < 1 << 63
+        assert to_unsigned(to_signed(phash)) == phash
+
+
+@pytest.mark.parametrize("max_distance", [0, 2, 6, 10])
+def test_multi_index_search_matches_brute_force(max_distance):
+    generator = random.Random(max_distance)
+    centers = [generator.getrandbits(64) for _ in range(20)]
+    # hashes around a few centers, so that many of them are within the distance of each other
+    phashes = {
+        center ^ sum(1 << bit for bit in generator.sample(range(64), generator.randint(0, 12)))
+        for center in centers
+        for _ in range(50)
+    }
+    index = HammingIndex(max_distance)
+    for phash in phashes:
+        index.add(phash)
+    removed = set(list(phashes)[:100])
+    for phash in removed:
+        index.remove(phash)
+    indexed = phashes - removed
+    for query in list(phashes)[:200] + centers:
+        expected = {(_, hamming(query, _)) for _ in indexed if hamming(query, _) <= max_distance}
+        assert sorted(index.search(query)) == sorted(expected)
+
+
+def test_detector_flags_copies_of_protected_avatars():
+    detector = AvatarDetector(protected_ids=[1], max_distance=MAX_DISTANCE)
+    original = make_avatar(0)
+    detector.update(1, difference_hash(to_bytes(original)))
+    detector.update(2, difference_hash(to_bytes(add_noise(original, 1))))
+    detector.update(3, difference_hash(to_bytes(make_avatar(1))))
+    assert [(_.member_id, _.protected_id) for _ in detector.suspects()] == [(2, 1)]
+    assert [_.protected_id for _ in detector.match(2)] == [1]
+    assert detector.match(3) == []
+    detector.update(2, None)
+    assert detector.suspects() == []
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+
+from app.bulk import copy_rows, merge_staging_rows
+from app.models import DiscordMember
+
+CREATED_AT = datetime(2021, 6, 1, tzinfo=timezone.utc)
+
+
+def make_member_row(name):
+    # synced fields only, like SyncDiscord.build_member_row
+    return {
+        "avatar_url": "",
+        "name": name,
+        "username": f"{name}#0001",
+        "discriminator": "0001",
+        "messages_count": 3,
+        "created_at": CREATED_AT,
+    }
+
+
+def test_merge_staging_rows(in_rollback):
+    async def test(connection):
+        await connection.execute_script(
+            "DELETE FROM discord_discordmember_roles WHERE discordmember_id IN (1, 2, 3);"
+            "DELETE FROM discord_discordmember WHERE id IN (1, 2, 3);"
+            "CREATE TEMP TABLE staging_discordmember (LIKE discord_discordmember INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        await copy_rows(connection, DiscordMember, {1: make_member_row("old"), 2: make_member_row("same")})
+        await connection.execute_query("UPDATE discord_discordmember SET messages_count_7d = 2 WHERE id = 1")
+        staged_rows = {1: make_member_row("renamed"), 2: make_member_row("same"), 3: make_member_row("new")}
+        await copy_rows(connection, DiscordMember, staged_rows, table="staging_discordmember")
+
+        rows = await merge_staging_rows(connection, DiscordMember, "staging_discordmember", list(staged_rows[3]))
+
+        assert sorted(_["id"] for _ in rows) == [1, 3]
+        members = {
+            _["id"]: _
+            for _ in await DiscordMember.all()
+            .using_db(connection)
+            .values("id", "name", "messages_count_7d", "engagement_score_90d")
+        }
+        # a member who is not in the db yet is inserted with the defaults of the fields that are not synced
+        assert members[3] == {"id": 3, "name": "new", "messages_count_7d": 0, "engagement_score_90d": 0}
+        # fields that are not synced are left untouched on existing members
+        assert members[1] == {"id": 1, "name": "renamed", "messages_count_7d": 2, "engagement_score_90d": 0}
+
+    in_rollback(test)
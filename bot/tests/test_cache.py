@@ -0,0 +1,88 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from app.cache import MessagesCountCache
+from app.constants import CACHE_INDEX
+
+
+class FakePipeline:
+    """Queues commands and applies them all at once on execute, like a MULTI/EXEC transaction"""
+
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        return lambda *args: self.commands.append((command, args))
+
+    async def execute(self) -> list:
+        return [command(*args) for command, args in self.commands]
+
+
+class FakeRedis:
+    """Dict-backed stand-in for the subset of aioredis used by MessagesCountCache, values are strings like Redis"""
+
+    def __init__(self):
+        self.values: Dict[str, str] = {}
+        self.sorted_sets: Dict[str, Dict[str, float]] = {}
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        return [self.values.get(_) for _ in keys]
+
+    def delete(self, key: str) -> None:
+        self.values.pop(key, None)
+        self.sorted_sets.pop(key, None)
+
+    def mset(self, mapping: Dict[str, int]) -> None:
+        self.values.update({key: str(value) for key, value in mapping.items()})
+
+    def zadd(self, key: str, mapping: Dict[str, int]) -> None:
+        self.sorted_sets.setdefault(key, {}).update({member: float(score) for member, score in mapping.items()})
+
+    def incrby(self, key: str, delta: int) -> None:
+        self.values[key] = str(int(self.values.get(key, 0)) + delta)
+
+    def zincrby(self, key: str, delta: int, member: str) -> None:
+        scores = self.sorted_sets.setdefault(key, {})
+        scores[member] = scores.get(member, 0.0) + delta
+
+
+def test_increment_counts_applies_deltas_on_top_of_full_scan():
+    redis = FakeRedis()
+    cache = MessagesCountCache(redis)
+
+    async def run():
+        await cache.set_counts({1: 10, 2: 3}, {100: 13})
+        await cache.increment_counts({(100, 1): 2, (101, 2): 5, (100, 3): 1})
+        await cache.increment_counts({(100, 1): -1})
+        return (
+            await cache.get_members_messages_count([1, 2, 3, 4]),
+            await cache.get_channels_messages_count([100, 101, 102]),
+        )
+
+    members_messages_count, channels_messages_count = asyncio.run(run())
+    assert members_messages_count == {1: 11, 2: 8, 3: 1}
+    assert channels_messages_count == {100: 15, 101: 5}
+    assert redis.sorted_sets[CACHE_INDEX] == {"1": 11, "2": 8, "3": 1}
+
+
+def test_set_counts_replaces_ranking():
+    redis = FakeRedis()
+    cache = MessagesCountCache(redis)
+
+    async def run():
+        await cache.set_counts({1: 10, 2: 3}, {})
+        await cache.set_counts({2: 4}, {})
+
+    asyncio.run(run())
+    assert redis.sorted_sets[CACHE_INDEX] == {"2": 4}
+
+
+def test_empty_lookups_skip_redis():
+    cache = MessagesCountCache(None)
+    assert asyncio.run(cache.get_members_messages_count([])) == {}
+    assert asyncio.run(cache.get_channels_messages_count([])) == {}
@@ -0,0 +1,184 @@
+import random
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Tuple
+
+from app.bulk import copy_rows
+from app.constants import ENGAGEMENT_WINDOWS_DAYS
+from app.engagement import (
+    add_to_engagement_windows,
+    expire_engagement_windows,
+    expired_days,
+    leaving_day,
+    pruned_day,
+    refresh_engagement_windows,
+    save_messages_buckets,
+    window_deltas,
+)
+from app.models import DiscordMember
+from app.utils import calculate_engagement_score
+
+TODAY = date(2021, 6, 1)
+THRESHOLDS = (1, 5, 10, 20, 40)
+CREATED_AT = datetime(2021, 1, 1, tzinfo=timezone.utc)
+MEMBER_IDS = range(1, 6)
+
+
+class FakeEngagementStore:
+    """
+    Dict-backed stand-in for the daily buckets table and the rolling windows columns of members.
+    Every step applies the same arithmetic as the SQL of app.engagement.
+    """
+
+    def __init__(self, today: date):
+        self.day = today
+        self.buckets: Dict[Tuple[int, date], int] = {}
+        self.windows: Dict[int, Dict[int, int]] = {}
+
+    def add(self, buckets: Dict[Tuple[int, date], int]) -> None:
+        # save_messages_buckets and add_to_engagement_windows
+        for key, delta in buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + delta
+        for member_id, deltas in window_deltas(buckets, self.day).items():
+            windows = self.windows.setdefault(member_id, dict.fromkeys(ENGAGEMENT_WINDOWS_DAYS, 0))
+            for days, delta in deltas.items():
+                windows[days] += delta
+
+    def move_to(self, today: date) -> None:
+        # expire_engagement_windows for every day since the last move
+        for day in expired_days(self.day, today):
+            for days in ENGAGEMENT_WINDOWS_DAYS:
+                for (member_id, bucket_day), messages_count in self.buckets.items():
+                    if bucket_day == leaving_day(day, days):
+                        self.windows[member_id][days] -= messages_count
+            self.buckets = {key: _ for key, _ in self.buckets.items() if key[1] > pruned_day(day)}
+            self.day = day
+
+
+def recount(messages: Dict[Tuple[int, date], int], today: date) -> Dict[int, Dict[int, int]]:
+    # windows calculated from the whole history, a window of n days holds today and the n - 1 days before it
+    windows = {}
+    for (member_id, day), messages_count in messages.items():
+        member_windows = windows.setdefault(member_id, dict.fromkeys(ENGAGEMENT_WINDOWS_DAYS, 0))
+        for days in ENGAGEMENT_WINDOWS_DAYS:
+            if 0 <= (today - day).days < days:
+                member_windows[days] += messages_count
+    return windows
+
+
+def test_window_deltas_skip_days_outside_windows():
+    buckets = {(1, TODAY): 2, (1, TODAY - timedelta(days=7)): 3, (2, TODAY - timedelta(days=90)): 5}
+    deltas = window_deltas(buckets, TODAY)
+    assert deltas == {1: {7: 2, 30: 5, 90: 5}, 2: {7: 0, 30: 0, 90: 0}}
+
+
+def test_expired_days():
+    assert list(expired_days(TODAY, TODAY)) == []
+    assert list(expired_days(TODAY, TODAY + timedelta(days=3))) == [TODAY + timedelta(days=_) for _ in (1, 2, 3)]
+
+
+def test_day_rollover():
+    store = FakeEngagementStore(TODAY)
+    store.add({(1, TODAY): 4})
+    store.move_to(TODAY + timedelta(days=6))
+    assert store.windows[1] == {7: 4, 30: 4, 90: 4}
+    store.move_to(TODAY + timedelta(days=7))
+    assert store.windows[1] == {7: 0, 30: 4, 90: 4}
+
+
+def test_multi_day_gap():
+    store = FakeEngagementStore(TODAY)
+    store.add({(1, TODAY - timedelta(days=_)): 1 for _ in range(60)})
+    # the job did not run for 40 days, every missed day is subtracted once
+    store.move_to(TODAY + timedelta(days=40))
+    assert store.windows[1] == recount({(1, TODAY - timedelta(days=_)): 1 for _ in range(60)}, store.day)[1]
+    assert store.windows[1] == {7: 0, 30: 0, 90: 50}
+
+
+def test_prune_after_90_days():
+    store = FakeEngagementStore(TODAY)
+    store.add({(1, TODAY): 4, (2, TODAY + timedelta(days=1)): 1})
+    store.move_to(TODAY + timedelta(days=89))
+    assert (1, TODAY) in store.buckets
+    store.move_to(TODAY + timedelta(days=90))
+    assert store.windows[1] == {7: 0, 30: 0, 90: 0}
+    assert list(store.buckets) == [(2, TODAY + timedelta(days=1))]
+
+
+def test_incremental_windows_match_recount():
+    generator = random.Random(0)
+    store = FakeEngagementStore(TODAY)
+    messages: Dict[Tuple[int, date], int] = {}
+    for _ in range(300):
+        store.move_to(store.day + timedelta(days=generator.choice((0, 0, 1, 1, 2, 5, 40))))
+        buckets = {}
+        for _ in range(generator.randint(0, 10)):
+            # late messages of days that already left some windows are counted in the others only
+            key = (generator.randint(1, 5), store.day - timedelta(days=generator.choice((0, 0, 1, 6, 7, 29, 89, 95))))
+            buckets[key] = buckets.get(key, 0) + generator.randint(1, 5)
+        store.add(buckets)
+        for key, delta in buckets.items():
+            messages[key] = messages.get(key, 0) + delta
+        assert store.windows == recount(messages, store.day)
+
+
+def test_engagement_sql_matches_recount(in_rollback):
+    async def load_windows(connection) -> Dict[int, Dict[int, tuple]]:
+        members = await connection.execute_query_dict(
+            "SELECT * FROM discord_discordmember WHERE id = ANY($1::bigint[])", [list(MEMBER_IDS)]
+        )
+        return {
+            _["id"]: {
+                days: (_[f"messages_count_{days}d"], _[f"engagement_score_{days}d"]) for days in ENGAGEMENT_WINDOWS_DAYS
+            }
+            for _ in members
+        }
+
+    def expected_windows(messages: Dict[Tuple[int, date], int], today: date) -> Dict[int, Dict[int, tuple]]:
+        windows = recount(messages, today)
+        return {
+            member_id: {
+                days: (count, calculate_engagement_score(count, THRESHOLDS))
+                for days, count in windows.get(member_id, dict.fromkeys(ENGAGEMENT_WINDOWS_DAYS, 0)).items()
+            }
+            for member_id in MEMBER_IDS
+        }
+
+    async def test(connection):
+        await connection.execute_query(
+            "DELETE FROM discord_membermessagesbucket WHERE member_id = ANY($1::bigint[])", [list(MEMBER_IDS)]
+        )
+        await connection.execute_query(
+            "DELETE FROM discord_discordmember_roles WHERE discordmember_id = ANY($1::bigint[])", [list(MEMBER_IDS)]
+        )
+        await connection.execute_query(
+            "DELETE FROM discord_discordmember WHERE id = ANY($1::bigint[])", [list(MEMBER_IDS)]
+        )
+        member_row = {"avatar_url": "", "name": "", "username": "", "discriminator": "", "created_at": CREATED_AT}
+        await copy_rows(connection, DiscordMember, {_: member_row for _ in MEMBER_IDS})
+        generator = random.Random(0)
+        today = TODAY
+        messages: Dict[Tuple[int, date], int] = {}
+        for _ in range(60):
+            # the sync job moves the windows day by day, then applies the buckets flushed since
+            for day in expired_days(today, today + timedelta(days=generator.choice((0, 0, 1, 1, 2, 5, 40)))):
+                await expire_engagement_windows(connection, day, THRESHOLDS)
+                today = day
+            buckets = {}
+            for _ in range(generator.randint(0, 10)):
+                key = (generator.choice(MEMBER_IDS), today - timedelta(days=generator.choice((0, 0, 1, 6, 7, 29, 89))))
+                buckets[key] = buckets.get(key, 0) + generator.randint(1, 5)
+            await save_messages_buckets(connection, buckets)
+            await add_to_engagement_windows(connection, buckets, today, THRESHOLDS)
+            for key, delta in buckets.items():
+                messages[key] = messages.get(key, 0) + delta
+            assert await load_windows(connection) == expected_windows(messages, today)
+        # a full refresh from the buckets gives the same windows
+        await connection.execute_query(
+            "UPDATE discord_discordmember SET messages_count_7d = 0, messages_count_30d = 0, messages_count_90d = 0 "
+            "WHERE id = ANY($1::bigint[])",
+            [list(MEMBER_IDS)],
+        )
+        await refresh_engagement_windows(connection, today, THRESHOLDS, list(MEMBER_IDS))
+        assert await load_windows(connection) == expected_windows(messages, today)
+
+    in_rollback(test)
@@ -0,0 +1,70 @@
+import random
+from types import SimpleNamespace
+
+from app.impersonation import AhoCorasick, ImpersonationDetector, TrigramIndex, levenshtein, normalize_name
+
+
+def make_member(member_id, name, nick=None):
+    return SimpleNamespace(id=member_id, name=name, nick=nick)
+
+
+def test_normalize_name_folds_confusables():
+    assert normalize_name("Ассоuntаnt") == normalize_name("accountant")  # cyrillic letters
+    assert normalize_name("A.C.C.O.U.N.T.A.N.T") == normalize_name("accountant")
+    assert normalize_name("ａｃｃｏｕｎｔａｎｔ") == normalize_name("accountant")  # fullwidth forms
+    assert normalize_name("rnod") == normalize_name("mod")
+
+
+def test_aho_corasick_matches_naive_search():
+    generator = random.Random(0)
+    patterns = {"".join(generator.choice("abc") for _ in range(generator.randint(1, 4))) for _ in range(30)}
+    automaton = AhoCorasick(patterns)
+    for _ in range(200):
+        text = "".join(generator.choice("abcd") for _ in range(generator.randint(0, 20)))
+        assert automaton.search(text) == {_ for _ in patterns if _ in text}
+
+
+def test_trigram_index_matches_brute_force():
+    generator = random.Random(0)
+    words = {"".join(generator.choice("abc") for _ in range(generator.randint(1, 8))) for _ in range(300)}
+    index = TrigramIndex()
+    for word in words:
+        index.add(word)
+    removed = set(list(words)[:50])
+    for word in removed:
+        index.remove(word)
+    for _ in range(100):
+        query = "".join(generator.choice("abc") for _ in range(generator.randint(1, 8)))
+        for max_distance in (0, 1, 2):
+            expected = {
+                (word, levenshtein(query, word))
+                for word in words - removed
+                if levenshtein(query, word) <= max_distance
+            }
+            assert set(index.search(query, max_distance)) == expected
+
+
+def test_detector_matches_and_forgets_members():
+    detector = ImpersonationDetector(["Accountant"], whitelisted_ids=[1], max_distance=2)
+    assert detector.match(make_member(1, "accountant")) == set()
+    assert detector.match(make_member(2, "the ACC0UNTANT")) == {"Accountant"}
+    assert detector.match(make_member(3, "someone", nick="accountamt")) == set()
+    assert [(_.member_id, _.distance) for _ in detector.fuzzy_match(make_member(3, "someone", nick="accountamt"))] == [
+        (3, 1)
+    ]
+    assert [(_.member_id, _.distance) for _ in detector.fuzzy_suspects()] == [(3, 1)]
+    detector.match(make_member(3, "someone"))
+    assert detector.fuzzy_suspects() == []
+    detector.forget(2)
+    assert 2 not in detector.cache
+
+
+def test_detector_exact_match_suspects():
+    detector = ImpersonationDetector(["Accountant", "Mod"], whitelisted_ids=[1], max_distance=2)
+    assert detector.exact_match(make_member(1, "accountant")) == []
+    suspects = detector.exact_match(make_member(2, "the ACC0UNTANT", nick="rnod"))
+    assert sorted((_.protected_name, _.distance, _.score) for _ in suspects) == [
+        ("Accountant", 0, 1.0),
+        ("Mod", 0, 1.0),
+    ]
+    assert detector.exact_match(make_member(3, "someone", nick="accountamt")) == []
@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.members_filter import like_pattern, members_filter_sql
+
+
+def test_values_are_parameters():
+    query, args = members_filter_sql(
+        {
+            "roles_ids__contains": [2],
+            "bot__exact": False,
+            "joined_at__gte": "2021-10-10T00:00:00+00:00",
+            "search": ["o'neil; DROP TABLE discord_task", "x"],
+        }
+    )
+    assert "DROP" not in query and "o'neil" not in query
+    assert query.count("ILIKE $4") == 4 and query.count("ILIKE $5") == 4
+    assert args == [
+        [2],
+        False,
+        datetime(2021, 10, 10, tzinfo=timezone.utc),
+        "%o'neil; DROP TABLE discord\\_task%",
+        "%x%",
+    ]
+
+
+def test_empty_filter_selects_every_member():
+    assert members_filter_sql({}) == ("SELECT m.id FROM discord_discordmember AS m WHERE TRUE", [])
+
+
+def test_unknown_lookups_are_rejected():
+    with pytest.raises(ValueError):
+        members_filter_sql({"id__gt) OR (TRUE": 0})
+
+
+def test_like_pattern_matches_literally():
+    assert like_pattern("100%_\\") == "%100\\%\\_\\\\%"
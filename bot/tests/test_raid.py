@@ -0,0 +1,28 @@
+from app.raid import JoinWindow
+
+
+def test_cluster_is_reported_once_then_member_by_member():
+    window = JoinWindow(window_seconds=60, max_joins=100, cluster_size=3)
+    assert window.add(0, 1, {("name", "raider")}) == []
+    assert window.add(1, 2, {("name", "raider"), ("avatar", "x")}) == []
+    assert window.add(2, 10, {("name", "other")}) == []
+    assert window.add(3, 3, {("name", "raider")}) == [1, 2, 3]
+    assert window.add(4, 4, {("name", "raider")}) == [4]
+
+
+def test_expired_joins_leave_the_window():
+    window = JoinWindow(window_seconds=60, max_joins=100, cluster_size=3)
+    window.add(0, 1, {("name", "raider")})
+    window.add(1, 2, {("name", "raider")})
+    assert window.add(62, 3, {("name", "raider")}) == []
+    assert window.counts == {("name", "raider"): 1}
+    assert window.add(63, 4, {("name", "raider")}) == []
+    assert window.add(64, 5, {("name", "raider")}) == [3, 4, 5]
+
+
+def test_window_size_is_bounded():
+    window = JoinWindow(window_seconds=60, max_joins=3, cluster_size=10)
+    for member_id in range(10):
+        window.add(0, member_id, {("created_at", member_id)})
+    assert len(window.joins) <= 3
+    assert len(window.counts) == len(window.joins)
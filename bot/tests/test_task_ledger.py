@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.constants import TaskMemberResultStatusChoices, TaskTypesChoices
+from app.models import Task, TaskMemberResult
+from app.task_ledger import TaskLedger
+
+
+def test_actions_are_counted_per_task():
+    async def run():
+        # the ledger lock belongs to the running loop
+        ledger = TaskLedger(SimpleNamespace(id=1, members_ids=[1, 2, 3, 4, 5], cursor=0), done_ids={1})
+        await ledger.record(2, TaskMemberResultStatusChoices.DONE)
+        await ledger.record(3, TaskMemberResultStatusChoices.UNCHANGED)
+        await ledger.record(4, TaskMemberResultStatusChoices.SKIPPED)
+        await ledger.record(5, TaskMemberResultStatusChoices.ERROR, "error")
+        return ledger
+
+    ledger = asyncio.run(run())
+    # unchanged and superseded members took no API call
+    assert ledger.actions_count == 2
+    assert ledger.recorded_at >= ledger.started_at
+    assert ledger.pending_members_ids() == [2, 3, 4, 5]  # results are not flushed yet
+
+
+def test_pending_members_ids_stop_at_the_limit():
+    async def run():
+        return TaskLedger(SimpleNamespace(id=1, members_ids=[1, 2, 2, 3, 4, 5, 6], cursor=1), done_ids={3, 5})
+
+    ledger = asyncio.run(run())
+    assert ledger.pending_members_ids() == [2, 4, 6]
+    assert ledger.pending_members_ids(2) == [2, 4]
+    assert ledger.pending_members_ids(0) == []
+
+
+def test_load_reads_results_after_the_cursor(in_rollback):
+    async def test(connection):
+        task = await Task.create(
+            members_ids=[1, 2, 3, 4, 2], task_type=TaskTypesChoices.BAN, cursor=2, using_db=connection
+        )
+        await TaskMemberResult.bulk_create(
+            [
+                TaskMemberResult(task_id=task.id, member_id=_, status=TaskMemberResultStatusChoices.DONE)
+                for _ in (1, 2, 4)
+            ],
+            using_db=connection,
+        )
+        ledger = await TaskLedger.load(task, using_db=connection)
+        # member 1 is before the cursor, member 2 is found again after it
+        assert ledger.done_ids == {2, 4}
+        assert ledger.pending_members_ids() == [3]
+
+    in_rollback(test)
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from app.constants import TaskTypesChoices
+from app.task_planner import TasksPlan
+
+
+def make_task(task_id, task_type, roles_ids=()):
+    return SimpleNamespace(id=task_id, task_type=task_type, roles_ids=list(roles_ids))
+
+
+def test_latest_role_change_wins():
+    tasks = [
+        make_task(1, TaskTypesChoices.ASSIGN_ROLE, [10, 11]),
+        make_task(2, TaskTypesChoices.REMOVE_ROLE, [10]),
+    ]
+    plan = TasksPlan(tasks, {1: [100, 101], 2: [100]})
+    assert plan.members[100].add_roles_ids == {11}
+    assert plan.members[100].remove_roles_ids == {10}
+    assert plan.members[100].tasks_ids == [1, 2]
+    assert plan.members[101].add_roles_ids == {10, 11}
+    assert plan.calls_count == 2
+    assert plan.saved_calls_count == 3  # 2 + 2 role calls and 1 removal coalesced into 2 calls
+
+
+def test_ban_supersedes_kick_and_roles():
+    tasks = [
+        make_task(1, TaskTypesChoices.ASSIGN_ROLE, [10]),
+        make_task(2, TaskTypesChoices.KICK),
+        make_task(3, TaskTypesChoices.BAN),
+    ]
+    plan = TasksPlan(tasks, {1: [100], 2: [100, 101], 3: [100]})
+    assert plan.members[100].punishment == TaskTypesChoices.BAN
+    assert plan.members[100].tasks_ids == [3]
+    assert plan.members[100].superseded_tasks_ids == [1, 2]
+    assert not plan.members[100].add_roles_ids
+    assert plan.members[101].punishment == TaskTypesChoices.KICK
+
+
+def test_drop_unchanged():
+    tasks = [
+        make_task(1, TaskTypesChoices.ASSIGN_ROLE, [10]),
+        make_task(2, TaskTypesChoices.REMOVE_ROLE, [11]),
+    ]
+    plan = TasksPlan(tasks, {1: [100, 101, 102], 2: [100, 101, 102]})
+    unchanged = plan.drop_unchanged({100: {10}, 101: {10, 11}})
+    # member 102 roles are unknown, the plan is kept
+    assert [_.member_id for _ in unchanged] == [100]
+    assert set(plan.members) == {101, 102}
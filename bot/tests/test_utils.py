@@ -0,0 +1,36 @@
+from datetime import datetime, timezone, timedelta
+
+from app.utils import calculate_engagement_score, chunks, diff_rows
+
+
+def test_diff_rows():
+    naive = datetime(2021, 6, 1, 12)
+    stored_rows = {
+        1: {"name": "a", "joined_at": naive.replace(tzinfo=timezone.utc)},
+        2: {"name": "b", "joined_at": None},
+        3: {"name": "c", "joined_at": None},
+    }
+    fresh_rows = {
+        # discord.py gives naive UTC datetimes, the db aware ones
+        1: {"name": "a", "joined_at": naive},
+        2: {"name": "B", "joined_at": naive.replace(tzinfo=timezone(timedelta(hours=2)))},
+        4: {"name": "d", "joined_at": None},
+    }
+    to_create, to_update, to_delete = diff_rows(stored_rows, fresh_rows)
+    assert to_create == {4: fresh_rows[4]}
+    assert to_update == {2: fresh_rows[2]}
+    assert to_delete == [3]
+
+
+def test_diff_rows_keeps_only_changed_fields():
+    _, to_update, _ = diff_rows({1: {"name": "a", "roles_ids": [1, 2]}}, {1: {"name": "a", "roles_ids": [1]}})
+    assert to_update == {1: {"roles_ids": [1]}}
+
+
+def test_calculate_engagement_score():
+    thresholds = (1, 11, 21, 31, 51)
+    assert [calculate_engagement_score(_, thresholds) for _ in (0, 1, 10, 11, 50, 51, 1000)] == [0, 1, 1, 2, 4, 5, 5]
+
+
+def test_chunks():
+    assert list(chunks([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]